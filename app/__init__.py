@@ -1,13 +1,16 @@
-from flask import Flask
+from flask import Flask, abort, request
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_mail import Mail
 from datetime import datetime, timezone
 import os
+import posixpath
 import logging
 from logging.handlers import RotatingFileHandler
 
-db = SQLAlchemy()
+from .replica import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 mail = Mail()
 
@@ -27,7 +30,23 @@ def create_app():
         SECRET_KEY=os.environ.get('SECRET_KEY') or 'dev-fallback-change-in-production',
         SQLALCHEMY_DATABASE_URI=os.environ.get('DATABASE_URL') or 'sqlite:///puzzle_site.db',
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # Optional read replica for reports and exports (see app/replica.py)
+        SQLALCHEMY_BINDS=(
+            {'replica': os.environ['DATABASE_REPLICA_URL']}
+            if os.environ.get('DATABASE_REPLICA_URL') else {}
+        ),
+        REPLICA_MAX_LAG_SECONDS=int(os.environ.get('REPLICA_MAX_LAG_SECONDS', 30)),
+        REPLICA_CHECK_INTERVAL_SECONDS=int(os.environ.get('REPLICA_CHECK_INTERVAL_SECONDS', 10)),
         MAX_CONTENT_LENGTH=int(os.environ.get('MAX_UPLOAD_SIZE_MB', 20)) * 1024 * 1024,
+        # Issue PDF downloads: 'direct', 'x-accel-redirect' (nginx) or
+        # 'x-sendfile' (see app/pdf_delivery.py)
+        PDF_DELIVERY=os.environ.get('PDF_DELIVERY', 'direct'),
+        PDF_ACCEL_REDIRECT_PREFIX=os.environ.get('PDF_ACCEL_REDIRECT_PREFIX', '/protected-pdfs/'),
+        PDF_CACHE_MAX_AGE_SECONDS=int(os.environ.get('PDF_CACHE_MAX_AGE_SECONDS', 3600)),
+        # Uploaded PDFs no issue refers to are deleted once this old, checked
+        # by the background worker every PDF_SWEEP_INTERVAL_SECONDS
+        PDF_ORPHAN_GRACE_HOURS=int(os.environ.get('PDF_ORPHAN_GRACE_HOURS', 24)),
+        PDF_SWEEP_INTERVAL_SECONDS=int(os.environ.get('PDF_SWEEP_INTERVAL_SECONDS', 6 * 3600)),
         # Security settings
         WTF_CSRF_ENABLED=True,
         WTF_CSRF_TIME_LIMIT=None,
@@ -35,6 +54,9 @@ def create_app():
         REMEMBER_COOKIE_SECURE=False,
         SESSION_COOKIE_HTTPONLY=True,
         SESSION_COOKIE_SAMESITE='Lax',
+        # Public host name and scheme for links in emails built outside a request
+        SERVER_NAME=os.environ.get('SERVER_NAME') or None,
+        PREFERRED_URL_SCHEME=os.environ.get('PREFERRED_URL_SCHEME', 'http'),
         # Email configuration
         MAIL_SERVER=os.environ.get('MAIL_SERVER') or 'smtp.gmail.com',
         MAIL_PORT=int(os.environ.get('MAIL_PORT') or 587),
@@ -42,11 +64,70 @@ def create_app():
         MAIL_USERNAME=os.environ.get('MAIL_USERNAME'),
         MAIL_PASSWORD=os.environ.get('MAIL_PASSWORD'),
         MAIL_DEFAULT_SENDER=os.environ.get('MAIL_DEFAULT_SENDER'),
+        MAIL_MAX_EMAILS=int(os.environ['MAIL_MAX_EMAILS']) if os.environ.get('MAIL_MAX_EMAILS') else None,
         PUZZLE_SITE_ADMIN=os.environ.get('PUZZLE_SITE_ADMIN') or 'admin@example.com',
         MAIL_PROVIDER=os.environ.get('MAIL_PROVIDER', 'smtp'),  # 'smtp' or 'sendgrid'
         SENDGRID_API_KEY=os.environ.get('SENDGRID_API_KEY'),
+        SENDGRID_API_URL=os.environ.get('SENDGRID_API_URL') or 'https://api.sendgrid.com/v3/mail/send',
+        # Fan-out recipients per SendGrid request (the API allows 1000)
+        SENDGRID_BATCH_SIZE=int(os.environ.get('SENDGRID_BATCH_SIZE', 1000)),
+        # Background worker (worker.py): how often it checks the job tables,
+        # and how long a claimed job stays leased without a heartbeat
+        WORKER_POLL_SECONDS=int(os.environ.get('WORKER_POLL_SECONDS', 5)),
+        WORKER_LEASE_SECONDS=int(os.environ.get('WORKER_LEASE_SECONDS', 60)),
+        # Release announcements: longest the scheduler sleeps between passes,
+        # and how late a missed release may still be announced
+        SCHEDULER_MAX_SLEEP_SECONDS=int(os.environ.get('SCHEDULER_MAX_SLEEP_SECONDS', 600)),
+        NOTIFICATION_MAX_LATENESS_HOURS=int(os.environ.get('NOTIFICATION_MAX_LATENESS_HOURS', 24)),
+        # UTC hour at which daily notification digests are sent
+        DIGEST_DAILY_HOUR=int(os.environ.get('DIGEST_DAILY_HOUR', 8)),
+        # Outbound email sender pool (sends per second are per worker process)
+        EMAIL_WORKERS=int(os.environ.get('EMAIL_WORKERS', 4)),
+        # Priority lanes: senders bulk mail may occupy (default all but one),
+        # transactional rows claimed per bulk row, and how often idle
+        # senders look for transactional mail
+        EMAIL_BULK_SENDERS=int(os.environ['EMAIL_BULK_SENDERS']) if os.environ.get('EMAIL_BULK_SENDERS') else None,
+        EMAIL_TRANSACTIONAL_WEIGHT=int(os.environ.get('EMAIL_TRANSACTIONAL_WEIGHT', 10)),
+        EMAIL_TRANSACTIONAL_POLL_SECONDS=int(os.environ.get('EMAIL_TRANSACTIONAL_POLL_SECONDS', 2)),
+        # Durable outbox: polling, leases, retries with backoff, retention of sent rows
+        EMAIL_POLL_SECONDS=int(os.environ.get('EMAIL_POLL_SECONDS', 10)),
+        EMAIL_LEASE_SECONDS=int(os.environ.get('EMAIL_LEASE_SECONDS', 300)),
+        EMAIL_MAX_ATTEMPTS=int(os.environ.get('EMAIL_MAX_ATTEMPTS', 8)),
+        EMAIL_RETRY_BASE_SECONDS=int(os.environ.get('EMAIL_RETRY_BASE_SECONDS', 60)),
+        EMAIL_OUTBOX_RETENTION_HOURS=int(os.environ.get('EMAIL_OUTBOX_RETENTION_HOURS', 72)),
+        SMTP_SEND_RATE_PER_SECOND=float(os.environ.get('SMTP_SEND_RATE_PER_SECOND', 10)),
+        SENDGRID_SEND_RATE_PER_SECOND=float(os.environ.get('SENDGRID_SEND_RATE_PER_SECOND', 50)),
         # Logging
         LOG_LEVEL=os.environ.get('LOG_LEVEL', 'INFO'),
+        # Per-worker cache of the logged-in user's identity
+        USER_CACHE_TTL_SECONDS=int(os.environ.get('USER_CACHE_TTL_SECONDS', 30)),
+        USER_CACHE_MAX_SIZE=int(os.environ.get('USER_CACHE_MAX_SIZE', 1024)),
+        # Seconds before a worker reloads the hint unlock schedule
+        HINT_SCHEDULE_MAX_AGE_SECONDS=int(os.environ.get('HINT_SCHEDULE_MAX_AGE_SECONDS', 300)),
+        # Seconds before a worker reloads its cached issue pages
+        ISSUE_CACHE_MAX_AGE_SECONDS=int(os.environ.get('ISSUE_CACHE_MAX_AGE_SECONDS', 60)),
+        # Release preparation: how long before an issue's release the caches
+        # are warmed, and the waves its notification emails go out in
+        # (recipients per wave, 0 for all at once, and seconds between waves)
+        RELEASE_WARMUP_SECONDS=int(os.environ.get('RELEASE_WARMUP_SECONDS', 300)),
+        RELEASE_WAVE_SIZE=int(os.environ.get('RELEASE_WAVE_SIZE', 0)),
+        RELEASE_WAVE_SECONDS=int(os.environ.get('RELEASE_WAVE_SECONDS', 60)),
+        # How often the scheduler reconciles the materialized reporting stats
+        STATS_RECONCILE_INTERVAL_SECONDS=int(os.environ.get('STATS_RECONCILE_INTERVAL_SECONDS', 3600)),
+        # Admin report result cache
+        REPORT_CACHE_TTL_SECONDS=int(os.environ.get('REPORT_CACHE_TTL_SECONDS', 60)),
+        REPORT_CACHE_MAX_ENTRIES=int(os.environ.get('REPORT_CACHE_MAX_ENTRIES', 256)),
+        # Largest user report kept in the cache; bigger ones are streamed
+        REPORT_CACHE_MAX_ROWS=int(os.environ.get('REPORT_CACHE_MAX_ROWS', 5000)),
+        # Background report exports
+        EXPORT_FOLDER=os.environ.get('EXPORT_FOLDER'),
+        EXPORT_RETENTION_HOURS=int(os.environ.get('EXPORT_RETENTION_HOURS', 24)),
+        EXPORT_POLL_SECONDS=int(os.environ.get('EXPORT_POLL_SECONDS', 5)),
+        # Seconds before a worker rebuilds the leaderboard rank index from scratch
+        LEADERBOARD_MAX_AGE_SECONDS=int(os.environ.get('LEADERBOARD_MAX_AGE_SECONDS', 3600)),
+        # Difficulty ratings: UTC hour of the nightly refit, per-submission update size
+        RATINGS_REFIT_HOUR=int(os.environ.get('RATINGS_REFIT_HOUR', 4)),
+        RATING_UPDATE_STEP=float(os.environ.get('RATING_UPDATE_STEP', 0.1)),
     )
 
     app.config['PDF_UPLOAD_FOLDER'] = (
@@ -59,11 +140,27 @@ def create_app():
     login_manager.login_view = 'auth.login'
     mail.init_app(app)
 
+    from .replica import replica
+    replica.init_app(app)
+
+    from .user_cache import user_cache
+    user_cache.init_app(app)
+
+    from .hint_schedule import hint_schedule
+    hint_schedule.init_app(app)
+
+    from .issue_cache import issue_cache
+    issue_cache.init_app(app)
+
+    from .report_cache import report_cache
+    report_cache.init_app(app)
+
+    from .leaderboard import leaderboard
+    leaderboard.init_app(app)
 
     @login_manager.user_loader
     def load_user(user_id):
-        from .models import User
-        return User.query.get(int(user_id))
+        return user_cache.load(int(user_id))
 
     from .models import User, Issue, Puzzle, Submission
     @app.shell_context_processor
@@ -96,17 +193,35 @@ def create_app():
     from .errors import register_error_handlers
     register_error_handlers(app)
 
-    # Initialize email scheduler
+    # Background work: the email sender pool, recurring jobs and report
+    # exports. Only worker.py (or the development server) starts them;
+    # web processes just queue work for them.
+    from .email import email_dispatcher
+    email_dispatcher.init_app(app)
+
     from .scheduler import scheduler
     scheduler.init_app(app)
-    
-    # Start scheduler in development (not recommended for production)
-    if app.config.get('ENV') != 'production':
-        scheduler.start()
-    
+
+    from .exports import export_worker
+    export_worker.init_app(app)
+
     # Configure logging for production
     configure_logging(app)
     
+    # Issue PDFs are only served by puzzle.issue_pdf, which checks the
+    # release date; the static route would hand them out to anyone
+    @app.before_request
+    def hide_static_pdfs():
+        if request.endpoint == 'static':
+            filename = posixpath.normpath((request.view_args or {}).get('filename', ''))
+            if filename.split('/')[0].lower() == 'pdfs':
+                abort(404)
+
+    # Load issues released in the next few minutes before their visitors arrive
+    @app.before_request
+    def warm_release_caches():
+        issue_cache.warm_upcoming()
+
     # Add security headers
     @app.after_request
     def security_headers(response):
@@ -0,0 +1,328 @@
+"""
+Vectorized submission analytics for the admin reports.
+
+Submissions are fetched in a single query as compact NumPy arrays (user id,
+puzzle id, submission time in epoch seconds and correctness) and kept per
+worker, so later reads only fetch rows added since. Every report below is
+computed from them with array operations: first solves are found with a
+lexsort, per-puzzle percentiles are interpolated from group offsets, and
+histograms and cumulative curves use bincount/cumsum. No step loops over
+individual submissions in Python.
+"""
+import threading
+from collections import namedtuple
+from datetime import datetime, time as dt_time, timezone
+from itertools import chain
+
+import numpy as np
+from sqlalchemy import Integer, case, cast, func, select
+
+from . import db
+from .models import Hint, Issue, Puzzle, Submission
+from .replica import replica_reads
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Hours after an issue's release covered by the solves-per-hour histogram
+RELEASE_WINDOW_HOURS = 72
+
+# Window either side of a hint unlock used to compare solve rates
+HINT_WINDOW_SECONDS = DAY
+
+# Upper edges (seconds) of the time-to-first-solve distribution buckets
+TIME_TO_SOLVE_BUCKETS = (
+    ('Under 1 hour', HOUR),
+    ('1-6 hours', 6 * HOUR),
+    ('6-24 hours', DAY),
+    ('1-3 days', 3 * DAY),
+    ('3-7 days', 7 * DAY),
+    ('Over 7 days', None),
+)
+
+SubmissionArrays = namedtuple('SubmissionArrays', ['user_id', 'puzzle_id', 'submitted_at', 'is_correct'])
+FirstSolves = namedtuple('FirstSolves', ['user_id', 'puzzle_id', 'solved_at'])
+
+
+def _epoch_seconds(column):
+    """SQL expression converting a UTC timestamp column to integer epoch seconds"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return cast(func.strftime('%s', column), Integer)
+    if dialect in ('mysql', 'mariadb'):
+        return cast(func.unix_timestamp(column), Integer)
+    return cast(func.extract('epoch', column), Integer)
+
+
+def _to_epoch(value):
+    """Epoch seconds for a date or datetime, treating naive values as UTC"""
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, dt_time.min)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def load_submission_arrays(after_id=0):
+    """Fetch submissions with id > after_id as NumPy arrays in one query
+
+    Returns (ids, SubmissionArrays), ordered by id.
+    """
+    query = (
+        select(
+            Submission.id,
+            Submission.user_id,
+            Submission.puzzle_id,
+            _epoch_seconds(Submission.submitted_at),
+            case((Submission.is_correct == True, 1), else_=0),
+        )
+        .where(Submission.id > after_id, Submission.submitted_at.isnot(None))
+        .order_by(Submission.id.asc())
+    )
+
+    # Core rows skip ORM processing, which dominates at millions of rows
+    result = db.session.connection().execute(query)
+    columns = np.fromiter(chain.from_iterable(result), dtype=np.int64).reshape(-1, 5)
+    return columns[:, 0].copy(), SubmissionArrays(
+        user_id=columns[:, 1].astype(np.int32),
+        puzzle_id=columns[:, 2].astype(np.int32),
+        submitted_at=columns[:, 3].copy(),
+        is_correct=columns[:, 4].astype(bool),
+    )
+
+
+class SubmissionArrayCache:
+    """Per-worker copy of the submission arrays, extended with new rows on each read.
+
+    Submissions are append-only apart from puzzle and user deletion, so each
+    read only fetches rows above the highest id already held. A row count
+    that no longer adds up (something was deleted) triggers a full reload.
+    """
+
+    def __init__(self):
+        self._ids = np.array([], dtype=np.int64)
+        self._arrays = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Drop the cached arrays so the next read reloads everything"""
+        with self._lock:
+            self._ids = np.array([], dtype=np.int64)
+            self._arrays = None
+
+    def get(self, puzzle_ids=None):
+        """Current submission arrays, optionally restricted to some puzzles"""
+        with self._lock:
+            total, max_id = db.session.execute(
+                select(func.count(Submission.id), func.max(Submission.id))
+                .where(Submission.submitted_at.isnot(None))
+            ).one()
+            max_id = max_id or 0
+
+            cached_max = int(self._ids[-1]) if len(self._ids) else 0
+            if self._arrays is None or cached_max > max_id:
+                self._ids, self._arrays = load_submission_arrays()
+            elif cached_max < max_id:
+                new_ids, new_arrays = load_submission_arrays(after_id=cached_max)
+                self._ids = np.concatenate((self._ids, new_ids))
+                self._arrays = SubmissionArrays(*(
+                    np.concatenate((old, new)) for old, new in zip(self._arrays, new_arrays)
+                ))
+
+            if len(self._ids) != total:
+                self._ids, self._arrays = load_submission_arrays()
+            arrays = self._arrays
+
+        if puzzle_ids is None:
+            return arrays
+        keep = np.isin(arrays.puzzle_id, np.asarray(list(puzzle_ids), dtype=np.int32))
+        return SubmissionArrays(*(column[keep] for column in arrays))
+
+
+def first_solves(arrays):
+    """Earliest correct submission for each (user, puzzle) pair"""
+    correct = arrays.is_correct
+    users = arrays.user_id[correct]
+    puzzles = arrays.puzzle_id[correct]
+    times = arrays.submitted_at[correct]
+
+    order = np.lexsort((times, puzzles, users))
+    users, puzzles, times = users[order], puzzles[order], times[order]
+
+    first = np.ones(len(users), dtype=bool)
+    first[1:] = (users[1:] != users[:-1]) | (puzzles[1:] != puzzles[:-1])
+    return FirstSolves(users[first], puzzles[first], times[first])
+
+
+def load_release_times():
+    """Sorted puzzle ids and their release times (issue date, else creation time)"""
+    rows = (
+        db.session.query(Puzzle.id, Issue.available_date, Puzzle.created_at)
+        .outerjoin(Issue, Issue.id == Puzzle.issue_id)
+        .order_by(Puzzle.id.asc())
+        .all()
+    )
+    puzzle_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    released_at = np.array(
+        [_to_epoch(row[1] or row[2] or datetime.now(timezone.utc)) for row in rows],
+        dtype=np.int64,
+    )
+    return puzzle_ids, released_at
+
+
+def _lookup(keys, values, wanted):
+    """Vectorized dict lookup of wanted in sorted keys; returns (values, found mask)"""
+    if len(keys) == 0:
+        return np.zeros(len(wanted), dtype=values.dtype), np.zeros(len(wanted), dtype=bool)
+    index = np.clip(np.searchsorted(keys, wanted), 0, len(keys) - 1)
+    return values[index], keys[index] == wanted
+
+
+def time_to_first_solve(solves, release_ids, released_at):
+    """Seconds from each puzzle's release to each first solve, with the puzzle ids"""
+    release, found = _lookup(release_ids, released_at, solves.puzzle_id)
+    elapsed = np.maximum(solves.solved_at[found] - release[found], 0)
+    return solves.puzzle_id[found], elapsed
+
+
+def grouped_percentiles(groups, values, quantiles):
+    """Per-group linear-interpolated percentiles without a Python loop per group
+
+    Returns (group keys, counts, array of shape (len(keys), len(quantiles))).
+    """
+    if len(values) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.zeros((0, len(quantiles)))
+
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order].astype(np.float64)
+    keys, starts, counts = np.unique(groups, return_index=True, return_counts=True)
+
+    position = starts[:, None] + np.asarray(quantiles)[None, :] * (counts[:, None] - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    result = values[lower] + (values[upper] - values[lower]) * (position - lower)
+    return keys, counts, result
+
+
+def solves_per_hour(elapsed, hours=RELEASE_WINDOW_HOURS):
+    """Histogram of first solves by whole hours since release, plus the overflow count"""
+    buckets = np.bincount(elapsed // HOUR, minlength=hours)
+    return buckets[:hours], int(buckets[hours:].sum())
+
+
+def time_to_solve_distribution(elapsed):
+    """Counts of first solves in each TIME_TO_SOLVE_BUCKETS range"""
+    edges = np.array([edge for _, edge in TIME_TO_SOLVE_BUCKETS[:-1]], dtype=np.int64)
+    counts = np.bincount(np.searchsorted(edges, elapsed, side='right'), minlength=len(TIME_TO_SOLVE_BUCKETS))
+    return [
+        {'label': label, 'solves': int(count)}
+        for (label, _), count in zip(TIME_TO_SOLVE_BUCKETS, counts)
+    ]
+
+
+def hint_solve_counts(solves, hint_puzzle_ids, hint_unlocks, window=HINT_WINDOW_SECONDS):
+    """First solves of each hint's puzzle in the window before and after it unlocks"""
+    if len(hint_unlocks) == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty
+
+    # Pack (puzzle, time) into one sortable key so every window becomes a
+    # pair of binary searches over a single sorted array.
+    origin = min(int(solves.solved_at.min()) if len(solves.solved_at) else 0, int(hint_unlocks.min()) - window)
+    span = np.int64(1) << 32
+    keys = np.sort(solves.puzzle_id * span + (solves.solved_at - origin))
+
+    def _bound(puzzle_ids, times):
+        return np.searchsorted(keys, puzzle_ids * span + np.clip(times - origin, 0, span - 1))
+
+    at_unlock = _bound(hint_puzzle_ids, hint_unlocks)
+    before = at_unlock - _bound(hint_puzzle_ids, hint_unlocks - window)
+    after = _bound(hint_puzzle_ids, hint_unlocks + window) - at_unlock
+    return before, after
+
+
+def _hours(seconds):
+    return float(seconds) / HOUR
+
+
+@replica_reads
+def compute_issue_analytics(issue_id=None):
+    """Build the analytics report for one issue, or for every puzzle"""
+    puzzle_query = db.session.query(Puzzle.id, Puzzle.title)
+    if issue_id is not None:
+        puzzle_query = puzzle_query.filter(Puzzle.issue_id == issue_id)
+    puzzle_titles = dict(puzzle_query.all())
+    if not puzzle_titles:
+        return None
+
+    arrays = submission_arrays.get(puzzle_titles if issue_id is not None else None)
+    solves = first_solves(arrays)
+    release_ids, released_at = load_release_times()
+    solve_puzzle_ids, elapsed = time_to_first_solve(solves, release_ids, released_at)
+
+    keys, counts, percentiles = grouped_percentiles(solve_puzzle_ids, elapsed, (0.5, 0.9))
+    attempt_keys, attempt_counts = np.unique(arrays.puzzle_id, return_counts=True)
+    puzzle_ids = np.array(sorted(puzzle_titles), dtype=np.int64)
+    solvers, solved = _lookup(keys, counts, puzzle_ids)
+    attempts, attempted = _lookup(attempt_keys, attempt_counts, puzzle_ids)
+    index = np.clip(np.searchsorted(keys, puzzle_ids), 0, max(len(keys) - 1, 0))
+
+    puzzle_rows = [
+        {
+            'puzzle_id': int(puzzle_id),
+            'puzzle_title': puzzle_titles[int(puzzle_id)],
+            'solvers': int(solver_count) if has_solves else 0,
+            'attempts': int(attempt_count) if has_attempts else 0,
+            'p50_hours': _hours(percentiles[position, 0]) if has_solves else None,
+            'p90_hours': _hours(percentiles[position, 1]) if has_solves else None,
+        }
+        for puzzle_id, solver_count, has_solves, attempt_count, has_attempts, position
+        in zip(puzzle_ids, solvers, solved, attempts, attempted, index)
+    ]
+    puzzle_rows.sort(key=lambda row: (row['p50_hours'] is None, row['p50_hours'] or 0, row['puzzle_title'].lower()))
+
+    hourly, later = solves_per_hour(elapsed)
+    cumulative = np.cumsum(hourly)
+    hourly_rows = [
+        {'hour': hour, 'solves': int(count), 'cumulative': int(total)}
+        for hour, (count, total) in enumerate(zip(hourly, cumulative))
+    ]
+
+    hint_query = db.session.query(Hint.id, Hint.puzzle_id, Hint.unlock_date).order_by(Hint.unlock_date.asc(), Hint.id.asc())
+    if issue_id is not None:
+        hint_query = hint_query.filter(Hint.puzzle_id.in_(list(puzzle_titles)))
+    hints = hint_query.all()
+    hint_puzzle_ids = np.array([row[1] for row in hints], dtype=np.int64)
+    hint_unlocks = np.array([_to_epoch(row[2]) for row in hints], dtype=np.int64)
+    before, after = hint_solve_counts(solves, hint_puzzle_ids, hint_unlocks)
+    hint_rows = [
+        {
+            'hint_id': row[0],
+            'puzzle_id': row[1],
+            'puzzle_title': puzzle_titles.get(row[1], f'Puzzle {row[1]}'),
+            'unlock_date': row[2],
+            'solves_before': int(solves_before),
+            'solves_after': int(solves_after),
+        }
+        for row, solves_before, solves_after in zip(hints, before, after)
+    ]
+
+    overall = np.percentile(elapsed, (50, 90)) if len(elapsed) else (0, 0)
+    return {
+        'submission_count': int(len(arrays.user_id)),
+        'solve_count': int(len(elapsed)),
+        'p50_hours': _hours(overall[0]),
+        'p90_hours': _hours(overall[1]),
+        'puzzle_rows': puzzle_rows,
+        'hourly_rows': hourly_rows,
+        'hourly_peak': int(hourly.max()) if len(hourly) else 0,
+        'solves_after_window': later,
+        'distribution': time_to_solve_distribution(elapsed),
+        'hint_rows': hint_rows,
+        'window_hours': RELEASE_WINDOW_HOURS,
+        'hint_window_hours': HINT_WINDOW_SECONDS // HOUR,
+    }
+
+
+# Global submission array cache (one per worker process)
+submission_arrays = SubmissionArrayCache()
@@ -5,6 +5,7 @@ from .models import User
 from . import db
 from .forms import RegisterForm, LoginForm, RequestPasswordResetForm, ResetPasswordForm, UserPreferencesForm
 from .email import send_welcome_email, send_password_reset_email
+from .user_cache import user_cache
 
 auth = Blueprint('auth', __name__)
 
@@ -94,6 +95,7 @@ def reset_password(token):
     if form.validate_on_submit():
         user.password_hash = generate_password_hash(form.password.data)
         db.session.commit()
+        user_cache.invalidate(user.id)
         flash('Your password has been reset successfully.')
         return redirect(url_for('auth.login'))
     return render_template('reset_password.html', form=form)
@@ -101,16 +103,20 @@ def reset_password(token):
 @auth.route('/preferences', methods=['GET', 'POST'])
 @login_required
 def preferences():
-    form = UserPreferencesForm(obj=current_user)
+    # current_user is a cached snapshot; edit the real row
+    user = User.query.get_or_404(current_user.id)
+    form = UserPreferencesForm(obj=user)
     
     if form.validate_on_submit():
-        current_user.display_name = form.display_name.data
-        current_user.email_notifications = form.email_notifications.data
-        current_user.notify_new_issues = form.notify_new_issues.data
-        current_user.notify_new_hints = form.notify_new_hints.data
+        user.display_name = form.display_name.data
+        user.email_notifications = form.email_notifications.data
+        user.notify_new_issues = form.notify_new_issues.data
+        user.notify_new_hints = form.notify_new_hints.data
+        user.digest_frequency = form.digest_frequency.data
         
         db.session.commit()
+        user_cache.invalidate(user.id)
         flash('Your preferences have been updated successfully.')
         return redirect(url_for('auth.preferences'))
     
-    return render_template('user_preferences.html', form=form)
+    return render_template('user_preferences.html', form=form, user=user)
@@ -1,59 +1,783 @@
-from threading import Thread
+"""
+Outbound email.
+
+Messages are rendered by the caller and written to the email_outbox table
+in the caller's transaction, so a notification is stored exactly when the
+change that triggered it commits. Fan-out notifications render their
+template once into an EmailSkeleton and fill each recipient's slots by
+escaped string substitution; the skeleton is kept as an EmailBatch so
+SendGrid can send the whole fan-out as a few multi-recipient requests. A
+bounded pool of EMAIL_WORKERS sender threads drains the outbox: each claims
+a batch of due rows under a lease, sends them over one provider session (a
+persistent SMTP connection, re-opened when the server drops it, or a
+keep-alive connection to the SendGrid API), spaced to the provider's
+configured rate, and records the outcome per row. Users who chose an
+hourly or daily digest get no fan-out email; their notifications are held
+as PendingNotification rows and the scheduler sends each of them one
+digest when their window closes.
+Transient failures retry with exponential backoff; permanent rejections
+and messages out of attempts move to the dead-letter state for an admin to
+retry or discard. Leases left by a crashed or recycled worker expire and
+the rows are sent again. The pool runs in the background worker processes
+(worker.py); web processes only write to the outbox.
+
+Every message is in one of two priority lanes: transactional mail (password
+resets, welcome emails) or bulk mail (release fan-outs, digests). Senders
+pick the next lane to claim from by weighted-fair scheduling, bulk mail may
+occupy at most EMAIL_BULK_SENDERS of the pool's threads, and idle senders
+look for transactional mail every EMAIL_TRANSACTIONAL_POLL_SECONDS, so a
+password reset is not stuck behind a 20k-recipient release.
+"""
+import http.client
+import json
+import os
+import random
+import re
+import smtplib
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from http.client import HTTPConnection, HTTPSConnection
+from itertools import groupby, islice
+from urllib.parse import urlsplit
+
 from flask import current_app, render_template
+from markupsafe import Markup, escape
+from flask_sqlalchemy.session import Session
+from sqlalchemy import and_, event, exists, func, literal as sa_literal, or_, select
+from sqlalchemy.orm import defer
 from flask_mail import Message
 from . import mail, db
+from .models import EmailBatch, EmailOutbox, PendingNotification
+from .utils import as_utc
+
+# Outbox rows a sender claims at a time (and rows per fan-out insert)
+SEND_CHUNK_SIZE = 100
+
+# Close a sender's connection after this long without work
+IDLE_DISCONNECT_SECONDS = 30
+
+# SMTP reply meaning the server is closing the session
+SMTP_SERVICE_CLOSING = 421
+
+# Longest wait between retries of one message
+MAX_RETRY_DELAY_SECONDS = 6 * 3600
+
+# SendGrid v3 mail send limits and the tag a recipient slot becomes
+SENDGRID_MAX_PERSONALIZATIONS = 1000
+SENDGRID_TIMEOUT_SECONDS = 30
+SENDGRID_TAG = '-recipient.{}-'
+
+# Outbound mail priority lanes, most urgent first
+LANES = ('transactional', 'bulk')
+
+# Notification frequencies that collect into a digest, with their subjects
+DIGEST_SUBJECTS = {
+    'hourly': 'Your hourly puzzle digest',
+    'daily': 'Your daily puzzle digest',
+}
 
-try:
-    from sendgrid import SendGridAPIClient
-    from sendgrid.helpers.mail import Mail as SGMail
-except Exception:
-    SendGridAPIClient = None
-    SGMail = None
-
-def send_async_email(app, msg):
-    """Send email asynchronously in background thread"""
-    with app.app_context():
-        mail.send(msg)
-
-
-def send_async_sendgrid(app, subject, to, html):
-    """Send email asynchronously via SendGrid Web API"""
-    with app.app_context():
-        api_key = app.config.get('SENDGRID_API_KEY')
-        if not api_key or SendGridAPIClient is None:
-            current_app.logger.error('SendGrid API not available or API key missing')
+OutboundEmail = namedtuple(
+    'OutboundEmail', ['to', 'subject', 'html', 'batch_id', 'substitutions'], defaults=(None, None)
+)
+
+
+class RateLimiter:
+    """Spaces calls evenly at up to rate per second across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
             return
-        client = SendGridAPIClient(api_key)
-        from_email = app.config['MAIL_DEFAULT_SENDER']
-        to_list = to if isinstance(to, list) else [to]
-        sg_msg = SGMail(
-            from_email=from_email,
-            to_emails=to_list,
-            subject=f'[Puzzle Site] {subject}',
-            html_content=html,
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _send_each(sender, rows):
+    for row in rows:
+        sender.limiter.wait()
+        error = None
+        try:
+            sender.send(row)
+        except Exception as e:
+            error = e
+        yield [row], error
+
+
+class SMTPSender:
+    """One persistent Flask-Mail connection, re-opened when it drops."""
+
+    claim_size = SEND_CHUNK_SIZE
+
+    def __init__(self, app, limiter):
+        self.app = app
+        self.limiter = limiter
+        self.connection = None
+
+    def _connect(self):
+        self.connection = mail.connect()
+        self.connection.__enter__()
+
+    def close(self):
+        if self.connection is None:
+            return
+        try:
+            self.connection.__exit__(None, None, None)
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.connection = None
+
+    def send(self, email):
+        message = Message(
+            subject=f'[Puzzle Site] {email.subject}',
+            recipients=email.to,
+            html=email.html,
+            sender=self.app.config['MAIL_DEFAULT_SENDER'],
         )
-        client.send(sg_msg)
-
-def send_email(to, subject, template, **kwargs):
-    """Send email using selected provider"""
-    app = current_app._get_current_object()
-    html = render_template(template, **kwargs)
-    provider = app.config.get('MAIL_PROVIDER', 'smtp').lower()
-
-    if provider == 'sendgrid':
-        thr = Thread(target=send_async_sendgrid, args=[app, subject, to, html])
-        thr.start()
-        return thr
-    else:
-        msg = Message(
-            subject=f'[Puzzle Site] {subject}',
-            recipients=[to] if isinstance(to, str) else to,
-            html=html,
-            sender=app.config['MAIL_DEFAULT_SENDER']
+        for attempt in range(2):
+            try:
+                if self.connection is None:
+                    self._connect()
+                self.connection.send(message)
+                return
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError) as e:
+                error = e
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code != SMTP_SERVICE_CLOSING:
+                    raise
+                error = e
+            # The connection is unusable; retry once on a fresh one
+            self.close()
+        raise error
+
+    def send_all(self, rows):
+        """Send claimed rows one message at a time, yielding ([row], error)"""
+        return _send_each(self, rows)
+
+
+class SendGridError(Exception):
+    """The SendGrid API answered with an error status."""
+
+    def __init__(self, status_code, body):
+        super().__init__(f'SendGrid API returned {status_code}: {body[:500]}')
+        self.status_code = status_code
+
+
+def sendgrid_content(batch):
+    """A batch's body with SendGrid substitution tags in its slots, or None
+    if the rendered text already contains one of the tags"""
+    literals = json.loads(batch.literals)
+    slot_names = json.loads(batch.slot_names)
+    if any(SENDGRID_TAG.format(name) in literal for name in slot_names for literal in literals):
+        return None
+    parts = [literals[0]]
+    for name, literal in zip(slot_names, literals[1:]):
+        parts.append(SENDGRID_TAG.format(name))
+        parts.append(literal)
+    return ''.join(parts)
+
+
+class SendGridSender:
+    """One keep-alive connection to the SendGrid v3 mail send API.
+
+    Claimed rows from the same fan-out batch go out together: one request
+    per SENDGRID_BATCH_SIZE recipients, each a personalization carrying the
+    recipient's address and escaped slot values as substitutions.
+    """
+
+    def __init__(self, app, limiter):
+        self.app = app
+        self.limiter = limiter
+        self.connection = None
+        self.claim_size = min(max(1, app.config.get('SENDGRID_BATCH_SIZE', SENDGRID_MAX_PERSONALIZATIONS)),
+                              SENDGRID_MAX_PERSONALIZATIONS)
+        url = urlsplit(app.config.get('SENDGRID_API_URL') or 'https://api.sendgrid.com/v3/mail/send')
+        self._connection_class = HTTPConnection if url.scheme == 'http' else HTTPSConnection
+        self._host = url.netloc
+        self._path = url.path or '/'
+        self._contents = {}
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        self._contents.clear()
+
+    def _post(self, payload):
+        api_key = self.app.config.get('SENDGRID_API_KEY')
+        if not api_key:
+            raise RuntimeError('SendGrid API key missing')
+        body = json.dumps(payload).encode('utf-8')
+        headers = {'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'}
+
+        self.limiter.wait()
+        for attempt in range(2):
+            reused = self.connection is not None
+            if not reused:
+                self.connection = self._connection_class(self._host, timeout=SENDGRID_TIMEOUT_SECONDS)
+            try:
+                self.connection.request('POST', self._path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                response_body = response.read().decode('utf-8', 'replace')
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                # The server closed an idle keep-alive connection; the request
+                # never arrived, so it is safe to send it once more
+                if reused:
+                    continue
+                raise
+            except (http.client.HTTPException, OSError):
+                self.close()
+                raise
+            if response.will_close:
+                self.close()
+            if response.status >= 300:
+                raise SendGridError(response.status, response_body)
+            return
+
+    def _message(self, subject, html, personalizations):
+        return {
+            'personalizations': personalizations,
+            'from': {'email': self.app.config['MAIL_DEFAULT_SENDER']},
+            'subject': f'[Puzzle Site] {subject}',
+            'content': [{'type': 'text/html', 'value': html}],
+        }
+
+    def send(self, email):
+        self._post(self._message(
+            email.subject, email.html, [{'to': [{'email': address} for address in email.to]}]
+        ))
+
+    def _content(self, batch_id):
+        if batch_id not in self._contents:
+            batch = db.session.get(EmailBatch, batch_id)
+            self._contents[batch_id] = sendgrid_content(batch) if batch else None
+        return self._contents[batch_id]
+
+    def _send_personalized(self, content, rows):
+        personalizations = [
+            {
+                'to': [{'email': address} for address in row.to],
+                'substitutions': {
+                    SENDGRID_TAG.format(name): str(escape(value))
+                    for name, value in json.loads(row.substitutions).items()
+                },
+            }
+            for row in rows
+        ]
+        try:
+            self._post(self._message(rows[0].subject, content, personalizations))
+        except SendGridError as e:
+            if e.status_code != 400 or len(rows) == 1:
+                yield rows, e
+                return
+            # One bad address fails the whole request; split it until the
+            # bad rows are isolated and the rest go through
+            middle = len(rows) // 2
+            yield from self._send_personalized(content, rows[:middle])
+            yield from self._send_personalized(content, rows[middle:])
+            return
+        except Exception as e:
+            yield rows, e
+            return
+        yield rows, None
+
+    def send_all(self, rows):
+        """Send claimed rows, one request per fan-out batch; yields (rows, error)"""
+        batches = {}
+        for row in rows:
+            batches.setdefault(row.batch_id if row.substitutions else None, []).append(row)
+
+        for batch_id, batch_rows in batches.items():
+            content = self._content(batch_id) if batch_id else None
+            if content is None:
+                yield from _send_each(self, batch_rows)
+                continue
+            for start in range(0, len(batch_rows), self.claim_size):
+                yield from self._send_personalized(content, batch_rows[start:start + self.claim_size])
+
+
+SENDERS = {
+    'smtp': (SMTPSender, 'SMTP_SEND_RATE_PER_SECOND'),
+    'sendgrid': (SendGridSender, 'SENDGRID_SEND_RATE_PER_SECOND'),
+}
+
+
+def retry_delay(attempts, base_seconds):
+    """Seconds before the next try after attempts failures, with jitter"""
+    delay = min(base_seconds * 2 ** (attempts - 1), MAX_RETRY_DELAY_SECONDS)
+    return delay * (0.5 + random.random() / 2)
+
+
+def is_permanent_failure(error):
+    """Whether retrying the same message can't succeed (e.g. rejected address)"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    status_code = getattr(error, 'status_code', None)
+    return isinstance(status_code, int) and 400 <= status_code < 500 and status_code != 429
+
+
+class EmailDispatcher:
+    """Bounded pool of sender threads that drain the email outbox"""
+
+    def __init__(self):
+        self.app = None
+        self.running = False
+        self.threads = []
+        self._pid = None
+        self._wake = threading.Event()
+        self._limiter = None
+        self._lock = threading.Lock()
+        self._last_housekeeping = None
+        self._budgets = {}
+        self._weights = {}
+        self._active = {}
+        self._virtual_time = {}
+        self._clock = 0.0
+
+    def init_app(self, app):
+        """Initialize the dispatcher with Flask app"""
+        self.app = app
+
+    def provider(self):
+        provider = self.app.config.get('MAIL_PROVIDER', 'smtp').lower()
+        return provider if provider in SENDERS else 'smtp'
+
+    def start(self):
+        """Start the sender threads in this process if they aren't running"""
+        if self.running and self._pid == os.getpid():
+            return
+        with self._lock:
+            # Threads don't survive a fork, so a preloaded app starts its own
+            if (self.running and self._pid == os.getpid()) or not self.app:
+                return
+            _, rate_setting = SENDERS[self.provider()]
+            # Shared by this process's senders: messages (SMTP) or requests (SendGrid)
+            self._limiter = RateLimiter(self.app.config.get(rate_setting, 0))
+            workers = max(1, self.app.config.get('EMAIL_WORKERS', 4))
+            bulk_senders = self.app.config.get('EMAIL_BULK_SENDERS') or workers - 1
+            self._budgets = {'transactional': workers, 'bulk': min(workers, max(1, bulk_senders))}
+            self._weights = {
+                'transactional': max(1, self.app.config.get('EMAIL_TRANSACTIONAL_WEIGHT', 10)),
+                'bulk': 1,
+            }
+            self._active = dict.fromkeys(LANES, 0)
+            self._virtual_time = dict.fromkeys(LANES, 0.0)
+            self._clock = 0.0
+            self._pid = os.getpid()
+            self.running = True
+            self.threads = [
+                threading.Thread(target=self._run_sender, daemon=True)
+                for _ in range(workers)
+            ]
+            for thread in self.threads:
+                thread.start()
+
+    def stop(self):
+        """Stop the sender threads once they finish their current batch"""
+        self.running = False
+        self._wake.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def wake(self):
+        """Ask this process's senders, if it has any, to look for newly queued mail now"""
+        self._wake.set()
+
+    def _run_sender(self):
+        """Sender loop - runs in each pool thread"""
+        poll_seconds = self.app.config.get('EMAIL_POLL_SECONDS', 10)
+        # Idle senders check often enough for transactional mail queued by
+        # the web processes, which can't wake them
+        idle_seconds = min(poll_seconds, self.app.config.get('EMAIL_TRANSACTIONAL_POLL_SECONDS', 2))
+        sender_class, _ = SENDERS[self.provider()]
+        last_send = time.monotonic()
+        with self.app.app_context():
+            sender = sender_class(self.app, self._limiter)
+            while self.running:
+                claimed = 0
+                try:
+                    # Claimed rows are leased to this thread, so keep them
+                    # loaded across the commit after each send
+                    db.session().expire_on_commit = False
+                    self._housekeeping(poll_seconds)
+                    for lane in self._lanes_by_turn():
+                        if not self._enter_lane(lane):
+                            continue
+                        try:
+                            batch = self.claim_batch(sender.claim_size, lane)
+                            claimed = len(batch)
+                            if claimed:
+                                self._charge(lane, claimed)
+                            for rows, error in sender.send_all(batch):
+                                self.record(rows, error)
+                        finally:
+                            self._leave_lane(lane)
+                        if claimed:
+                            break
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Email sender error: {e}")
+                finally:
+                    db.session.remove()
+
+                if claimed:
+                    last_send = time.monotonic()
+                    continue
+                if time.monotonic() - last_send > IDLE_DISCONNECT_SECONDS:
+                    sender.close()
+                self._wake.wait(idle_seconds)
+                self._wake.clear()
+            sender.close()
+
+    def _lanes_by_turn(self):
+        """Lanes in the order this sender should try them: least served for its weight first"""
+        with self._lock:
+            return sorted(LANES, key=lambda lane: (self._virtual_time[lane], LANES.index(lane)))
+
+    def _enter_lane(self, lane):
+        """Take one of the lane's sender slots; False when its budget is used up"""
+        with self._lock:
+            if self._active[lane] >= self._budgets[lane]:
+                return False
+            self._active[lane] += 1
+            return True
+
+    def _leave_lane(self, lane):
+        with self._lock:
+            self._active[lane] -= 1
+
+    def _charge(self, lane, count):
+        """Advance a lane's virtual time by the rows it claimed, scaled by its weight"""
+        with self._lock:
+            # The clock is where the latest batch started; a lane that sat
+            # idle restarts from it rather than banking credit to starve the
+            # others later
+            start = max(self._virtual_time[lane], self._clock)
+            self._clock = start
+            self._virtual_time[lane] = start + count / self._weights[lane]
+
+    def claim_batch(self, limit=SEND_CHUNK_SIZE, lane=None):
+        """Lease up to limit due messages (from one lane, if given) to this thread"""
+        now = datetime.now(timezone.utc)
+        conditions = [EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now]
+        if lane is not None:
+            conditions.append(EmailOutbox.priority == lane)
+        due_ids = db.session.execute(
+            select(EmailOutbox.id)
+            .where(*conditions)
+            .order_by(EmailOutbox.next_attempt_at.asc(), EmailOutbox.id.asc())
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not due_ids:
+            db.session.commit()
+            return []
+
+        # Another sender may take some of the same rows first; the token
+        # identifies the ones this claim actually got.
+        token = uuid.uuid4().hex
+        lease = timedelta(seconds=self.app.config.get('EMAIL_LEASE_SECONDS', 300))
+        EmailOutbox.query.filter(
+            EmailOutbox.id.in_(due_ids),
+            EmailOutbox.status == 'pending',
+        ).update(
+            {'status': 'sending', 'lease_token': token, 'lease_expires_at': now + lease},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        return EmailOutbox.query.filter_by(lease_token=token).order_by(EmailOutbox.id.asc()).all()
+
+    def record(self, rows, error):
+        """Record the outcome of one send attempt for its rows"""
+        now = datetime.now(timezone.utc)
+        max_attempts = self.app.config.get('EMAIL_MAX_ATTEMPTS', 8)
+        given_up = 0
+        for row in rows:
+            row.attempts += 1
+            row.lease_token = None
+            row.lease_expires_at = None
+            if error is None:
+                row.status = 'sent'
+                row.sent_at = now
+                row.last_error = None
+                row.queue_seconds = max(0.0, (now - as_utc(row.next_attempt_at)).total_seconds())
+            elif is_permanent_failure(error) or row.attempts >= max_attempts:
+                row.status = 'dead'
+                row.last_error = str(error)[:2000]
+                given_up += 1
+            else:
+                row.status = 'pending'
+                row.last_error = str(error)[:2000]
+                row.next_attempt_at = now + timedelta(
+                    seconds=retry_delay(row.attempts, self.app.config.get('EMAIL_RETRY_BASE_SECONDS', 60))
+                )
+        if given_up:
+            print(f"Gave up on {given_up} email(s) '{rows[0].subject}' (first id {rows[0].id}): {error}")
+        db.session.commit()
+
+    def _housekeeping(self, interval):
+        """Requeue expired leases and drop old sent mail, once per interval per process"""
+        with self._lock:
+            now = time.monotonic()
+            if self._last_housekeeping is not None and now - self._last_housekeeping < interval:
+                return
+            self._last_housekeeping = now
+
+        now = datetime.now(timezone.utc)
+        EmailOutbox.query.filter(
+            EmailOutbox.status == 'sending',
+            EmailOutbox.lease_expires_at < now,
+        ).update(
+            {'status': 'pending', 'lease_token': None, 'lease_expires_at': None, 'next_attempt_at': now},
+            synchronize_session=False,
+        )
+        retention = timedelta(hours=self.app.config.get('EMAIL_OUTBOX_RETENTION_HOURS', 72))
+        EmailOutbox.query.filter(
+            EmailOutbox.status == 'sent',
+            EmailOutbox.sent_at < now - retention,
+        ).delete(synchronize_session=False)
+        EmailBatch.query.filter(
+            ~exists().where(EmailOutbox.batch_id == EmailBatch.id)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+
+# Global email dispatcher instance
+email_dispatcher = EmailDispatcher()
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_senders(session):
+    if session.info.pop('email_queued', False):
+        email_dispatcher.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_queued(session):
+    session.info.pop('email_queued', None)
+
+
+def render_email(to, subject, template, **kwargs):
+    """Render one message for the outbox"""
+    return OutboundEmail(
+        to=[to] if isinstance(to, str) else list(to),
+        subject=subject,
+        html=render_template(template, **kwargs),
+    )
+
+
+def recipient_slots(user):
+    """Per-recipient values the email templates read from `recipient`"""
+    return {'name': user.display_name or user.username}
+
+
+class _SlotMarkers:
+    """Stands in for `recipient` while a skeleton is rendered."""
+
+    def __init__(self, markers):
+        self._markers = markers
+
+    def __getattr__(self, name):
+        try:
+            return self._markers[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class EmailSkeleton:
+    """A template rendered once, with per-recipient slots left to fill in.
+
+    fill() interleaves the rendered literal text with each recipient's
+    values, HTML-escaping them just as the template would have.
+    """
+
+    def __init__(self, literals, slot_names):
+        self.literals = literals
+        self.slot_names = slot_names
+
+    def fill(self, values):
+        parts = [self.literals[0]]
+        for name, literal in zip(self.slot_names, self.literals[1:]):
+            parts.append(escape(values[name]))
+            parts.append(literal)
+        return ''.join(parts)
+
+
+def render_skeleton(template, slot_names=('name',), **kwargs):
+    """Render a template once with markers where `recipient.<slot>` values go"""
+    # Digits survive case filters, so a transformed marker is still caught below
+    nonce = uuid.uuid4().int
+    markers = {name: Markup(f'[[{nonce}:{name}]]') for name in slot_names}
+    html = render_template(template, recipient=_SlotMarkers(markers), **kwargs)
+
+    parts = re.split(rf'\[\[{nonce}:(\w+)\]\]', html)
+    literals, names = parts[0::2], parts[1::2]
+    # A slot passed through a filter or used in a test no longer matches
+    if any(str(nonce) in literal for literal in literals) or not set(names) <= set(slot_names):
+        raise ValueError(f'{template} transforms a recipient slot; only plain {{{{ recipient.<slot> }}}} is supported')
+    return EmailSkeleton(literals, names)
+
+
+def queue_emails(emails, wave_size=0, wave_seconds=0, priority='bulk'):
+    """Add OutboundEmails to the outbox in the caller's transaction (caller commits).
+
+    With a wave_size, only that many are due at once; each further wave
+    becomes due wave_seconds after the one before. priority is the lane
+    they are sent in (see LANES).
+    """
+    emails = iter(emails)
+    count = 0
+    start = datetime.now(timezone.utc)
+    while chunk := list(islice(emails, SEND_CHUNK_SIZE)):
+        now = datetime.now(timezone.utc)
+        db.session.execute(EmailOutbox.__table__.insert(), [
+            {
+                'recipients': json.dumps(email.to),
+                'subject': email.subject,
+                'html': email.html,
+                'batch_id': email.batch_id,
+                'substitutions': json.dumps(email.substitutions) if email.substitutions is not None else None,
+                'status': 'pending',
+                'priority': priority,
+                'attempts': 0,
+                'next_attempt_at': (
+                    start + timedelta(seconds=(count + index) // wave_size * wave_seconds) if wave_size else now
+                ),
+                'created_at': now,
+            }
+            for index, email in enumerate(chunk)
+        ])
+        count += len(chunk)
+    if count:
+        db.session.info['email_queued'] = True
+    return count
+
+
+def send_email(to, subject, template, priority='transactional', **kwargs):
+    """Render a message, queue it in the outbox and commit"""
+    count = queue_emails([render_email(to, subject, template, **kwargs)], priority=priority)
+    db.session.commit()
+    return count
+
+
+def _percentile(column, conditions, count, fraction):
+    """The value fraction of the way through count ordered rows, or None"""
+    if not count:
+        return None
+    return db.session.execute(
+        select(column).where(*conditions).order_by(column.asc())
+        .offset(min(count - 1, int(count * fraction))).limit(1)
+    ).scalar()
+
+
+def lane_summary(now=None):
+    """Per lane: due and sending counts, oldest due mail, and queue latency over the last hour"""
+    now = now or datetime.now(timezone.utc)
+    lanes = []
+    for lane in LANES:
+        in_lane = EmailOutbox.priority == lane
+        sent = [in_lane, EmailOutbox.status == 'sent', EmailOutbox.sent_at >= now - timedelta(hours=1)]
+        due, sending, oldest_due_at, sent_count, average, longest = db.session.execute(
+            select(
+                select(func.count(EmailOutbox.id))
+                .where(in_lane, EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now)
+                .scalar_subquery(),
+                select(func.count(EmailOutbox.id)).where(in_lane, EmailOutbox.status == 'sending').scalar_subquery(),
+                select(func.min(EmailOutbox.next_attempt_at))
+                .where(in_lane, EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now)
+                .scalar_subquery(),
+                select(func.count(EmailOutbox.queue_seconds)).where(*sent).scalar_subquery(),
+                select(func.avg(EmailOutbox.queue_seconds)).where(*sent).scalar_subquery(),
+                select(func.max(EmailOutbox.queue_seconds)).where(*sent).scalar_subquery(),
+            )
+        ).one()
+        sent.append(EmailOutbox.queue_seconds.isnot(None))
+        lanes.append({
+            'lane': lane,
+            'due': due,
+            'sending': sending,
+            'oldest_due_at': oldest_due_at,
+            'sent_last_hour': sent_count,
+            'average_queue_seconds': average,
+            'p95_queue_seconds': _percentile(EmailOutbox.queue_seconds, sent, sent_count, 0.95),
+            'max_queue_seconds': longest,
+        })
+    return lanes
+
+
+def outbox_summary(dead_limit=50):
+    """Queue depth, recent throughput and the newest dead letters"""
+    now = datetime.now(timezone.utc)
+
+    def _count(*conditions):
+        return select(func.count(EmailOutbox.id)).where(*conditions).scalar_subquery()
+
+    row = db.session.execute(
+        select(
+            _count(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now).label('due'),
+            _count(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at > now, EmailOutbox.attempts > 0).label('retrying'),
+            _count(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at > now, EmailOutbox.attempts == 0).label('scheduled'),
+            _count(EmailOutbox.status == 'sending').label('sending'),
+            _count(EmailOutbox.status == 'dead').label('dead'),
+            _count(EmailOutbox.status == 'sent', EmailOutbox.sent_at >= now - timedelta(hours=1)).label('sent_last_hour'),
+            _count(EmailOutbox.status == 'sent', EmailOutbox.sent_at >= now - timedelta(days=1)).label('sent_last_day'),
+            select(func.min(EmailOutbox.next_attempt_at))
+            .where(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now)
+            .scalar_subquery()
+            .label('oldest_due_at'),
         )
-        thr = Thread(target=send_async_email, args=[app, msg])
-        thr.start()
-        return thr
+    ).one()
+    summary = dict(row._mapping)
+    summary['sent_per_minute'] = summary['sent_last_hour'] / 60
+    summary['lanes'] = lane_summary(now)
+    summary['dead_letters'] = (
+        EmailOutbox.query
+        .options(defer(EmailOutbox.html))
+        .filter(EmailOutbox.status == 'dead')
+        .order_by(EmailOutbox.id.desc())
+        .limit(dead_limit)
+        .all()
+    )
+    return summary
+
+
+def retry_dead_emails(email_id=None):
+    """Return one dead letter (or all of them) to the outbox with fresh attempts"""
+    query = EmailOutbox.query.filter(EmailOutbox.status == 'dead')
+    if email_id is not None:
+        query = query.filter(EmailOutbox.id == email_id)
+    count = query.update(
+        {'status': 'pending', 'attempts': 0, 'next_attempt_at': datetime.now(timezone.utc), 'last_error': None},
+        synchronize_session=False,
+    )
+    db.session.commit()
+    if count:
+        email_dispatcher.wake()
+    return count
+
+
+def discard_dead_email(email_id):
+    """Delete one dead letter"""
+    count = EmailOutbox.query.filter(
+        EmailOutbox.status == 'dead', EmailOutbox.id == email_id
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return count
+
 
 def send_welcome_email(user):
     """Send welcome email to new users"""
@@ -71,7 +795,8 @@ def send_new_issue_notification(user, issue):
         user.email,
         f'New Issue Available: {issue.title}',
         'email/new_issue.html',
-        user=user,
+        priority='bulk',
+        recipient=recipient_slots(user),
         issue=issue
     )
 
@@ -82,7 +807,8 @@ def send_new_hint_notification(user, puzzle, hint):
         user.email,
         f'New Hint for: {puzzle.title}',
         'email/new_hint.html',
-        user=user,
+        priority='bulk',
+        recipient=recipient_slots(user),
         puzzle=puzzle,
         hint=hint
     )
@@ -99,39 +825,169 @@ def send_password_reset_email(user, token):
     )
 
 
+def _queue_for_recipients(users, subject, skeleton, wave_size=0, wave_seconds=0):
+    batch = EmailBatch(
+        subject=subject,
+        literals=json.dumps(skeleton.literals),
+        slot_names=json.dumps(skeleton.slot_names),
+    )
+    db.session.add(batch)
+    db.session.flush()
+
+    def _emails():
+        for user in users:
+            slots = recipient_slots(user)
+            yield OutboundEmail(
+                to=[user.email],
+                subject=subject,
+                html=skeleton.fill(slots),
+                batch_id=batch.id,
+                substitutions=slots,
+            )
+    return queue_emails(_emails(), wave_size, wave_seconds)
+
+
+def _hold_for_digest(users, issue_id=None, hint_id=None):
+    """Record a notification for the digest users among users instead of emailing them"""
+    from .models import User
+
+    digest_users = users.filter(User.digest_frequency.in_(DIGEST_SUBJECTS)).with_entities(
+        User.id,
+        sa_literal(issue_id, db.Integer),
+        sa_literal(hint_id, db.Integer),
+        sa_literal(datetime.now(timezone.utc), db.DateTime),
+    )
+    return db.session.execute(
+        PendingNotification.__table__.insert().from_select(
+            ['user_id', 'issue_id', 'hint_id', 'created_at'], digest_users.statement
+        )
+    ).rowcount
+
+
 def notify_all_users_new_issue(issue):
-    """Send new issue notification to all users with notifications enabled"""
+    """Queue new issue notifications for all users with them enabled (caller commits)"""
     from .models import User
     
     # Get all users who want issue notifications
-    users = User.query.filter_by(
+    users = db.session.query(User.email, User.display_name, User.username).filter_by(
         email_notifications=True,
         notify_new_issues=True
-    ).all()
-    
-    threads = []
-    for user in users:
-        thread = send_new_issue_notification(user, issue)
-        threads.append(thread)
-    
-    return threads
+    )
+    held = _hold_for_digest(users, issue_id=issue.id)
+
+    # Rendered once; each recipient only costs a string join
+    skeleton = render_skeleton('email/new_issue.html', issue=issue)
+    immediate = users.filter(User.digest_frequency == 'immediate').order_by(User.id)
+    # Sent in waves so the visitors it brings arrive at a rate the site can serve
+    return held + _queue_for_recipients(
+        immediate,
+        f'New Issue Available: {issue.title}',
+        skeleton,
+        wave_size=current_app.config.get('RELEASE_WAVE_SIZE', 0),
+        wave_seconds=current_app.config.get('RELEASE_WAVE_SECONDS', 60),
+    )
 
 
 def notify_users_new_hint(puzzle, hint):
-    """Send new hint notification to users who have attempted this puzzle"""
+    """Queue new hint notifications for users who attempted the puzzle (caller commits)"""
     from .models import User, Submission
     
     # Get users who have submitted to this puzzle and want hint notifications
     user_ids = db.session.query(Submission.user_id).filter_by(puzzle_id=puzzle.id).distinct()
-    users = User.query.filter(
+    users = db.session.query(User.email, User.display_name, User.username).filter(
         User.id.in_(user_ids),
         User.email_notifications == True,
         User.notify_new_hints == True
-    ).all()
-    
-    threads = []
-    for user in users:
-        thread = send_new_hint_notification(user, puzzle, hint)
-        threads.append(thread)
-    
-    return threads
\ No newline at end of file
+    )
+    held = _hold_for_digest(users, hint_id=hint.id)
+
+    skeleton = render_skeleton('email/new_hint.html', puzzle=puzzle, hint=hint)
+    immediate = users.filter(User.digest_frequency == 'immediate')
+    return held + _queue_for_recipients(immediate, f'New Hint for: {puzzle.title}', skeleton)
+
+
+def digest_cutoffs(now, daily_hour):
+    """For each frequency, the latest held notification its digest may include now"""
+    hour_start = now.replace(minute=0, second=0, microsecond=0)
+    day_start = hour_start.replace(hour=daily_hour)
+    if day_start > now:
+        day_start -= timedelta(days=1)
+    # Users who switched back to immediate get what was still held at once
+    return {'hourly': hour_start, 'daily': day_start, 'immediate': now}
+
+
+def _digest_email(user_rows):
+    user = user_rows[0]
+    issues = {}
+    hints = {}
+    for row in user_rows:
+        if row.issue_id is not None and user.notify_new_issues:
+            issues[row.issue_id] = {'id': row.issue_id, 'title': row.issue_title}
+        if row.puzzle_id is not None and user.notify_new_hints:
+            entry = hints.setdefault(row.puzzle_id, {'puzzle_id': row.puzzle_id, 'puzzle_title': row.puzzle_title, 'count': 0})
+            entry['count'] += 1
+    if not user.email_notifications or not (issues or hints):
+        return None
+    return render_email(
+        user.email,
+        DIGEST_SUBJECTS.get(user.digest_frequency, 'Your puzzle digest'),
+        'email/digest.html',
+        recipient=recipient_slots(user),
+        issues=list(issues.values()),
+        hints=list(hints.values()),
+    )
+
+
+def queue_digests(now=None):
+    """Queue one digest per user whose window has closed and clear what it covers (caller commits)"""
+    from .models import Hint, Issue, Puzzle, User
+
+    now = now or datetime.now(timezone.utc)
+    cutoffs = digest_cutoffs(now, current_app.config.get('DIGEST_DAILY_HOUR', 8))
+    due = or_(*(
+        and_(User.digest_frequency == frequency, PendingNotification.created_at <= cutoff)
+        for frequency, cutoff in cutoffs.items()
+    ))
+
+    # Everything due for every user in one query, grouped by user below
+    rows = (
+        db.session.query(
+            PendingNotification.id,
+            PendingNotification.user_id,
+            User.email,
+            User.display_name,
+            User.username,
+            User.email_notifications,
+            User.notify_new_issues,
+            User.notify_new_hints,
+            User.digest_frequency,
+            Issue.id.label('issue_id'),
+            Issue.title.label('issue_title'),
+            Puzzle.id.label('puzzle_id'),
+            Puzzle.title.label('puzzle_title'),
+        )
+        .join(User, User.id == PendingNotification.user_id)
+        .outerjoin(Issue, Issue.id == PendingNotification.issue_id)
+        .outerjoin(Hint, Hint.id == PendingNotification.hint_id)
+        .outerjoin(Puzzle, Puzzle.id == Hint.puzzle_id)
+        .filter(due)
+        .order_by(PendingNotification.user_id, PendingNotification.id)
+        .all()
+    )
+    if not rows:
+        return 0
+
+    emails = (
+        _digest_email(list(user_rows))
+        for _, user_rows in groupby(rows, key=lambda row: row.user_id)
+    )
+    count = queue_emails(email for email in emails if email is not None)
+
+    # Held rows for deleted issues or hints, or users who have since opted
+    # out, are cleared along with the ones that were sent
+    ids = [row.id for row in rows]
+    for start in range(0, len(ids), SEND_CHUNK_SIZE):
+        PendingNotification.query.filter(
+            PendingNotification.id.in_(ids[start:start + SEND_CHUNK_SIZE])
+        ).delete(synchronize_session=False)
+    return count
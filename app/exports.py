@@ -0,0 +1,384 @@
+"""
+CSV report exports and background export jobs.
+
+Each entry in REPORT_EXPORTS knows how to normalize its filters and produce a
+filename, header row and lazy row iterator, reusing rows from the report cache
+when the HTML view has just computed them. The admin export endpoints stream
+these directly; large exports can instead be queued as a ReportExport job that
+ExportWorker builds off the request path into a gzipped CSV file, which the
+admin downloads once it is complete. ExportWorker runs in the background
+worker processes; each job is claimed by one of them and kept alive by
+heartbeats, and a job whose heartbeat stops is queued again. Finished
+files are removed after EXPORT_RETENTION_HOURS.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from . import db
+from .leases import Heartbeat
+from .models import ReportExport
+from .report_cache import report_cache
+from .reporting import (
+    iter_puzzle_report_rows,
+    iter_puzzle_solver_rows,
+    iter_user_issue_progress_rows,
+    iter_user_report_rows,
+)
+from .utils import parse_optional_int
+
+# Number of CSV rows encoded before a chunk is flushed
+CSV_CHUNK_ROWS = 500
+
+ACTIVE_EXPORT_STATUSES = ('pending', 'running')
+
+
+def iter_csv(headers, rows):
+    """Encode rows as CSV, yielding a chunk every CSV_CHUNK_ROWS rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % CSV_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    yield buffer.getvalue()
+
+
+def _report_rows(report_name, params, iter_rows):
+    """Reuse rows the report page already cached, otherwise stream from the database"""
+    cached = report_cache.peek(report_name, params)
+    if cached is not None:
+        return cached
+    return iter_rows(**params)
+
+
+def _puzzles_csv(params):
+    rows = (
+        [
+            row['puzzle_id'],
+            row['puzzle_title'],
+            row['issue_title'] or 'Unassigned',
+            row['solve_count'],
+            row['attempt_count'],
+            row['correct_submission_count'],
+            f"{row['success_rate']:.1f}",
+            row['difficulty_rating'] if row['difficulty_rating'] is not None else '',
+        ]
+        for row in _report_rows('puzzles', params, iter_puzzle_report_rows)
+    )
+    return (
+        'puzzle-report.csv',
+        ['Puzzle ID', 'Puzzle Title', 'Issue', 'Solvers', 'Attempts', 'Correct Submissions', 'Success Rate %', 'Difficulty'],
+        rows,
+    )
+
+
+def _puzzle_solvers_csv(params):
+    rows = (
+        [
+            row['user_id'],
+            row['username'],
+            row['attempt_count'],
+            row['correct_submission_count'],
+            row['incorrect_before_solve'],
+            row['first_correct_at'].strftime('%Y-%m-%d %H:%M:%S') if row['first_correct_at'] else '',
+        ]
+        for row in iter_puzzle_solver_rows(params['puzzle_id'])
+    )
+    return (
+        f"puzzle-{params['puzzle_id']}-solvers.csv",
+        ['User ID', 'Username', 'Attempts', 'Correct Submissions', 'Incorrect Before First Solve', 'First Correct Submission (UTC)'],
+        rows,
+    )
+
+
+def _users_csv(params):
+    rows = (
+        [
+            row['user_id'],
+            row['username'],
+            row['email'],
+            row['solved_puzzles'],
+            row['attempt_count'],
+            row['correct_submission_count'],
+            f"{row['success_rate']:.1f}",
+            row['ability_rating'] if row['ability_rating'] is not None else '',
+        ]
+        for row in _report_rows('users', params, iter_user_report_rows)
+    )
+    return (
+        'user-report.csv',
+        ['User ID', 'Username', 'Email', 'Solved Puzzles', 'Attempts', 'Correct Submissions', 'Success Rate %', 'Ability'],
+        rows,
+    )
+
+
+def _issue_progress_csv(params):
+    rows = (
+        [
+            row['user_id'],
+            row['username'],
+            row['issue_id'],
+            row['issue_title'],
+            row['solved_count'],
+            row['total_puzzles'],
+            f"{row['completion_rate']:.1f}",
+        ]
+        for row in iter_user_issue_progress_rows(**params)
+    )
+    return (
+        'issue-progress-report.csv',
+        ['User ID', 'Username', 'Issue ID', 'Issue', 'Solved', 'Total Puzzles', 'Completion Rate %'],
+        rows,
+    )
+
+
+# report name -> (display title, filter defaults, CSV builder)
+REPORT_EXPORTS = {
+    'puzzles': ('Puzzle Performance', {'issue_id': None, 'sort': 'most_solved'}, _puzzles_csv),
+    'puzzle_solvers': ('Puzzle Solvers', {'puzzle_id': None}, _puzzle_solvers_csv),
+    'users': ('User Solves', {'sort': 'most_solved'}, _users_csv),
+    'issue_progress': (
+        'Issue Progress',
+        {'user_id': None, 'issue_id': None, 'sort': 'best_completion'},
+        _issue_progress_csv,
+    ),
+}
+
+
+def normalize_report_params(report_name, args):
+    """Return the report's filters from request-style args with defaults applied"""
+    _, defaults, _ = REPORT_EXPORTS[report_name]
+    params = {}
+    for key, default in defaults.items():
+        if key.endswith('_id'):
+            params[key] = parse_optional_int(args.get(key))
+        else:
+            params[key] = args.get(key) or default
+    return params
+
+
+def build_report_csv(report_name, params):
+    """Return (filename, headers, rows) for a report with normalized params"""
+    _, _, builder = REPORT_EXPORTS[report_name]
+    return builder(params)
+
+
+def params_key(params):
+    """Canonical string form of a report's filters, used to share jobs"""
+    return json.dumps(params, sort_keys=True, separators=(',', ':'))
+
+
+def queue_report_export(report_name, params, requested_by_id=None):
+    """Queue a background export, reusing an identical pending or running job"""
+    key = params_key(params)
+
+    def _active_jobs():
+        return ReportExport.query.filter(
+            ReportExport.report_name == report_name,
+            ReportExport.params_key == key,
+            ReportExport.status.in_(ACTIVE_EXPORT_STATUSES),
+        ).order_by(ReportExport.id.asc())
+
+    existing = _active_jobs().first()
+    if existing:
+        return existing
+
+    job = ReportExport(
+        report_name=report_name,
+        params_key=key,
+        status='pending',
+        requested_by_id=requested_by_id,
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    # Two identical requests may have inserted at the same moment; both keep
+    # the oldest job so they still share a single build.
+    oldest = _active_jobs().first()
+    if oldest and oldest.id != job.id:
+        db.session.delete(job)
+        db.session.commit()
+        job = oldest
+
+    export_worker.wake()
+    return job
+
+
+def export_file_path(job):
+    return os.path.join(export_worker.export_folder(), job.filename)
+
+
+class ExportWorker:
+    """Background thread that builds queued report exports"""
+
+    def __init__(self):
+        self.running = False
+        self.thread = None
+        self.app = None
+        self._wake = threading.Event()
+
+    def init_app(self, app):
+        """Initialize the worker with Flask app"""
+        self.app = app
+
+    def export_folder(self):
+        folder = self.app.config.get('EXPORT_FOLDER') or os.path.join(self.app.instance_path, 'exports')
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def start(self):
+        """Start the background export thread"""
+        if not self.running and self.app:
+            self.running = True
+            self.thread = threading.Thread(target=self._run_worker, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stop the background export thread"""
+        self.running = False
+        self._wake.set()
+        if self.thread:
+            self.thread.join()
+
+    def wake(self):
+        """Ask the worker to look for new jobs now, if it runs in this process"""
+        self._wake.set()
+
+    def _run_worker(self):
+        """Main worker loop - runs in background thread"""
+        poll_seconds = self.app.config.get('EXPORT_POLL_SECONDS', 5)
+        with self.app.app_context():
+            while self.running:
+                try:
+                    self._requeue_stale_jobs()
+                    while self.running and self.process_next():
+                        pass
+                    self.expire_old_exports()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Export worker error: {e}")
+                finally:
+                    db.session.remove()
+
+                self._wake.wait(poll_seconds)
+                self._wake.clear()
+
+    def _claim(self, job_id):
+        now = datetime.now(timezone.utc)
+        claimed = (
+            ReportExport.query
+            .filter(ReportExport.id == job_id, ReportExport.status == 'pending')
+            .update(
+                {'status': 'running', 'started_at': now, 'heartbeat_at': now},
+                synchronize_session=False,
+            )
+        )
+        db.session.commit()
+        return claimed == 1
+
+    def _renew(self, job_id):
+        return ReportExport.query.filter(
+            ReportExport.id == job_id, ReportExport.status == 'running'
+        ).update({'heartbeat_at': datetime.now(timezone.utc)}, synchronize_session=False) == 1
+
+    def process_next(self):
+        """Build the oldest pending export; returns False when none are left"""
+        job = (
+            ReportExport.query
+            .filter(ReportExport.status == 'pending')
+            .order_by(ReportExport.created_at.asc(), ReportExport.id.asc())
+            .first()
+        )
+        if job is None:
+            return False
+
+        # Another process may have claimed it first; just move on.
+        if self._claim(job.id):
+            db.session.refresh(job)
+            with Heartbeat(self.app, lambda: self._renew(job.id)):
+                self.build(job)
+        return True
+
+    def build(self, job):
+        """Write one export to a gzipped CSV file and record the outcome"""
+        filename = f"report-{job.id}-{job.report_name}.csv.gz"
+        path = os.path.join(self.export_folder(), filename)
+        tmp_path = f"{path}.tmp"
+
+        try:
+            report_filename, headers, rows = build_report_csv(job.report_name, job.params)
+
+            row_count = 0
+
+            def _counted(rows):
+                nonlocal row_count
+                for row in rows:
+                    row_count += 1
+                    yield row
+
+            with gzip.open(tmp_path, 'wt', encoding='utf-8', newline='') as output:
+                for chunk in iter_csv(headers, _counted(rows)):
+                    output.write(chunk)
+            os.replace(tmp_path, path)
+
+            retention = timedelta(hours=self.app.config.get('EXPORT_RETENTION_HOURS', 24))
+            now = datetime.now(timezone.utc)
+            job.status = 'complete'
+            job.filename = filename
+            job.download_name = f"{report_filename}.gz"
+            job.row_count = row_count
+            job.file_size = os.path.getsize(path)
+            job.completed_at = now
+            job.expires_at = now + retention
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            job.status = 'failed'
+            job.error = str(e)
+            job.completed_at = datetime.now(timezone.utc)
+            job.expires_at = job.completed_at + timedelta(hours=self.app.config.get('EXPORT_RETENTION_HOURS', 24))
+            db.session.commit()
+            print(f"Failed to build export {job.id} ({job.report_name}): {e}")
+
+    def _requeue_stale_jobs(self):
+        """Return jobs whose worker stopped sending heartbeats to the queue"""
+        lease = timedelta(seconds=self.app.config.get('WORKER_LEASE_SECONDS', 60))
+        cutoff = datetime.now(timezone.utc) - lease
+        ReportExport.query.filter(
+            ReportExport.status == 'running',
+            db.func.coalesce(ReportExport.heartbeat_at, ReportExport.started_at) < cutoff,
+        ).update({'status': 'pending', 'started_at': None, 'heartbeat_at': None}, synchronize_session=False)
+        db.session.commit()
+
+    def expire_old_exports(self):
+        """Delete finished exports and their files once past retention"""
+        now = datetime.now(timezone.utc)
+        expired = ReportExport.query.filter(
+            ReportExport.status.in_(('complete', 'failed')),
+            ReportExport.expires_at < now,
+        ).all()
+
+        for job in expired:
+            if job.filename:
+                path = os.path.join(self.export_folder(), job.filename)
+                if os.path.exists(path):
+                    os.remove(path)
+            db.session.delete(job)
+        db.session.commit()
+        return len(expired)
+
+
+# Global export worker instance
+export_worker = ExportWorker()
@@ -76,6 +76,11 @@ class UserPreferencesForm(FlaskForm):
     email_notifications = BooleanField('Enable email notifications')
     notify_new_issues = BooleanField('Notify me when new issues become available')
     notify_new_hints = BooleanField('Notify me when new hints are unlocked for puzzles I\'ve attempted')
+    digest_frequency = SelectField('Email frequency', choices=[
+        ('immediate', 'Send each notification as it happens'),
+        ('hourly', 'Hourly digest'),
+        ('daily', 'Daily digest'),
+    ])
     submit = SubmitField('Update Preferences')
 
 class ErrataForm(FlaskForm):
@@ -86,3 +91,10 @@ class ErrataForm(FlaskForm):
     is_active = BooleanField('Active', default=True)
     submit = SubmitField('Save Erratum')
 
+
+class ReportExportForm(FlaskForm):
+    submit = SubmitField('Queue Background Export')
+
+
+class EmailOutboxActionForm(FlaskForm):
+    submit = SubmitField('Retry')
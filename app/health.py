@@ -3,9 +3,10 @@ Health check endpoints for monitoring and deployment.
 """
 from flask import Blueprint, jsonify, current_app
 from app import db
-from app.models import User
+from app.models import User, WorkerJob
+from sqlalchemy import func
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 
 health_bp = Blueprint('health', __name__)
 
@@ -42,6 +43,43 @@ def detailed_health_check():
             'message': f'Database connection failed: {str(e)}'
         }
     
+    # Read replica (reports fall back to the primary when it is degraded)
+    from app.replica import replica
+    if replica.configured():
+        replica.check()
+    health_status['checks']['read_replica'] = replica.status()
+
+    # Background worker (worker.py): when a job last started, finished or
+    # sent a heartbeat. Reported, not counted against the web process.
+    try:
+        last_seen = db.session.query(func.max(func.coalesce(
+            WorkerJob.heartbeat_at, WorkerJob.last_finished_at, WorkerJob.last_started_at
+        ))).scalar()
+        max_silence = 2 * max(
+            current_app.config.get('SCHEDULER_MAX_SLEEP_SECONDS', 600),
+            current_app.config.get('WORKER_LEASE_SECONDS', 60),
+        )
+        if last_seen is None:
+            health_status['checks']['background_worker'] = {
+                'status': 'degraded',
+                'message': 'No background worker has run yet; start one with python worker.py'
+            }
+        else:
+            if last_seen.tzinfo is None:
+                last_seen = last_seen.replace(tzinfo=timezone.utc)
+            silent_for = (datetime.now(timezone.utc) - last_seen).total_seconds()
+            health_status['checks']['background_worker'] = {
+                'status': 'healthy' if silent_for <= max_silence else 'degraded',
+                'last_seen': last_seen.isoformat(),
+                'message': f'Last background job activity {silent_for:.0f}s ago'
+            }
+    except Exception as e:
+        db.session.rollback()
+        health_status['checks']['background_worker'] = {
+            'status': 'unknown',
+            'message': f'Could not check the background worker: {str(e)}'
+        }
+
     # Environment check
     required_env_vars = ['SECRET_KEY', 'DATABASE_URL']
     env_missing = []
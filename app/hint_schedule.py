@@ -0,0 +1,73 @@
+"""
+In-memory index of hint unlock dates.
+
+Hints only become visible on a date boundary, so the set of unlocked hints per
+puzzle is fixed between unlock dates. The index is rebuilt when an admin adds,
+edits or deletes a hint, and periodically so other workers pick up changes.
+"""
+import threading
+import time
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import date
+
+from . import db
+
+HintEntry = namedtuple('HintEntry', ['id', 'puzzle_id', 'hint_text', 'unlock_date'])
+
+
+class HintSchedule:
+    """Maps each puzzle to its hints sorted by unlock date."""
+
+    def __init__(self, max_age_seconds=300):
+        self.max_age_seconds = max_age_seconds
+        self._by_puzzle = {}
+        self._built_at = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read the rebuild interval from the Flask config"""
+        self.max_age_seconds = app.config.get('HINT_SCHEDULE_MAX_AGE_SECONDS', self.max_age_seconds)
+        self.invalidate()
+
+    def invalidate(self):
+        """Force a rebuild on next access"""
+        with self._lock:
+            self._built_at = None
+
+    def rebuild(self):
+        """Load every hint and rebuild the per-puzzle unlock lists"""
+        from .models import Hint
+
+        rows = (
+            db.session.query(Hint.id, Hint.puzzle_id, Hint.hint_text, Hint.unlock_date)
+            .order_by(Hint.unlock_date.asc(), Hint.id.asc())
+            .all()
+        )
+
+        by_puzzle = {}
+        for row in rows:
+            entry = HintEntry(*row)
+            dates, entries = by_puzzle.setdefault(entry.puzzle_id, ([], []))
+            dates.append(entry.unlock_date)
+            entries.append(entry)
+
+        with self._lock:
+            self._by_puzzle = by_puzzle
+            self._built_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        built_at = self._built_at
+        if built_at is None or time.monotonic() - built_at > self.max_age_seconds:
+            self.rebuild()
+
+    def visible_hints(self, puzzle_id, today=None):
+        """Hints for a puzzle whose unlock date is on or before today"""
+        self._ensure_fresh()
+        today = today or date.today()
+        dates, entries = self._by_puzzle.get(puzzle_id, ((), ()))
+        return list(entries[:bisect_right(dates, today)])
+
+
+# Global hint schedule instance (one per worker process)
+hint_schedule = HintSchedule()
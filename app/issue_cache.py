@@ -0,0 +1,179 @@
+"""
+Per-worker snapshots of issues, warmed before each release.
+
+When an issue is released every subscriber is emailed and most of them open
+the issue page, its puzzles and the PDF within minutes. issue_detail and
+puzzle_detail take the issue's puzzle list from an in-memory snapshot
+rather than the database. RELEASE_WARMUP_SECONDS before an issue's
+available_date, the first request a web process serves loads that issue's
+puzzles and asks the OS to read its PDFs into the page cache, so the first
+visitors after the release don't all miss at once.
+
+The issue row itself (title, PDF names and the available_date the release
+gate checks) is read by primary key on every get(), so postponing an issue
+or replacing its PDF takes effect in every process at once. Admin edits
+drop the puzzle lists in the process that made them; other processes
+reload theirs after ISSUE_CACHE_MAX_AGE_SECONDS.
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+
+from . import db
+from .utils import as_utc
+
+# How often each process looks for issues about to be released
+UPCOMING_CHECK_SECONDS = 60
+
+# Read size when the platform has no posix_fadvise
+PRELOAD_CHUNK_BYTES = 1024 * 1024
+
+PuzzleSummary = namedtuple('PuzzleSummary', ['id', 'title'])
+IssueSnapshot = namedtuple(
+    'IssueSnapshot',
+    ['id', 'title', 'description', 'pdf_filename', 'answer_pdf_filename', 'available_date', 'puzzles'],
+)
+
+
+def _preload_file(path):
+    """Ask the OS to read a file into its page cache ahead of the first download"""
+    try:
+        with open(path, 'rb') as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            else:
+                while f.read(PRELOAD_CHUNK_BYTES):
+                    pass
+    except OSError:
+        pass
+
+
+class IssueCache:
+    """Maps issue ids to their puzzle lists, and builds read-only snapshots of issues from them."""
+
+    def __init__(self, max_age_seconds=60, warmup_seconds=300):
+        self.max_age_seconds = max_age_seconds
+        self.warmup_seconds = warmup_seconds
+        self._entries = {}
+        self._upcoming = []
+        self._upcoming_checked_at = None
+        self._warmed = set()
+        self._lock = threading.Lock()
+        self._warm_lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read the reload interval and warm-up lead time from the Flask config"""
+        self.max_age_seconds = app.config.get('ISSUE_CACHE_MAX_AGE_SECONDS', self.max_age_seconds)
+        self.warmup_seconds = app.config.get('RELEASE_WARMUP_SECONDS', self.warmup_seconds)
+        self.invalidate()
+
+    def invalidate(self, issue_id=None):
+        """Drop one issue's puzzle list, or all of them and the upcoming list"""
+        with self._lock:
+            if issue_id is None:
+                self._entries.clear()
+                self._upcoming_checked_at = None
+                self._warmed.clear()
+            else:
+                self._entries.pop(issue_id, None)
+                self._warmed.discard(issue_id)
+
+    def _issue_row(self, issue_id):
+        from .models import Issue
+
+        return (
+            db.session.query(
+                Issue.id, Issue.title, Issue.description, Issue.pdf_filename,
+                Issue.answer_pdf_filename, Issue.available_date,
+            )
+            .filter(Issue.id == issue_id)
+            .first()
+        )
+
+    def _load_puzzles(self, issue_id):
+        from .models import Puzzle
+
+        puzzles = tuple(
+            PuzzleSummary(*puzzle)
+            for puzzle in db.session.query(Puzzle.id, Puzzle.title)
+            .filter(Puzzle.issue_id == issue_id)
+            .order_by(Puzzle.id.asc())
+        )
+        with self._lock:
+            self._entries[issue_id] = (time.monotonic(), puzzles)
+        return puzzles
+
+    def puzzles(self, issue_id):
+        """The issue's puzzle list, loading it if missing or stale"""
+        entry = self._entries.get(issue_id)
+        if entry is not None and time.monotonic() - entry[0] <= self.max_age_seconds:
+            return entry[1]
+        return self._load_puzzles(issue_id)
+
+    def get(self, issue_id):
+        """The issue as read from the database with its cached puzzles; None if there is no such issue"""
+        row = self._issue_row(issue_id)
+        if row is None:
+            return None
+        return IssueSnapshot(*row[:5], as_utc(row.available_date), self.puzzles(issue_id))
+
+    def _refresh_upcoming(self, now):
+        from .models import Issue
+
+        horizon = now + timedelta(seconds=self.warmup_seconds + UPCOMING_CHECK_SECONDS)
+        rows = (
+            db.session.query(Issue.id, Issue.available_date)
+            .filter(Issue.available_date > now, Issue.available_date <= horizon)
+            .all()
+        )
+        with self._lock:
+            self._upcoming = [(as_utc(available_date), issue_id) for issue_id, available_date in rows]
+            self._upcoming_checked_at = time.monotonic()
+
+    def warm(self, issue_id):
+        """Load an issue's puzzles now and preload its PDFs"""
+        row = self._issue_row(issue_id)
+        if row is None:
+            return None
+        self._load_puzzles(issue_id)
+        folder = current_app.config.get('PDF_UPLOAD_FOLDER')
+        for filename in (row.pdf_filename, row.answer_pdf_filename):
+            if folder and filename:
+                _preload_file(os.path.join(folder, filename))
+        with self._lock:
+            self._warmed.add(issue_id)
+        return row
+
+    def warm_upcoming(self, now=None):
+        """Warm any issue released within RELEASE_WARMUP_SECONDS; cheap when there are none"""
+        if self.warmup_seconds <= 0:
+            return
+        checked_at = self._upcoming_checked_at
+        due_check = checked_at is None or time.monotonic() - checked_at > UPCOMING_CHECK_SECONDS
+        now = now or datetime.now(timezone.utc)
+        warm_before = now + timedelta(seconds=self.warmup_seconds)
+        if not due_check and not any(
+            available_date <= warm_before and issue_id not in self._warmed
+            for available_date, issue_id in self._upcoming
+        ):
+            return
+
+        # One thread per process does the work; the others carry on serving
+        if not self._warm_lock.acquire(blocking=False):
+            return
+        try:
+            if due_check:
+                self._refresh_upcoming(now)
+            for available_date, issue_id in self._upcoming:
+                if available_date <= warm_before and issue_id not in self._warmed:
+                    self.warm(issue_id)
+        finally:
+            self._warm_lock.release()
+
+
+# Global issue cache instance (one per worker process)
+issue_cache = IssueCache()
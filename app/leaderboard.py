@@ -0,0 +1,401 @@
+"""
+In-memory leaderboard rank index.
+
+Users are ranked by the number of puzzles they have solved, with ties going to
+whoever reached that count first. Each board (overall and one per issue) keeps
+its entries in an indexable skiplist, so moving a user after a solve, looking up
+a user's rank and reading the top N are all O(log n) (plus N for the top list).
+
+Each Gunicorn worker builds the index from the database as it starts (see
+warm()); until that finishes, and after invalidate(), the first read builds
+it while concurrent reads wait for that one build. It is then rebuilt in the
+background every LEADERBOARD_MAX_AGE_SECONDS. In between, the worker that
+records a solve applies it immediately, and every read first catches up on
+correct submissions other workers have committed since.
+"""
+import random
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from sqlalchemy import func
+
+from . import db
+
+# 2**24 entries per board before the skiplist degrades
+MAX_LEVELS = 24
+
+LeaderboardEntry = namedtuple('LeaderboardEntry', ['rank', 'user_id', 'solved', 'reached_at'])
+
+
+class _Last:
+    """Sentinel key that sorts after every real key."""
+
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return self is other
+
+    def __gt__(self, other):
+        return self is not other
+
+    def __ge__(self, other):
+        return True
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, next_nodes, widths):
+        self.key = key
+        self.next = next_nodes
+        self.width = widths
+
+
+class RankIndex:
+    """Indexable skiplist of unique, comparable keys.
+
+    width[level] counts the level-0 steps a link skips, which lets insert,
+    remove, rank and positional lookup all run in O(log n) expected time.
+    """
+
+    def __init__(self):
+        self._tail = _Node(_Last(), [], [])
+        self._head = _Node(None, [self._tail] * MAX_LEVELS, [1] * MAX_LEVELS)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def load_sorted(self, keys):
+        """Fill an empty index from keys already in ascending order, in O(n)"""
+        last = [self._head] * MAX_LEVELS
+        last_position = [0] * MAX_LEVELS
+        position = 0
+        for position, key in enumerate(keys, 1):
+            height = min(MAX_LEVELS, 1 + _geometric_height())
+            node = _Node(key, [self._tail] * height, [0] * height)
+            for level in range(height):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_position[level]
+                last[level] = node
+                last_position[level] = position
+        for level in range(MAX_LEVELS):
+            last[level].width[level] = position + 1 - last_position[level]
+        self._size = position
+
+    def insert(self, key):
+        chain = [None] * MAX_LEVELS
+        steps_at_level = [0] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        height = min(MAX_LEVELS, 1 + _geometric_height())
+        new_node = _Node(key, [None] * height, [None] * height)
+        steps = 0
+        for level in range(height):
+            previous = chain[level]
+            new_node.next[level] = previous.next[level]
+            previous.next[level] = new_node
+            new_node.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(height, MAX_LEVELS):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain = [None] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is self._tail or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            previous = chain[level]
+            previous.width[level] += target.width[level] - 1
+            previous.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def count_before(self, key):
+        """Number of keys strictly less than key"""
+        position = 0
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def first(self, count):
+        """The smallest count keys in order"""
+        keys = []
+        node = self._head.next[0]
+        while node is not self._tail and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+def _geometric_height():
+    height = 0
+    while random.random() < 0.5:
+        height += 1
+    return height
+
+
+class Board:
+    """One ranking: user -> (solved count, time that count was reached)."""
+
+    def __init__(self):
+        self._keys = {}
+        self._index = RankIndex()
+
+    def __len__(self):
+        return len(self._index)
+
+    def load(self, totals):
+        """Fill an empty board from {user_id: (solved, reached_at)}"""
+        self._keys = {
+            user_id: (-solved, reached_at, user_id)
+            for user_id, (solved, reached_at) in totals.items()
+        }
+        self._index.load_sorted(sorted(self._keys.values()))
+
+    def add_solve(self, user_id, solved_at):
+        key = self._keys.get(user_id)
+        solved = 0
+        reached_at = solved_at
+        if key is not None:
+            self._index.remove(key)
+            solved = -key[0]
+            reached_at = max(key[1], solved_at)
+        key = (-(solved + 1), reached_at, user_id)
+        self._keys[user_id] = key
+        self._index.insert(key)
+
+    def entry(self, user_id):
+        key = self._keys.get(user_id)
+        if key is None:
+            return None
+        return _entry(self._index.count_before(key) + 1, key)
+
+    def top(self, count):
+        return [_entry(rank, key) for rank, key in enumerate(self._index.first(count), 1)]
+
+
+def _entry(rank, key):
+    solved, reached_at, user_id = key
+    return LeaderboardEntry(rank, user_id, -solved, datetime.fromtimestamp(reached_at, timezone.utc))
+
+
+class Leaderboard:
+    """Overall and per-issue boards for one worker process."""
+
+    def __init__(self, max_age_seconds=3600):
+        self.max_age_seconds = max_age_seconds
+        self._overall = Board()
+        self._issues = {}
+        self._solved_pairs = set()
+        self._last_submission_id = 0
+        self._built_at = None
+        self._lock = threading.RLock()
+        self._rebuilding = False
+        # Held while building a missing index, so only one thread does it
+        self._build_lock = threading.Lock()
+        self.app = None
+
+    def init_app(self, app):
+        """Read the rebuild interval from the Flask config"""
+        self.app = app
+        self.max_age_seconds = app.config.get('LEADERBOARD_MAX_AGE_SECONDS', self.max_age_seconds)
+        self.invalidate()
+
+    def invalidate(self):
+        """Force a rebuild on next access, e.g. after deleting a user or puzzle"""
+        with self._lock:
+            self._built_at = None
+
+    @staticmethod
+    def _epoch(value):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+
+    def _apply(self, user_id, puzzle_id, issue_id, solved_at):
+        if (user_id, puzzle_id) in self._solved_pairs:
+            return
+        self._solved_pairs.add((user_id, puzzle_id))
+        solved_at = self._epoch(solved_at)
+        self._overall.add_solve(user_id, solved_at)
+        if issue_id is not None:
+            self._issues.setdefault(issue_id, Board()).add_solve(user_id, solved_at)
+
+    def _correct_submissions(self):
+        from .models import Puzzle, Submission, User
+
+        return (
+            db.session.query(
+                Submission.id,
+                Submission.user_id,
+                Submission.puzzle_id,
+                Puzzle.issue_id,
+                Submission.submitted_at,
+            )
+            .join(Puzzle, Puzzle.id == Submission.puzzle_id)
+            .join(User, User.id == Submission.user_id)
+            .filter(Submission.is_correct == True, User.is_admin == False)
+        )
+
+    def rebuild(self):
+        """Reload every first solve from the database"""
+        from .models import Puzzle, Submission
+
+        # Read the high-water mark first; anything committed meanwhile is
+        # picked up by the next catch-up and de-duplicated by solved pair.
+        last_id = db.session.query(func.max(Submission.id)).scalar() or 0
+        first_solves = (
+            self._correct_submissions()
+            .with_entities(
+                Submission.user_id,
+                Submission.puzzle_id,
+                Puzzle.issue_id,
+                func.min(Submission.submitted_at),
+            )
+            .filter(Submission.id <= last_id)
+            .group_by(Submission.user_id, Submission.puzzle_id, Puzzle.issue_id)
+            .all()
+        )
+
+        # Total each board first so every user is inserted only once
+        solved_pairs = set()
+        overall_totals = {}
+        issue_totals = {}
+        for user_id, puzzle_id, issue_id, solved_at in first_solves:
+            solved_pairs.add((user_id, puzzle_id))
+            solved_at = self._epoch(solved_at)
+            totals = [overall_totals]
+            if issue_id is not None:
+                totals.append(issue_totals.setdefault(issue_id, {}))
+            for board_totals in totals:
+                solved, reached_at = board_totals.get(user_id, (0, solved_at))
+                board_totals[user_id] = (solved + 1, max(reached_at, solved_at))
+
+        overall = Board()
+        overall.load(overall_totals)
+        issues = {}
+        for issue_id, totals in issue_totals.items():
+            issues[issue_id] = Board()
+            issues[issue_id].load(totals)
+
+        with self._lock:
+            self._overall = overall
+            self._issues = issues
+            self._solved_pairs = solved_pairs
+            self._last_submission_id = last_id
+            self._built_at = time.monotonic()
+
+    def _catch_up(self):
+        from .models import Submission
+
+        rows = (
+            self._correct_submissions()
+            .filter(Submission.id > self._last_submission_id)
+            .order_by(Submission.id.asc())
+            .all()
+        )
+        with self._lock:
+            for submission_id, user_id, puzzle_id, issue_id, solved_at in rows:
+                self._apply(user_id, puzzle_id, issue_id, solved_at)
+                self._last_submission_id = max(self._last_submission_id, submission_id)
+
+    def _build_if_missing(self):
+        with self._build_lock:
+            if self._built_at is None:
+                self.rebuild()
+
+    def _build_at_start(self):
+        with self.app.app_context():
+            try:
+                self._build_if_missing()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Leaderboard build error: {e}")
+            finally:
+                db.session.remove()
+
+    def warm(self):
+        """Build the index in a background thread, e.g. as a web worker starts"""
+        if self.app is not None:
+            threading.Thread(target=self._build_at_start, daemon=True).start()
+
+    def _rebuild_in_background(self):
+        with self.app.app_context():
+            try:
+                self.rebuild()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Leaderboard rebuild error: {e}")
+            finally:
+                self._rebuilding = False
+                db.session.remove()
+
+    def _ensure_fresh(self):
+        built_at = self._built_at
+        if built_at is None:
+            self._build_if_missing()
+            return
+
+        # A stale index keeps serving (caught up) while a thread rebuilds it
+        if time.monotonic() - built_at > self.max_age_seconds and self.app is not None:
+            with self._lock:
+                start = not self._rebuilding
+                self._rebuilding = True
+            if start:
+                threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+        self._catch_up()
+
+    def record_solve(self, user, puzzle, solved_at):
+        """Apply a just-committed correct submission in this worker"""
+        if user.is_admin or self._built_at is None:
+            return
+        with self._lock:
+            self._apply(user.id, puzzle.id, puzzle.issue_id, solved_at)
+
+    def _board(self, issue_id):
+        if issue_id is None:
+            return self._overall
+        return self._issues.get(issue_id) or Board()
+
+    def top(self, count, issue_id=None):
+        """The top count entries overall or for one issue"""
+        self._ensure_fresh()
+        with self._lock:
+            return self._board(issue_id).top(count)
+
+    def rank(self, user_id, issue_id=None):
+        """A user's entry overall or for one issue, or None if they have no solves"""
+        self._ensure_fresh()
+        with self._lock:
+            return self._board(issue_id).entry(user_id)
+
+    def size(self, issue_id=None):
+        """Number of ranked users overall or for one issue"""
+        with self._lock:
+            return len(self._board(issue_id))
+
+
+# Global leaderboard instance (one per worker process)
+leaderboard = Leaderboard()
@@ -0,0 +1,57 @@
+"""
+Leases for work shared between background worker processes.
+
+A worker claims a row (a WorkerJob or a ReportExport) by stamping it with
+its identity and a lease expiry in one conditional UPDATE, so only one
+process can hold it. While the work runs, a Heartbeat renews the lease
+every third of WORKER_LEASE_SECONDS; if the process dies the lease lapses
+and another worker takes the row over.
+"""
+import os
+import socket
+import threading
+import uuid
+
+from . import db
+
+_worker_id = None
+
+
+def worker_id():
+    """This process's identity in lease_owner columns (host, pid and a nonce)"""
+    global _worker_id
+    if _worker_id is None or not _worker_id.startswith(f"{socket.gethostname()}:{os.getpid()}:"):
+        _worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    return _worker_id
+
+
+class Heartbeat:
+    """Calls renew() from a side thread until the with block exits"""
+
+    def __init__(self, app, renew):
+        self.app = app
+        self.renew = renew
+        self.interval = max(1, app.config.get('WORKER_LEASE_SECONDS', 60) / 3)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        with self.app.app_context():
+            while not self._stop.wait(self.interval):
+                try:
+                    if not self.renew():
+                        print(f"Lost a lease held by {worker_id()}; another worker may take over")
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Lease heartbeat failed: {e}")
+                finally:
+                    db.session.remove()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
@@ -1,3 +1,4 @@
+import json
 from . import db
 from datetime import datetime, timezone
 from flask_login import UserMixin
@@ -17,6 +18,8 @@ class User(UserMixin, db.Model):
     email_notifications = db.Column(db.Boolean, default=True)
     notify_new_issues = db.Column(db.Boolean, default=True)
     notify_new_hints = db.Column(db.Boolean, default=True)
+    # 'immediate', or collect notifications into an 'hourly' or 'daily' digest
+    digest_frequency = db.Column(db.String(10), nullable=False, default='immediate', server_default='immediate')
 
     submissions = db.relationship('Submission', backref='user', lazy=True)
     
@@ -97,3 +100,154 @@ class Erratum(db.Model):
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     is_active = db.Column(db.Boolean, default=True)
 
+
+
+class PuzzleStats(db.Model):
+    """Materialized per-puzzle submission counters used by reporting."""
+    puzzle_id = db.Column(db.Integer, db.ForeignKey('puzzle.id'), primary_key=True)
+    solve_count = db.Column(db.Integer, nullable=False, default=0)
+    attempt_count = db.Column(db.Integer, nullable=False, default=0)
+    correct_submission_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class UserStats(db.Model):
+    """Materialized per-user submission counters used by reporting."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    solved_puzzles = db.Column(db.Integer, nullable=False, default=0)
+    attempt_count = db.Column(db.Integer, nullable=False, default=0)
+    correct_submission_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class PuzzleRating(db.Model):
+    """Fitted Rasch difficulty of a puzzle on the logit scale (higher is harder)."""
+    puzzle_id = db.Column(db.Integer, db.ForeignKey('puzzle.id'), primary_key=True)
+    difficulty = db.Column(db.Float, nullable=False, default=0.0)
+    # Submissions up to and including each solver's first correct one
+    trial_count = db.Column(db.Integer, nullable=False, default=0)
+    fitted_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class UserRating(db.Model):
+    """Fitted Rasch ability of a user on the logit scale (higher is stronger)."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    ability = db.Column(db.Float, nullable=False, default=0.0)
+    trial_count = db.Column(db.Integer, nullable=False, default=0)
+    fitted_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class ReportExport(db.Model):
+    """A queued or finished background CSV export of an admin report."""
+    id = db.Column(db.Integer, primary_key=True)
+    report_name = db.Column(db.String(50), nullable=False)
+    # Canonical JSON of the report filters; identical requests share a job
+    params_key = db.Column(db.String(500), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)
+    requested_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    filename = db.Column(db.String(200), nullable=True)
+    download_name = db.Column(db.String(200), nullable=True)
+    row_count = db.Column(db.Integer, nullable=True)
+    file_size = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    started_at = db.Column(db.DateTime, nullable=True)
+    # Renewed by the worker building it; a stale one means that worker died
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True)
+
+    requested_by = db.relationship('User')
+
+    @property
+    def params(self):
+        return json.loads(self.params_key)
+
+
+class WorkerJob(db.Model):
+    """A recurring background job, leased to one worker process at a time."""
+    __tablename__ = 'worker_job'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    next_run_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    # Worker holding the job; the lease is renewed by heartbeats while it runs
+    lease_owner = db.Column(db.String(100), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    last_started_at = db.Column(db.DateTime, nullable=True)
+    last_finished_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+
+class NotificationLedger(db.Model):
+    """One row per release that has been announced, so each goes out once."""
+    __tablename__ = 'notification_ledger'
+    __table_args__ = (UniqueConstraint('kind', 'subject_id', name='uq_notification_ledger_release'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    # 'issue' or 'hint', and that row's id
+    kind = db.Column(db.String(20), nullable=False)
+    subject_id = db.Column(db.Integer, nullable=False)
+    recipient_count = db.Column(db.Integer, nullable=True)
+    announced_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+
+class PendingNotification(db.Model):
+    """A new issue or hint held for a user's next digest email."""
+    __tablename__ = 'pending_notification'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
+    issue_id = db.Column(db.Integer, db.ForeignKey('issue.id', ondelete='CASCADE'), nullable=True)
+    hint_id = db.Column(db.Integer, db.ForeignKey('hint.id', ondelete='CASCADE'), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+
+class EmailBatch(db.Model):
+    """A fan-out notification rendered once, shared by its outbox rows."""
+    __tablename__ = 'email_batch'
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(300), nullable=False)
+    # JSON lists: the rendered text between recipient slots, and the slot names
+    literals = db.Column(db.Text, nullable=False)
+    slot_names = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class EmailOutbox(db.Model):
+    """An outbound email, kept until it is sent or gives up."""
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.Index('ix_email_outbox_due', 'status', 'next_attempt_at'),
+        db.Index('ix_email_outbox_lane_due', 'status', 'priority', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # JSON list of recipient addresses
+    recipients = db.Column(db.Text, nullable=False)
+    subject = db.Column(db.String(300), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    # pending -> sending -> sent, or back to pending to retry, or dead
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    # Sending lane: 'transactional' (resets, welcomes) or 'bulk' (fan-outs, digests)
+    priority = db.Column(db.String(20), nullable=False, default='bulk', server_default='bulk')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    lease_token = db.Column(db.String(32), nullable=True, index=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    sent_at = db.Column(db.DateTime, nullable=True, index=True)
+    # Seconds from when the message was last due until it was sent
+    queue_seconds = db.Column(db.Float, nullable=True)
+    # Fan-out rows: the shared batch and this recipient's JSON slot values
+    batch_id = db.Column(db.Integer, db.ForeignKey('email_batch.id'), nullable=True, index=True)
+    substitutions = db.Column(db.Text, nullable=True)
+
+    @property
+    def to(self):
+        return json.loads(self.recipients)
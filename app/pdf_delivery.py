@@ -0,0 +1,91 @@
+"""
+Issue PDF delivery.
+
+Issue and answer PDFs are only served through pdf_response(), after the
+view has checked that the user is logged in and the issue is released (the
+static route refuses anything under pdfs/). The transfer itself is handed
+off according to PDF_DELIVERY:
+
+- 'direct': the app sends the file with Range, ETag and Last-Modified
+  support; the WSGI server's file wrapper (Gunicorn's uses sendfile) copies
+  full responses without reading them into Python.
+- 'x-accel-redirect': an empty response with X-Accel-Redirect pointing at
+  PDF_ACCEL_REDIRECT_PREFIX, an internal nginx location over the PDF
+  folder, so nginx streams the file (ranges and validators included) and
+  the worker is free at once.
+- 'x-sendfile': the same with an X-Sendfile header holding the file's path
+  (Apache mod_xsendfile, lighttpd).
+
+Uploaded files are named by the digest of their contents (see pdf_store).
+When the view serves one from a URL that carries that name
+(versioned=True), the URL identifies the bytes and replacing the PDF
+changes it, so the response may be cached privately for a year. Anything
+else, including files named by hand, is cached for
+PDF_CACHE_MAX_AGE_SECONDS and revalidated by ETag.
+"""
+import os
+from urllib.parse import quote
+
+from flask import abort, current_app, send_file
+from werkzeug.security import safe_join
+
+from .pdf_store import STORED_NAME, pdf_folder
+
+# Cache lifetime for a file whose name is never reused
+IMMUTABLE_MAX_AGE_SECONDS = 365 * 24 * 3600
+
+DELIVERY_MODES = ('direct', 'x-accel-redirect', 'x-sendfile')
+
+
+def is_immutable(filename):
+    """Whether a stored PDF name always refers to the same bytes (it is their digest)"""
+    return bool(STORED_NAME.match(filename))
+
+
+def _set_cache_headers(response, filename, versioned):
+    response.cache_control.no_cache = None
+    response.cache_control.public = None
+    response.cache_control.private = True
+    if versioned and is_immutable(filename):
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE_SECONDS
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = current_app.config.get('PDF_CACHE_MAX_AGE_SECONDS', 3600)
+    response.expires = None
+    return response
+
+
+def pdf_response(filename, download_name=None, versioned=False):
+    """Serve a stored PDF by the configured delivery mode, or 404 if it is missing.
+
+    Pass versioned=True only when the request URL names the file, so a
+    changed PDF is fetched from a new URL.
+    """
+    path = safe_join(pdf_folder(), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    download_name = download_name or os.path.basename(filename)
+
+    mode = current_app.config.get('PDF_DELIVERY', 'direct').lower()
+    if mode not in DELIVERY_MODES or mode == 'direct':
+        response = send_file(
+            path,
+            mimetype='application/pdf',
+            download_name=download_name,
+            conditional=True,
+            etag=True,
+            max_age=None,
+        )
+        # Werkzeug only advertises ranges on a range response
+        response.headers.setdefault('Accept-Ranges', 'bytes')
+        return _set_cache_headers(response, filename, versioned)
+
+    # The front-end server reads the file, so only the headers come from here
+    response = current_app.response_class(mimetype='application/pdf')
+    response.headers['Content-Disposition'] = f"inline; filename*=UTF-8''{quote(download_name)}"
+    if mode == 'x-accel-redirect':
+        prefix = current_app.config.get('PDF_ACCEL_REDIRECT_PREFIX', '/protected-pdfs/')
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(filename)
+    else:
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+    return _set_cache_headers(response, filename, versioned)
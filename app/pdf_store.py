@@ -0,0 +1,165 @@
+"""
+Content-addressed storage for issue PDFs.
+
+An upload is streamed to a temporary file in the PDF folder while it is
+hashed, then renamed to <sha256>.pdf. Uploading the same bytes again finds
+that file already there and keeps the one copy, so several issues can
+share a PDF. Since a name always means the same bytes, a download URL
+that carries the name can be cached indefinitely (see pdf_delivery).
+
+A file's references are the Issue.pdf_filename and
+Issue.answer_pdf_filename values naming it. The scheduler's sweep deletes
+stored files with no references once they are older than
+PDF_ORPHAN_GRACE_HOURS, which covers an upload whose issue form hasn't
+been saved yet. Only names this module (or the old timestamped uploads)
+created are ever swept; PDFs copied into the folder by hand are left
+alone.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import time
+from collections import Counter
+
+from flask import current_app
+
+from . import db
+
+# Bytes read from an upload at a time
+CHUNK_BYTES = 64 * 1024
+
+# Every PDF has this header within its first 1024 bytes
+PDF_MAGIC = b'%PDF-'
+PDF_HEADER_BYTES = 1024
+
+# Names of stored files: the SHA-256 digest of their contents
+STORED_NAME = re.compile(r'^[0-9a-f]{64}\.pdf$')
+
+# Names uploads were given before the store: <prefix>_<YYYYmmdd_HHMMSS>_<8 hex>.pdf
+UPLOADED_NAME = re.compile(r'_\d{8}_\d{6}_[0-9a-f]{8}\.pdf$')
+
+TEMP_PREFIX = '.upload-'
+
+
+def pdf_folder():
+    return current_app.config.get('PDF_UPLOAD_FOLDER') or os.path.join(current_app.root_path, 'static', 'pdfs')
+
+
+def is_managed(filename):
+    """Whether a file in the PDF folder was created by an upload (so it may be swept)"""
+    return bool(STORED_NAME.match(filename) or UPLOADED_NAME.search(filename))
+
+
+def store_pdf(stream):
+    """Save an uploaded PDF under its digest and return the stored name.
+
+    Raises ValueError if the upload isn't a PDF.
+    """
+    folder = pdf_folder()
+    os.makedirs(folder, exist_ok=True)
+    digest = hashlib.sha256()
+    # In the same folder, so the rename below is atomic
+    fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix='.pdf', dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as temp:
+            first = True
+            while chunk := stream.read(CHUNK_BYTES):
+                if first and PDF_MAGIC not in chunk[:PDF_HEADER_BYTES]:
+                    raise ValueError('Only PDF files are allowed.')
+                first = False
+                digest.update(chunk)
+                temp.write(chunk)
+            if first:
+                raise ValueError('The uploaded file is empty.')
+            temp.flush()
+            os.fsync(temp.fileno())
+
+        filename = f'{digest.hexdigest()}.pdf'
+        path = os.path.join(folder, filename)
+        if os.path.exists(path):
+            # Same bytes already stored; restart its grace period so a
+            # sweep can't remove it before the issue referencing it is saved
+            os.utime(path)
+        else:
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        return filename
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def pdf_references():
+    """How many issue PDF fields name each file"""
+    from .models import Issue
+
+    references = Counter()
+    for column in (Issue.pdf_filename, Issue.answer_pdf_filename):
+        references.update(
+            filename for (filename,) in db.session.query(column).filter(column.isnot(None))
+        )
+    return references
+
+
+def sweep_orphaned_pdfs(grace_seconds=None):
+    """Delete stored PDFs no issue references, and stale temporary files; returns files deleted"""
+    if grace_seconds is None:
+        grace_seconds = current_app.config.get('PDF_ORPHAN_GRACE_HOURS', 24) * 3600
+    folder = pdf_folder()
+    if not os.path.isdir(folder):
+        return 0
+
+    references = pdf_references()
+    cutoff = time.time() - grace_seconds
+    deleted = 0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            orphaned = is_managed(entry.name) and not references[entry.name]
+            # Left by an upload that died before its rename
+            abandoned = entry.name.startswith(TEMP_PREFIX)
+            try:
+                if (orphaned or abandoned) and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    deleted += 1
+            except FileNotFoundError:
+                pass
+    return deleted
+
+
+def adopt_existing_pdfs():
+    """Move every PDF an issue names into the store, pointing the issues at the stored copies.
+
+    Duplicates collapse into one file. Originals no issue names any more
+    are removed. Returns (files stored, issue fields updated).
+    """
+    from .models import Issue
+
+    folder = pdf_folder()
+    stored = {}
+    updated = 0
+    for issue in Issue.query.all():
+        for field in ('pdf_filename', 'answer_pdf_filename'):
+            filename = getattr(issue, field)
+            if not filename or STORED_NAME.match(filename):
+                continue
+            if filename not in stored:
+                path = os.path.join(folder, filename)
+                if os.path.dirname(os.path.normpath(filename)) or not os.path.isfile(path):
+                    continue
+                with open(path, 'rb') as f:
+                    try:
+                        stored[filename] = store_pdf(f)
+                    except ValueError:
+                        continue
+            setattr(issue, field, stored[filename])
+            updated += 1
+    db.session.commit()
+
+    references = pdf_references()
+    for filename in stored:
+        if not references[filename]:
+            os.remove(os.path.join(folder, filename))
+    return len(set(stored.values())), updated
@@ -1,12 +1,19 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash
+from flask import Blueprint, abort, render_template, redirect, url_for, request, flash
 from flask_login import login_required, current_user
-from .models import Puzzle, Submission, Hint, Issue, Erratum, PuzzleAnswerRule
+from .models import Puzzle, Submission, Issue, Erratum, PuzzleAnswerRule, User
 from .forms import AnswerForm
 from . import db
 from datetime import date, datetime, timezone
 from werkzeug.security import check_password_hash
+from werkzeug.utils import secure_filename
 import string
-from .utils import compare_dates
+from .utils import compare_dates, parse_optional_int
+from .hint_schedule import hint_schedule
+from .issue_cache import issue_cache
+from .pdf_delivery import pdf_response
+from .stats import record_submission
+from .ratings import record_rating
+from .leaderboard import leaderboard
 
 def normalize_answer(text):
             # Lowercase, remove punctuation and spaces
@@ -56,7 +63,9 @@ def list_issues():
 @puzzle_bp.route('/issue/<int:issue_id>')
 @login_required
 def issue_detail(issue_id):
-    issue = Issue.query.get_or_404(issue_id)
+    issue = issue_cache.get(issue_id)
+    if issue is None:
+        abort(404)
     now = datetime.now(timezone.utc)
     
     if compare_dates(now, issue.available_date):
@@ -77,6 +86,30 @@ def issue_detail(issue_id):
     )
 
 
+@puzzle_bp.route('/issue/<int:issue_id>/pdf/<any(issue, answers):kind>')
+@puzzle_bp.route('/issue/<int:issue_id>/pdf/<any(issue, answers):kind>/<path:filename>')
+@login_required
+def issue_pdf(issue_id, kind, filename=None):
+    issue = issue_cache.get(issue_id)
+    if issue is None:
+        abort(404)
+    # Admins can check an issue's PDFs before it is released
+    if compare_dates(datetime.now(timezone.utc), issue.available_date) and not current_user.is_admin:
+        abort(404)
+
+    current_filename = issue.pdf_filename if kind == 'issue' else issue.answer_pdf_filename
+    if not current_filename:
+        abort(404)
+    # The stored name is part of the URL, so a replaced PDF gets a new URL
+    # and browsers can cache each one for good
+    if filename != current_filename:
+        return redirect(url_for('puzzle.issue_pdf', issue_id=issue_id, kind=kind, filename=current_filename))
+    # Stored files are named by digest; save them under the issue's title
+    title = secure_filename(issue.title)
+    download_name = f"{title}{'_answers' if kind == 'answers' else ''}.pdf" if title else None
+    return pdf_response(filename, download_name, versioned=True)
+
+
 @puzzle_bp.route('/puzzles')
 @login_required
 def list_puzzles():
@@ -88,7 +121,7 @@ def list_puzzles():
 def puzzle_detail(puzzle_id):
     puzzle = Puzzle.query.get_or_404(puzzle_id)
     
-    issue = puzzle.issue
+    issue = issue_cache.get(puzzle.issue_id) if puzzle.issue_id is not None else None
     now = datetime.now(timezone.utc)
 
     if issue and compare_dates(now, issue.available_date):
@@ -122,9 +155,12 @@ def puzzle_detail(puzzle_id):
             is_correct=correct
         )
         db.session.add(submission)
+        record_submission(submission)
+        record_rating(submission)
         db.session.commit()
 
         if correct:
+            leaderboard.record_solve(current_user, puzzle, submission.submitted_at)
             response_text = None
             if response_rule and response_rule.feedback_text:
                 response_text = _render_feedback_message(response_rule.feedback_text, submitted_raw)
@@ -149,16 +185,15 @@ def puzzle_detail(puzzle_id):
 
         return redirect(url_for('puzzle.puzzle_detail', puzzle_id=puzzle_id))
 
-    unlocked_hints = Hint.query.filter(
-        Hint.puzzle_id == puzzle_id,
-        Hint.unlock_date <= date.today()
-    ).order_by(Hint.unlock_date).all()
+    unlocked_hints = hint_schedule.visible_hints(puzzle_id, date.today())
 
     return render_template(
         'puzzle_detail.html',
         puzzle=puzzle,
+        issue=issue,
         form=form,
         unlocked_hints=unlocked_hints,
+        user_submission=user_submission,
         correct=user_submission is not None
     )
 
@@ -211,4 +246,48 @@ def user_dashboard():
 @puzzle_bp.route('/errata')
 def errata_list():
     active_errata = Erratum.query.filter_by(is_active=True).order_by(Erratum.created_at.desc()).all()
-    return render_template('errata_list.html', errata=active_errata)
\ No newline at end of file
+    return render_template('errata_list.html', errata=active_errata)
+
+
+# Entries shown on each leaderboard page
+LEADERBOARD_SIZE = 50
+
+
+@puzzle_bp.route('/leaderboard')
+def leaderboard_view():
+    issue_id = parse_optional_int(request.args.get('issue_id'))
+    now = datetime.now(timezone.utc)
+    issue = None
+    if issue_id is not None:
+        issue = Issue.query.get_or_404(issue_id)
+        if compare_dates(now, issue.available_date):
+            abort(404)
+
+    entries = leaderboard.top(LEADERBOARD_SIZE, issue_id=issue_id)
+    my_entry = None
+    if current_user.is_authenticated:
+        my_entry = leaderboard.rank(current_user.id, issue_id=issue_id)
+
+    user_ids = [entry.user_id for entry in entries]
+    if my_entry:
+        user_ids.append(my_entry.user_id)
+    names = {
+        user_id: display_name or username
+        for user_id, display_name, username in db.session.query(
+            User.id, User.display_name, User.username
+        ).filter(User.id.in_(user_ids))
+    }
+
+    issues = [
+        candidate for candidate in Issue.query.order_by(Issue.available_date.desc()).all()
+        if not compare_dates(now, candidate.available_date)
+    ]
+    return render_template(
+        'leaderboard.html',
+        issue=issue,
+        issues=issues,
+        entries=entries,
+        my_entry=my_entry,
+        names=names,
+        ranked_count=leaderboard.size(issue_id=issue_id),
+    )
@@ -0,0 +1,203 @@
+"""
+Puzzle difficulty and user ability ratings.
+
+Each submission up to and including a user's first correct answer on a puzzle
+counts as one trial, modelled Rasch-style as
+P(correct) = sigmoid(ability[user] - difficulty[puzzle]). refit_ratings()
+collapses all submissions into a sparse user x puzzle matrix of (trials,
+solved) cells and fits both sides with alternating Newton steps computed by
+bincount over the cells. A standard-normal prior keeps users who solved
+everything (or nothing) finite. The scheduler refits nightly; between fits
+record_rating() nudges both ratings Elo-style after each submission.
+"""
+import math
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .analytics import submission_arrays
+from .models import Puzzle, PuzzleRating, User, UserRating
+
+# Logit ratings are shown Elo-style: 0 is 1500 and one logit is ~174 points
+ELO_BASE = 1500
+ELO_SCALE = 400 / math.log(10)
+
+PRIOR_PRECISION = 1.0
+MAX_ITERATIONS = 200
+MAX_STEP = 1.0
+TOLERANCE = 1e-6
+
+OutcomeMatrix = namedtuple(
+    'OutcomeMatrix', ['user_ids', 'puzzle_ids', 'user_index', 'puzzle_index', 'trials', 'solved']
+)
+
+
+def to_elo(logit):
+    """Elo-style display value for a logit-scale rating"""
+    if logit is None:
+        return None
+    return int(round(ELO_BASE + ELO_SCALE * logit))
+
+
+def _sigmoid(values):
+    return 1.0 / (1.0 + np.exp(-values))
+
+
+def build_outcome_matrix(arrays):
+    """Collapse submissions into sparse (user, puzzle) cells of trial and solve counts"""
+    order = np.lexsort((arrays.submitted_at, arrays.puzzle_id, arrays.user_id))
+    users = arrays.user_id[order]
+    puzzles = arrays.puzzle_id[order]
+    correct = arrays.is_correct[order].astype(np.int64)
+
+    new_pair = np.ones(len(users), dtype=bool)
+    new_pair[1:] = (users[1:] != users[:-1]) | (puzzles[1:] != puzzles[:-1])
+    pair = np.cumsum(new_pair) - 1
+    pair_start = np.flatnonzero(new_pair)
+
+    # Submissions after a user's first solve of a puzzle carry no information
+    correct_before = np.cumsum(correct) - correct
+    correct_before -= correct_before[pair_start][pair]
+    rated = correct_before == 0
+
+    trials = np.bincount(pair[rated], minlength=len(pair_start))
+    solved = np.bincount(pair[rated], weights=correct[rated], minlength=len(pair_start))
+
+    user_ids, user_index = np.unique(users[pair_start], return_inverse=True)
+    puzzle_ids, puzzle_index = np.unique(puzzles[pair_start], return_inverse=True)
+    return OutcomeMatrix(user_ids, puzzle_ids, user_index, puzzle_index, trials, solved)
+
+
+def fit_ratings(matrix, prior_precision=PRIOR_PRECISION, max_iterations=MAX_ITERATIONS, tolerance=TOLERANCE):
+    """Fit (ability, difficulty, iterations) for the matrix's users and puzzles"""
+    user_count, puzzle_count = len(matrix.user_ids), len(matrix.puzzle_ids)
+    ability = np.zeros(user_count)
+    difficulty = np.zeros(puzzle_count)
+    if len(matrix.trials) == 0:
+        return ability, difficulty, 0
+
+    users, puzzles = matrix.user_index, matrix.puzzle_index
+    trials = matrix.trials.astype(np.float64)
+    solved = matrix.solved.astype(np.float64)
+
+    def _residual_and_information():
+        expected = _sigmoid(ability[users] - difficulty[puzzles])
+        return solved - trials * expected, trials * expected * (1.0 - expected)
+
+    iteration = 0
+    for iteration in range(1, max_iterations + 1):
+        residual, information = _residual_and_information()
+        ability_step = np.clip(
+            (np.bincount(users, residual, user_count) - prior_precision * ability)
+            / (np.bincount(users, information, user_count) + prior_precision),
+            -MAX_STEP, MAX_STEP,
+        )
+        ability += ability_step
+
+        residual, information = _residual_and_information()
+        difficulty_step = np.clip(
+            (-np.bincount(puzzles, residual, puzzle_count) - prior_precision * difficulty)
+            / (np.bincount(puzzles, information, puzzle_count) + prior_precision),
+            -MAX_STEP, MAX_STEP,
+        )
+        difficulty += difficulty_step
+
+        if max(np.abs(ability_step).max(), np.abs(difficulty_step).max()) < tolerance:
+            break
+
+    return ability, difficulty, iteration
+
+
+def _store(model, key_name, value_name, keys, values, trial_counts, valid_keys, now):
+    existing = {getattr(row, key_name): row for row in model.query.all()}
+    fitted = set()
+
+    for key, value, trial_count in zip(keys.tolist(), values.tolist(), trial_counts.tolist()):
+        if key not in valid_keys:
+            continue
+        fitted.add(key)
+        row = existing.get(key)
+        if row is None:
+            row = model(**{key_name: key})
+            db.session.add(row)
+        setattr(row, value_name, value)
+        row.trial_count = int(trial_count)
+        row.fitted_at = now
+        row.updated_at = now
+
+    for key, row in existing.items():
+        if key not in fitted:
+            db.session.delete(row)
+
+    return len(fitted)
+
+
+def refit_ratings():
+    """Refit every rating from all submissions; returns (puzzles, users, iterations)"""
+    matrix = build_outcome_matrix(submission_arrays.get())
+    ability, difficulty, iterations = fit_ratings(matrix)
+
+    now = datetime.now(timezone.utc)
+    puzzle_trials = np.bincount(matrix.puzzle_index, weights=matrix.trials, minlength=len(matrix.puzzle_ids))
+    user_trials = np.bincount(matrix.user_index, weights=matrix.trials, minlength=len(matrix.user_ids))
+
+    # Puzzles or users deleted since the submissions were read are skipped
+    puzzle_ids = {puzzle_id for (puzzle_id,) in db.session.query(Puzzle.id)}
+    user_ids = {user_id for (user_id,) in db.session.query(User.id)}
+
+    puzzle_count = _store(
+        PuzzleRating, 'puzzle_id', 'difficulty', matrix.puzzle_ids, difficulty, puzzle_trials, puzzle_ids, now
+    )
+    user_count = _store(
+        UserRating, 'user_id', 'ability', matrix.user_ids, ability, user_trials, user_ids, now
+    )
+    db.session.commit()
+    return puzzle_count, user_count, iterations
+
+
+def _nudge(model, key_column, key_name, key, value_name, delta):
+    """Add delta to one rating and count the trial, creating the row if missing"""
+    now = datetime.now(timezone.utc)
+    values = {
+        value_name: getattr(model, value_name) + delta,
+        'trial_count': model.trial_count + 1,
+        'updated_at': now,
+    }
+    if db.session.execute(update(model).where(key_column == key).values(**values)).rowcount:
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**{key_name: key, value_name: delta, 'trial_count': 1, 'updated_at': now}))
+    except IntegrityError:
+        db.session.execute(update(model).where(key_column == key).values(**values))
+
+
+def record_rating(submission):
+    """Move the user's ability and the puzzle's difficulty after one submission (caller commits)"""
+    step = current_app.config.get('RATING_UPDATE_STEP', 0.1)
+    puzzle_rating = db.session.get(PuzzleRating, submission.puzzle_id)
+    user_rating = db.session.get(UserRating, submission.user_id)
+    difficulty = puzzle_rating.difficulty if puzzle_rating else 0.0
+    ability = user_rating.ability if user_rating else 0.0
+
+    expected = 1.0 / (1.0 + math.exp(difficulty - ability))
+    delta = step * ((1.0 if submission.is_correct else 0.0) - expected)
+
+    _nudge(PuzzleRating, PuzzleRating.puzzle_id, 'puzzle_id', submission.puzzle_id, 'difficulty', -delta)
+    _nudge(UserRating, UserRating.user_id, 'user_id', submission.user_id, 'ability', delta)
+
+
+def forget_puzzle_rating(puzzle_id):
+    """Remove a puzzle's rating before the puzzle itself is deleted"""
+    PuzzleRating.query.filter_by(puzzle_id=puzzle_id).delete()
+
+
+def forget_user_rating(user_id):
+    """Remove a user's rating before the user itself is deleted"""
+    UserRating.query.filter_by(user_id=user_id).delete()
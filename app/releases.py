@@ -0,0 +1,147 @@
+"""
+Release announcements.
+
+An issue is released at its available_date (UTC) and a hint when its
+unlock_date begins, the moment puzzle pages start showing it. Each release
+is announced exactly once: announce_issue() and announce_hint() first
+claim a unique (kind, subject_id) row in notification_ledger and queue the
+emails in the same transaction, so a second scheduler, a restart, or the
+add-issue form racing the scheduler finds the row taken and sends nothing.
+Releases more than NOTIFICATION_MAX_LATENESS_HOURS in the past are never
+announced by the scheduler, so downtime is caught up on but old issues
+and hints are not.
+
+RELEASE_WARMUP_SECONDS before an issue is released the scheduler prepares
+it (see prepare_release), and the web processes warm their own caches (see
+issue_cache). Its announcement then queues the emails in waves of
+RELEASE_WAVE_SIZE recipients, RELEASE_WAVE_SECONDS apart, so visitors
+arrive at a rate the site can serve rather than all at once.
+"""
+from datetime import datetime, time, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import and_, exists, func
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .email import notify_all_users_new_issue, notify_users_new_hint
+from .models import Hint, Issue, NotificationLedger, Puzzle
+from .stats import ensure_puzzle_stats
+from .utils import as_utc
+
+
+def hint_release_at(unlock_date):
+    """When a hint unlocking on unlock_date becomes visible (the server's local midnight)"""
+    return datetime.combine(unlock_date, time.min).astimezone(timezone.utc)
+
+
+def _not_announced(kind, id_column):
+    return ~exists().where(and_(NotificationLedger.kind == kind, NotificationLedger.subject_id == id_column))
+
+
+def _claim(kind, subject_id):
+    """Record the release as announced; False (after rolling back) if it already was"""
+    # A plain flush rather than a savepoint: pysqlite commits a savepoint
+    # released outside a transaction, which would keep the claim even if
+    # queueing the emails then failed
+    try:
+        db.session.add(NotificationLedger(kind=kind, subject_id=subject_id))
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return True
+
+
+def _record(kind, subject_id, count):
+    NotificationLedger.query.filter_by(kind=kind, subject_id=subject_id).update(
+        {'recipient_count': count}, synchronize_session=False
+    )
+    return count
+
+
+def announce_issue(issue):
+    """Queue an issue's release notifications unless already announced (caller commits).
+
+    Call with no other uncommitted changes: a duplicate rolls the session back.
+    """
+    if not _claim('issue', issue.id):
+        return None
+    return _record('issue', issue.id, notify_all_users_new_issue(issue))
+
+
+def announce_hint(hint):
+    """Queue a hint's unlock notifications unless already announced (caller commits, as above)"""
+    if not _claim('hint', hint.id):
+        return None
+    return _record('hint', hint.id, notify_users_new_hint(hint.puzzle, hint))
+
+
+def due_releases(now=None):
+    """Issues and hints released within the lateness limit that haven't been announced"""
+    now = now or datetime.now(timezone.utc)
+    earliest = now - timedelta(hours=current_app.config.get('NOTIFICATION_MAX_LATENESS_HOURS', 24))
+
+    issues = Issue.query.filter(
+        Issue.available_date <= now,
+        Issue.available_date >= earliest,
+        _not_announced('issue', Issue.id),
+    ).order_by(Issue.available_date.asc()).all()
+
+    # Unlock dates are whole days; narrow to the exact instant below
+    hints = Hint.query.filter(
+        Hint.unlock_date <= now.astimezone().date(),
+        Hint.unlock_date >= earliest.astimezone().date(),
+        _not_announced('hint', Hint.id),
+    ).order_by(Hint.unlock_date.asc(), Hint.id.asc()).all()
+    hints = [hint for hint in hints if earliest <= hint_release_at(hint.unlock_date) <= now]
+    return issues, hints
+
+
+def next_release_at(now=None):
+    """The next instant an issue or hint is released after now, or None"""
+    now = now or datetime.now(timezone.utc)
+    next_issue = db.session.query(func.min(Issue.available_date)).filter(Issue.available_date > now).scalar()
+    next_unlock = db.session.query(func.min(Hint.unlock_date)).filter(
+        Hint.unlock_date > now.astimezone().date()
+    ).scalar()
+
+    candidates = []
+    if next_issue is not None:
+        candidates.append(as_utc(next_issue))
+    if next_unlock is not None:
+        candidates.append(hint_release_at(next_unlock))
+    return min(candidates, default=None)
+
+
+def _warmup():
+    return timedelta(seconds=current_app.config.get('RELEASE_WARMUP_SECONDS', 300))
+
+
+def issues_to_prepare(now=None):
+    """Issues released within the next RELEASE_WARMUP_SECONDS"""
+    now = now or datetime.now(timezone.utc)
+    return Issue.query.filter(
+        Issue.available_date > now,
+        Issue.available_date <= now + _warmup(),
+    ).order_by(Issue.available_date.asc()).all()
+
+
+def prepare_release(issue):
+    """Create the issue's puzzle stats rows before its first submissions arrive (caller commits)"""
+    puzzle_ids = [puzzle_id for (puzzle_id,) in db.session.query(Puzzle.id).filter(Puzzle.issue_id == issue.id)]
+    return ensure_puzzle_stats(puzzle_ids)
+
+
+def next_preparation_at(now=None):
+    """When the next issue not yet within its warm-up window should be prepared, or None"""
+    now = now or datetime.now(timezone.utc)
+    next_issue = db.session.query(func.min(Issue.available_date)).filter(
+        Issue.available_date > now + _warmup()
+    ).scalar()
+    return as_utc(next_issue) - _warmup() if next_issue is not None else None
+
+
+def forget_release(kind, subject_id):
+    """Drop a deleted issue's or hint's ledger row so a reused id is announced again"""
+    NotificationLedger.query.filter_by(kind=kind, subject_id=subject_id).delete()
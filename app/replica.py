@@ -0,0 +1,214 @@
+"""
+Read-replica routing for reporting queries.
+
+When DATABASE_REPLICA_URL is set it becomes the 'replica' entry in
+SQLALCHEMY_BINDS. Nothing is sent there implicitly: only functions wrapped
+with @replica_reads (the admin reports, dashboard, analytics and exports)
+run their queries on the replica, and any flush inside them still goes to
+the primary. Everything else, including the submission path, stays on the
+primary.
+
+Each worker checks the replica every REPLICA_CHECK_INTERVAL_SECONDS. The
+lag is the age of the oldest submission the primary has that the replica
+does not; if that exceeds REPLICA_MAX_LAG_SECONDS, or the replica cannot be
+reached, wrapped reads use the primary until a later check passes. A query
+that fails on the replica marks it down and is retried once on the primary;
+a streamed read is only retried if it fails before yielding its first row,
+and otherwise re-raises after marking the replica down.
+A request that writes pins that browser session to the primary for
+REPLICA_MAX_LAG_SECONDS so it reads its own writes.
+"""
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, func, select
+from sqlalchemy.exc import DBAPIError
+
+REPLICA_BIND = 'replica'
+PIN_SESSION_KEY = 'primary_pinned_until'
+
+_reading_replica = contextvars.ContextVar('reading_replica', default=False)
+
+
+class RoutingSession(Session):
+    """db.session class that sends reads to the replica inside @replica_reads"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _reading_replica.get() and not self._flushing:
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _note_write(session_, flush_context):
+    if has_request_context():
+        g.wrote_to_primary = True
+
+
+class ReplicaRouter:
+    """Per-worker view of whether the replica is usable right now."""
+
+    def __init__(self):
+        self.app = None
+        self.max_lag_seconds = 30
+        self.check_interval_seconds = 10
+        self.healthy = False
+        self.lag_seconds = None
+        self.last_error = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read the replica settings and pin writers to the primary"""
+        self.app = app
+        self.max_lag_seconds = app.config.get('REPLICA_MAX_LAG_SECONDS', self.max_lag_seconds)
+        self.check_interval_seconds = app.config.get('REPLICA_CHECK_INTERVAL_SECONDS', self.check_interval_seconds)
+        self._checked_at = None
+
+        @app.after_request
+        def _pin_writer_to_primary(response):
+            if self.configured() and g.get('wrote_to_primary'):
+                session[PIN_SESSION_KEY] = time.time() + self.max_lag_seconds
+            return response
+
+    def configured(self):
+        return bool((self.app.config.get('SQLALCHEMY_BINDS') or {}).get(REPLICA_BIND))
+
+    def _engines(self):
+        from . import db
+
+        return db.engines[None], db.engines[REPLICA_BIND]
+
+    def measure_lag(self):
+        """Seconds the replica is behind on submissions (0 if it has them all)"""
+        from .models import Submission
+
+        primary, replica = self._engines()
+        with replica.connect() as connection:
+            replica_max_id = connection.execute(select(func.max(Submission.id))).scalar() or 0
+        with primary.connect() as connection:
+            oldest_missing = connection.execute(
+                select(func.min(Submission.submitted_at)).where(Submission.id > replica_max_id)
+            ).scalar()
+
+        if oldest_missing is None:
+            return 0.0
+        if oldest_missing.tzinfo is None:
+            oldest_missing = oldest_missing.replace(tzinfo=timezone.utc)
+        return max(0.0, (datetime.now(timezone.utc) - oldest_missing).total_seconds())
+
+    def check(self):
+        """Re-measure the replica's health and lag now"""
+        try:
+            self.lag_seconds = self.measure_lag()
+            self.healthy = self.lag_seconds <= self.max_lag_seconds
+            self.last_error = None if self.healthy else f'replica is {self.lag_seconds:.0f}s behind'
+        except Exception as e:
+            self.healthy = False
+            self.lag_seconds = None
+            self.last_error = str(e)
+            print(f"Read replica unavailable, using the primary: {e}")
+        self._checked_at = time.monotonic()
+        return self.healthy
+
+    def mark_down(self, error):
+        """Stop using the replica until the next check"""
+        error = getattr(error, 'orig', error)
+        self.healthy = False
+        self.lag_seconds = None
+        self.last_error = str(error)
+        self._checked_at = time.monotonic()
+        print(f"Read replica query failed, using the primary: {error}")
+
+    def usable(self):
+        """Whether a @replica_reads call starting now should use the replica"""
+        if not self.configured():
+            return False
+        if has_request_context() and session.get(PIN_SESSION_KEY, 0) > time.time():
+            return False
+
+        checked_at = self._checked_at
+        if checked_at is None or time.monotonic() - checked_at > self.check_interval_seconds:
+            # One thread re-checks; the rest keep the last answer meanwhile
+            if self._lock.acquire(blocking=checked_at is None):
+                try:
+                    self.check()
+                finally:
+                    self._lock.release()
+        return self.healthy
+
+    def status(self):
+        """Summary for the health endpoint"""
+        if not self.configured():
+            return {'status': 'disabled'}
+        return {
+            'status': 'healthy' if self.healthy else 'degraded',
+            'lag_seconds': self.lag_seconds,
+            'message': self.last_error or 'Reads are served by the replica',
+        }
+
+
+def _on_replica(function, *args, **kwargs):
+    token = _reading_replica.set(True)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _reading_replica.reset(token)
+
+
+def replica_reads(function):
+    """Run a read-only function (or generator) on the replica when it is usable"""
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def generator(*args, **kwargs):
+            if not replica.usable():
+                yield from function(*args, **kwargs)
+                return
+            rows = function(*args, **kwargs)
+            started = False
+            while True:
+                try:
+                    row = _on_replica(next, rows)
+                except StopIteration:
+                    return
+                except DBAPIError as e:
+                    from . import db
+
+                    db.session.rollback()
+                    replica.mark_down(e)
+                    # Rows already sent can't be taken back, so only a
+                    # stream that fails before its first row is retried
+                    if started:
+                        raise
+                    rows.close()
+                    yield from function(*args, **kwargs)
+                    return
+                started = True
+                yield row
+        return generator
+
+    @functools.wraps(function)
+    def decorated_function(*args, **kwargs):
+        if not replica.usable():
+            return function(*args, **kwargs)
+        try:
+            return _on_replica(function, *args, **kwargs)
+        except DBAPIError as e:
+            from . import db
+
+            db.session.rollback()
+            replica.mark_down(e)
+            return function(*args, **kwargs)
+    return decorated_function
+
+
+# Global replica router (one per worker process)
+replica = ReplicaRouter()
@@ -0,0 +1,110 @@
+"""
+Per-worker cache of computed admin reports.
+
+Entries are keyed by report name and normalized filter/sort arguments and are
+reused while both their TTL and the data version hold. The data version is a
+cheap fingerprint of the tables the reports read, so a new submission, user,
+puzzle or issue invalidates cached reports in every worker on its next read.
+Concurrent requests for the same missing report in a worker wait on a striped
+lock while a single thread computes it.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import func, select
+
+from . import db
+
+LOCK_STRIPES = 64
+
+
+def current_data_version():
+    """Fingerprint of the data behind the reports, fetched in one round trip"""
+    from .models import Issue, Puzzle, Submission, User
+
+    return tuple(db.session.execute(
+        select(
+            select(func.max(Submission.id)).scalar_subquery(),
+            select(func.count(User.id)).scalar_subquery(),
+            select(func.max(User.id)).scalar_subquery(),
+            select(func.count(Puzzle.id)).scalar_subquery(),
+            select(func.max(Puzzle.id)).scalar_subquery(),
+            select(func.count(Issue.id)).scalar_subquery(),
+            select(func.max(Issue.id)).scalar_subquery(),
+        )
+    ).one())
+
+
+class ReportCache:
+    """TTL + data-version cache with single-flight computation per key."""
+
+    def __init__(self, ttl_seconds=60, max_entries=256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._entries_lock = threading.Lock()
+        self._compute_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def init_app(self, app):
+        """Read cache limits from the Flask config"""
+        self.ttl_seconds = app.config.get('REPORT_CACHE_TTL_SECONDS', self.ttl_seconds)
+        self.max_entries = app.config.get('REPORT_CACHE_MAX_ENTRIES', self.max_entries)
+        self.invalidate()
+
+    @staticmethod
+    def _key(report_name, params):
+        return report_name, tuple(sorted((params or {}).items()))
+
+    def _fresh_value(self, key, version):
+        with self._entries_lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry_version, expires_at, value = entry
+            if entry_version != version or expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _store(self, key, version, value):
+        with self._entries_lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, report_name, params, compute):
+        """Return the cached report, computing it at most once per worker"""
+        if self.ttl_seconds <= 0:
+            return compute()
+
+        key = self._key(report_name, params)
+        version = current_data_version()
+        value = self._fresh_value(key, version)
+        if value is not None:
+            return value
+
+        with self._compute_locks[hash(key) % LOCK_STRIPES]:
+            # Another thread may have filled it while we waited
+            value = self._fresh_value(key, version)
+            if value is None:
+                value = compute()
+                self._store(key, version, value)
+        return value
+
+    def peek(self, report_name, params):
+        """Return a fresh cached report without computing it, or None"""
+        if self.ttl_seconds <= 0:
+            return None
+        return self._fresh_value(self._key(report_name, params), current_data_version())
+
+    def invalidate(self):
+        """Drop every cached report, e.g. after an admin edit"""
+        with self._entries_lock:
+            self._entries.clear()
+
+
+# Global report cache instance (one per worker process)
+report_cache = ReportCache()
@@ -1,7 +1,16 @@
-from sqlalchemy import and_, case, distinct, func
+import base64
+import json
+
+from sqlalchemy import Float, and_, case, cast, func, or_, select, true
 
 from . import db
-from .models import Issue, Puzzle, Submission, User
+from .models import Erratum, Issue, Puzzle, PuzzleRating, PuzzleStats, Submission, User, UserRating, UserStats
+from .ratings import to_elo
+from .replica import replica_reads
+
+
+# Rows fetched per round trip when streaming a report (server-side cursor on PostgreSQL)
+STREAM_BATCH_SIZE = 1000
 
 
 def _safe_percentage(numerator, denominator):
@@ -10,10 +19,72 @@ def _safe_percentage(numerator, denominator):
     return (numerator / denominator) * 100
 
 
-def get_admin_dashboard_reporting_summary(limit=5):
-    solved_count_expr = func.count(
-        distinct(case((Submission.is_correct == True, Submission.user_id), else_=None))
+@replica_reads
+def get_admin_dashboard_counters():
+    """Every dashboard headline counter in one statement of scalar subqueries"""
+    # Submission totals come from the materialized puzzle_stats counters
+    # rather than scanning (and de-duplicating) the whole submission table.
+    def _count(column):
+        return select(func.count(column)).scalar_subquery()
+
+    def _total(column):
+        return select(func.coalesce(func.sum(column), 0)).scalar_subquery()
+
+    row = db.session.execute(
+        select(
+            _count(User.id).label("total_users"),
+            _count(Puzzle.id).label("total_puzzles"),
+            _count(Issue.id).label("total_issues"),
+            _count(Erratum.id).label("total_errata"),
+            _total(PuzzleStats.attempt_count).label("total_submissions"),
+            _total(PuzzleStats.correct_submission_count).label("correct_submissions"),
+            _total(PuzzleStats.solve_count).label("total_distinct_solves"),
+        )
+    ).one()
+    return {key: int(value or 0) for key, value in row._mapping.items()}
+
+
+@replica_reads
+def get_admin_dashboard_recent_activity(limit=5):
+    """Newest users and submissions, with submission users/puzzles joined in"""
+    recent_users = (
+        db.session.query(User.id, User.username, User.email, User.is_admin)
+        .order_by(User.id.desc())
+        .limit(limit)
+        .all()
     )
+    recent_submissions = (
+        db.session.query(
+            Submission.id,
+            Submission.is_correct,
+            Submission.submitted_at,
+            User.username.label("username"),
+            Puzzle.title.label("puzzle_title"),
+        )
+        .join(User, User.id == Submission.user_id)
+        .join(Puzzle, Puzzle.id == Submission.puzzle_id)
+        .order_by(Submission.submitted_at.desc())
+        .limit(limit)
+        .all()
+    )
+    return {
+        "recent_users": recent_users,
+        "recent_submissions": recent_submissions,
+    }
+
+
+@replica_reads
+def get_admin_dashboard_stats(limit=5):
+    """Everything the admin dashboard shows, in a fixed number of queries"""
+    stats = get_admin_dashboard_counters()
+    stats.update(get_admin_dashboard_recent_activity(limit))
+    stats["reporting"] = get_admin_dashboard_reporting_summary(limit)
+    return stats
+
+
+@replica_reads
+def get_admin_dashboard_reporting_summary(limit=5):
+    solved_count_expr = func.coalesce(PuzzleStats.solve_count, 0)
 
     top_solved = (
         db.session.query(
@@ -21,36 +92,30 @@ def get_admin_dashboard_reporting_summary(limit=5):
             Puzzle.title,
             solved_count_expr.label("solve_count"),
         )
-        .outerjoin(Submission, Submission.puzzle_id == Puzzle.id)
-        .group_by(Puzzle.id, Puzzle.title)
+        .outerjoin(PuzzleStats, PuzzleStats.puzzle_id == Puzzle.id)
         .order_by(solved_count_expr.desc(), Puzzle.title.asc())
         .limit(limit)
         .all()
     )
 
+    user_solved_expr = func.coalesce(UserStats.solved_puzzles, 0)
+
     top_users = (
         db.session.query(
             User.id,
             User.username,
-            func.count(
-                distinct(case((Submission.is_correct == True, Submission.puzzle_id), else_=None))
-            ).label("solved_puzzles"),
+            user_solved_expr.label("solved_puzzles"),
         )
-        .outerjoin(Submission, Submission.user_id == User.id)
-        .group_by(User.id, User.username)
-        .order_by(func.count(distinct(case((Submission.is_correct == True, Submission.puzzle_id), else_=None))).desc(), User.username.asc())
+        .outerjoin(UserStats, UserStats.user_id == User.id)
+        .order_by(user_solved_expr.desc(), User.username.asc())
         .limit(limit)
         .all()
     )
 
     unsolved_puzzles = (
         db.session.query(Puzzle.id, Puzzle.title)
-        .outerjoin(
-            Submission,
-            and_(Submission.puzzle_id == Puzzle.id, Submission.is_correct == True),
-        )
-        .group_by(Puzzle.id, Puzzle.title)
-        .having(func.count(Submission.id) == 0)
+        .outerjoin(PuzzleStats, PuzzleStats.puzzle_id == Puzzle.id)
+        .filter(solved_count_expr == 0)
         .order_by(Puzzle.title.asc())
         .limit(limit)
         .all()
@@ -63,12 +128,10 @@ def get_admin_dashboard_reporting_summary(limit=5):
     }
 
 
-def get_puzzle_report_rows(issue_id=None, sort="most_solved"):
-    solve_count_expr = func.count(
-        distinct(case((Submission.is_correct == True, Submission.user_id), else_=None))
-    )
-    attempts_expr = func.count(Submission.id)
-    correct_submissions_expr = func.sum(case((Submission.is_correct == True, 1), else_=0))
+def _puzzle_report_query(issue_id=None, sort="most_solved"):
+    solve_count_expr = func.coalesce(PuzzleStats.solve_count, 0)
+    attempts_expr = func.coalesce(PuzzleStats.attempt_count, 0)
+    correct_submissions_expr = func.coalesce(PuzzleStats.correct_submission_count, 0)
 
     query = (
         db.session.query(
@@ -79,10 +142,11 @@ def get_puzzle_report_rows(issue_id=None, sort="most_solved"):
             solve_count_expr.label("solve_count"),
             attempts_expr.label("attempt_count"),
             correct_submissions_expr.label("correct_submission_count"),
+            PuzzleRating.difficulty.label("difficulty"),
         )
         .outerjoin(Issue, Puzzle.issue_id == Issue.id)
-        .outerjoin(Submission, Submission.puzzle_id == Puzzle.id)
-        .group_by(Puzzle.id, Puzzle.title, Issue.id, Issue.title)
+        .outerjoin(PuzzleStats, PuzzleStats.puzzle_id == Puzzle.id)
+        .outerjoin(PuzzleRating, PuzzleRating.puzzle_id == Puzzle.id)
     )
 
     if issue_id:
@@ -92,34 +156,48 @@ def get_puzzle_report_rows(issue_id=None, sort="most_solved"):
         query = query.order_by(solve_count_expr.asc(), Puzzle.title.asc())
     elif sort == "most_attempted":
         query = query.order_by(attempts_expr.desc(), Puzzle.title.asc())
+    elif sort == "hardest":
+        query = query.order_by(func.coalesce(PuzzleRating.difficulty, 0.0).desc(), Puzzle.title.asc())
+    elif sort == "easiest":
+        query = query.order_by(func.coalesce(PuzzleRating.difficulty, 0.0).asc(), Puzzle.title.asc())
     elif sort == "title":
         query = query.order_by(Puzzle.title.asc())
     else:
         query = query.order_by(solve_count_expr.desc(), Puzzle.title.asc())
 
-    rows = query.all()
-
-    return [
-        {
-            "puzzle_id": row.puzzle_id,
-            "puzzle_title": row.puzzle_title,
-            "issue_id": row.issue_id,
-            "issue_title": row.issue_title,
-            "solve_count": int(row.solve_count or 0),
-            "attempt_count": int(row.attempt_count or 0),
-            "correct_submission_count": int(row.correct_submission_count or 0),
-            "success_rate": _safe_percentage(
-                int(row.correct_submission_count or 0),
-                int(row.attempt_count or 0),
-            ),
-        }
-        for row in rows
-    ]
+    return query
 
 
-def get_puzzle_solver_rows(puzzle_id):
-    puzzle = Puzzle.query.get_or_404(puzzle_id)
+def _puzzle_report_row(row):
+    return {
+        "puzzle_id": row.puzzle_id,
+        "puzzle_title": row.puzzle_title,
+        "issue_id": row.issue_id,
+        "issue_title": row.issue_title,
+        "solve_count": int(row.solve_count or 0),
+        "attempt_count": int(row.attempt_count or 0),
+        "correct_submission_count": int(row.correct_submission_count or 0),
+        "success_rate": _safe_percentage(
+            int(row.correct_submission_count or 0),
+            int(row.attempt_count or 0),
+        ),
+        "difficulty_rating": to_elo(row.difficulty),
+    }
+
 
+@replica_reads
+def get_puzzle_report_rows(issue_id=None, sort="most_solved"):
+    return [_puzzle_report_row(row) for row in _puzzle_report_query(issue_id, sort).all()]
+
+
+@replica_reads
+def iter_puzzle_report_rows(issue_id=None, sort="most_solved"):
+    query = _puzzle_report_query(issue_id, sort).yield_per(STREAM_BATCH_SIZE)
+    for row in query:
+        yield _puzzle_report_row(row)
+
+
+def _puzzle_solver_query(puzzle_id):
     first_correct_subq = (
         db.session.query(
             Submission.user_id.label("user_id"),
@@ -159,27 +237,37 @@ def get_puzzle_solver_rows(puzzle_id):
         .order_by(first_correct_subq.c.first_correct_at.asc(), User.username.asc())
     )
 
-    rows = solver_stats_query.all()
+    return solver_stats_query
 
-    return puzzle, [
-        {
-            "user_id": row.user_id,
-            "username": row.username,
-            "first_correct_at": row.first_correct_at,
-            "attempt_count": int(row.attempt_count or 0),
-            "correct_submission_count": int(row.correct_submission_count or 0),
-            "incorrect_before_solve": int(row.incorrect_before_solve or 0),
-        }
-        for row in rows
-    ]
 
+def _puzzle_solver_row(row):
+    return {
+        "user_id": row.user_id,
+        "username": row.username,
+        "first_correct_at": row.first_correct_at,
+        "attempt_count": int(row.attempt_count or 0),
+        "correct_submission_count": int(row.correct_submission_count or 0),
+        "incorrect_before_solve": int(row.incorrect_before_solve or 0),
+    }
+
+
+@replica_reads
+def get_puzzle_solver_rows(puzzle_id):
+    puzzle = Puzzle.query.get_or_404(puzzle_id)
+    return puzzle, [_puzzle_solver_row(row) for row in _puzzle_solver_query(puzzle_id).all()]
+
+
+@replica_reads
+def iter_puzzle_solver_rows(puzzle_id):
+    query = _puzzle_solver_query(puzzle_id).yield_per(STREAM_BATCH_SIZE)
+    for row in query:
+        yield _puzzle_solver_row(row)
 
-def get_user_report_rows(sort="most_solved"):
-    solved_count_expr = func.count(
-        distinct(case((Submission.is_correct == True, Submission.puzzle_id), else_=None))
-    )
-    attempts_expr = func.count(Submission.id)
-    correct_submissions_expr = func.sum(case((Submission.is_correct == True, 1), else_=0))
+
+def _user_report_query(sort="most_solved"):
+    solved_count_expr = func.coalesce(UserStats.solved_puzzles, 0)
+    attempts_expr = func.coalesce(UserStats.attempt_count, 0)
+    correct_submissions_expr = func.coalesce(UserStats.correct_submission_count, 0)
 
     query = (
         db.session.query(
@@ -189,59 +277,66 @@ def get_user_report_rows(sort="most_solved"):
             solved_count_expr.label("solved_puzzles"),
             attempts_expr.label("attempt_count"),
             correct_submissions_expr.label("correct_submission_count"),
+            UserRating.ability.label("ability"),
         )
-        .outerjoin(Submission, Submission.user_id == User.id)
-        .group_by(User.id, User.username, User.email)
+        .outerjoin(UserStats, UserStats.user_id == User.id)
+        .outerjoin(UserRating, UserRating.user_id == User.id)
     )
 
     if sort == "most_attempted":
         query = query.order_by(attempts_expr.desc(), User.username.asc())
+    elif sort == "strongest":
+        query = query.order_by(func.coalesce(UserRating.ability, 0.0).desc(), User.username.asc())
     elif sort == "username":
         query = query.order_by(User.username.asc())
     else:
         query = query.order_by(solved_count_expr.desc(), User.username.asc())
 
-    rows = query.all()
-
-    return [
-        {
-            "user_id": row.user_id,
-            "username": row.username,
-            "email": row.email,
-            "solved_puzzles": int(row.solved_puzzles or 0),
-            "attempt_count": int(row.attempt_count or 0),
-            "correct_submission_count": int(row.correct_submission_count or 0),
-            "success_rate": _safe_percentage(
-                int(row.correct_submission_count or 0),
-                int(row.attempt_count or 0),
-            ),
-        }
-        for row in rows
-    ]
+    return query
 
 
-def get_user_issue_progress_rows(user_id=None, issue_id=None, sort="best_completion"):
-    issue_query = (
+def _user_report_row(row):
+    return {
+        "user_id": row.user_id,
+        "username": row.username,
+        "email": row.email,
+        "solved_puzzles": int(row.solved_puzzles or 0),
+        "attempt_count": int(row.attempt_count or 0),
+        "correct_submission_count": int(row.correct_submission_count or 0),
+        "success_rate": _safe_percentage(
+            int(row.correct_submission_count or 0),
+            int(row.attempt_count or 0),
+        ),
+        "ability_rating": to_elo(row.ability),
+    }
+
+
+@replica_reads
+def get_user_report_rows(sort="most_solved"):
+    return [_user_report_row(row) for row in _user_report_query(sort).all()]
+
+
+@replica_reads
+def iter_user_report_rows(sort="most_solved"):
+    query = _user_report_query(sort).yield_per(STREAM_BATCH_SIZE)
+    for row in query:
+        yield _user_report_row(row)
+
+
+def _issue_progress_query(user_id=None, issue_id=None):
+    """Users x issues (with puzzles) joined to solved counts, computed in SQL"""
+    issue_totals_query = (
         db.session.query(
             Issue.id.label("issue_id"),
             Issue.title.label("issue_title"),
             func.count(Puzzle.id).label("total_puzzles"),
         )
-        .outerjoin(Puzzle, Puzzle.issue_id == Issue.id)
+        .join(Puzzle, Puzzle.issue_id == Issue.id)
         .group_by(Issue.id, Issue.title)
-        .order_by(Issue.title.asc())
     )
-
     if issue_id:
-        issue_query = issue_query.filter(Issue.id == issue_id)
-
-    issues = issue_query.all()
-
-    user_query = db.session.query(User.id.label("user_id"), User.username.label("username")).order_by(User.username.asc())
-    if user_id:
-        user_query = user_query.filter(User.id == user_id)
-
-    users = user_query.all()
+        issue_totals_query = issue_totals_query.filter(Issue.id == issue_id)
+    issue_totals = issue_totals_query.subquery()
 
     solved_pairs_query = (
         db.session.query(
@@ -253,56 +348,164 @@ def get_user_issue_progress_rows(user_id=None, issue_id=None, sort="best_complet
         .filter(Submission.is_correct == True, Puzzle.issue_id.isnot(None))
         .group_by(Submission.user_id, Puzzle.issue_id, Submission.puzzle_id)
     )
-
     if user_id:
         solved_pairs_query = solved_pairs_query.filter(Submission.user_id == user_id)
     if issue_id:
         solved_pairs_query = solved_pairs_query.filter(Puzzle.issue_id == issue_id)
-
-    solved_pairs_subq = solved_pairs_query.subquery()
+    solved_pairs = solved_pairs_query.subquery()
 
     solved_counts = (
         db.session.query(
-            solved_pairs_subq.c.user_id,
-            solved_pairs_subq.c.issue_id,
-            func.count(solved_pairs_subq.c.puzzle_id).label("solved_count"),
+            solved_pairs.c.user_id,
+            solved_pairs.c.issue_id,
+            func.count(solved_pairs.c.puzzle_id).label("solved_count"),
         )
-        .group_by(solved_pairs_subq.c.user_id, solved_pairs_subq.c.issue_id)
-        .all()
+        .group_by(solved_pairs.c.user_id, solved_pairs.c.issue_id)
+        .subquery()
     )
 
-    solved_map = {
-        (row.user_id, row.issue_id): int(row.solved_count or 0)
-        for row in solved_counts
+    columns = {
+        "user_id": User.id,
+        "username": User.username,
+        "issue_id": issue_totals.c.issue_id,
+        "issue_title": issue_totals.c.issue_title,
+        "solved_count": func.coalesce(solved_counts.c.solved_count, 0),
+        "total_puzzles": issue_totals.c.total_puzzles,
     }
 
-    rows = []
-    for user_row in users:
-        for issue_row in issues:
-            total_puzzles = int(issue_row.total_puzzles or 0)
-            if total_puzzles == 0:
-                continue
-
-            solved_count = solved_map.get((user_row.user_id, issue_row.issue_id), 0)
-            rows.append(
-                {
-                    "user_id": user_row.user_id,
-                    "username": user_row.username,
-                    "issue_id": issue_row.issue_id,
-                    "issue_title": issue_row.issue_title,
-                    "solved_count": solved_count,
-                    "total_puzzles": total_puzzles,
-                    "completion_rate": _safe_percentage(solved_count, total_puzzles),
-                }
-            )
-
-    if sort == "least_completion":
-        rows.sort(key=lambda row: (row["completion_rate"], row["username"], row["issue_title"]))
-    elif sort == "username":
-        rows.sort(key=lambda row: (row["username"], -row["completion_rate"], row["issue_title"]))
-    elif sort == "issue":
-        rows.sort(key=lambda row: (row["issue_title"], -row["completion_rate"], row["username"]))
-    else:
-        rows.sort(key=lambda row: (-row["completion_rate"], row["username"], row["issue_title"]))
+    query = (
+        db.session.query(*(expr.label(name) for name, expr in columns.items()))
+        .select_from(User)
+        .join(issue_totals, true())
+        .outerjoin(
+            solved_counts,
+            and_(
+                solved_counts.c.user_id == User.id,
+                solved_counts.c.issue_id == issue_totals.c.issue_id,
+            ),
+        )
+    )
+    if user_id:
+        query = query.filter(User.id == user_id)
+
+    return query, columns
+
+
+# Sort name -> ordered (key, direction) pairs; the trailing ids make the order
+# total so keyset pagination never skips or repeats rows.
+ISSUE_PROGRESS_SORTS = {
+    "best_completion": [("completion", "desc"), ("username", "asc"), ("issue_title", "asc"), ("user_id", "asc"), ("issue_id", "asc")],
+    "least_completion": [("completion", "asc"), ("username", "asc"), ("issue_title", "asc"), ("user_id", "asc"), ("issue_id", "asc")],
+    "username": [("username", "asc"), ("completion", "desc"), ("issue_title", "asc"), ("user_id", "asc"), ("issue_id", "asc")],
+    "issue": [("issue_title", "asc"), ("completion", "desc"), ("username", "asc"), ("issue_id", "asc"), ("user_id", "asc")],
+}
+
+
+def _issue_progress_order(columns, sort):
+    keys = ISSUE_PROGRESS_SORTS.get(sort, ISSUE_PROGRESS_SORTS["best_completion"])
+    completion_expr = cast(columns["solved_count"], Float) / columns["total_puzzles"]
+
+    order_by = []
+    for key, direction in keys:
+        expr = completion_expr if key == "completion" else columns[key]
+        order_by.append(expr.desc() if direction == "desc" else expr.asc())
+    return keys, order_by
+
+
+def _issue_progress_after(columns, keys, cursor):
+    """WHERE clause selecting rows strictly after the cursor in sort order"""
+    solved = columns["solved_count"]
+    total = columns["total_puzzles"]
+
+    def compare(key, direction, strict):
+        if key == "completion":
+            # Compare solved/total ratios exactly by cross-multiplying
+            lhs = solved * cursor["total_puzzles"]
+            rhs = cursor["solved_count"] * total
+        else:
+            lhs = columns[key]
+            rhs = cursor[key]
+        if not strict:
+            return lhs == rhs
+        return lhs < rhs if direction == "desc" else lhs > rhs
+
+    clauses = []
+    for index, (key, direction) in enumerate(keys):
+        equal_prefix = [compare(k, d, strict=False) for k, d in keys[:index]]
+        clauses.append(and_(*equal_prefix, compare(key, direction, strict=True)))
+    return or_(*clauses)
+
+
+def _issue_progress_row(row):
+    solved_count = int(row.solved_count or 0)
+    total_puzzles = int(row.total_puzzles or 0)
+    return {
+        "user_id": row.user_id,
+        "username": row.username,
+        "issue_id": row.issue_id,
+        "issue_title": row.issue_title,
+        "solved_count": solved_count,
+        "total_puzzles": total_puzzles,
+        "completion_rate": _safe_percentage(solved_count, total_puzzles),
+    }
+
+
+def _sorted_issue_progress_query(user_id=None, issue_id=None, sort="best_completion", after=None):
+    query, columns = _issue_progress_query(user_id=user_id, issue_id=issue_id)
+    keys, order_by = _issue_progress_order(columns, sort)
+    if after:
+        query = query.filter(_issue_progress_after(columns, keys, after))
+    return query.order_by(*order_by)
+
+
+def encode_progress_cursor(row):
+    payload = json.dumps(
+        [row["user_id"], row["username"], row["issue_id"], row["issue_title"], row["solved_count"], row["total_puzzles"]],
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_progress_cursor(token):
+    """Parse a page cursor, returning None if it is missing or malformed"""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        user_id, username, issue_id, issue_title, solved_count, total_puzzles = values
+        return {
+            "user_id": int(user_id),
+            "username": str(username),
+            "issue_id": int(issue_id),
+            "issue_title": str(issue_title),
+            "solved_count": int(solved_count),
+            "total_puzzles": int(total_puzzles),
+        }
+    except (ValueError, TypeError, UnicodeError):
+        return None
+
+
+@replica_reads
+def get_user_issue_progress_page(user_id=None, issue_id=None, sort="best_completion", after=None, limit=100):
+    """One keyset page of progress rows plus the cursor for the next page"""
+    query = _sorted_issue_progress_query(user_id, issue_id, sort, decode_progress_cursor(after))
+    rows = [_issue_progress_row(row) for row in query.limit(limit + 1).all()]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_progress_cursor(rows[-1])
+    return rows, next_cursor
+
+
+@replica_reads
+def get_user_issue_progress_rows(user_id=None, issue_id=None, sort="best_completion"):
+    query = _sorted_issue_progress_query(user_id, issue_id, sort)
+    return [_issue_progress_row(row) for row in query.all()]
+
 
-    return rows
+@replica_reads
+def iter_user_issue_progress_rows(user_id=None, issue_id=None, sort="best_completion"):
+    query = _sorted_issue_progress_query(user_id, issue_id, sort).yield_per(STREAM_BATCH_SIZE)
+    for row in query:
+        yield _issue_progress_row(row)
@@ -1,49 +1,83 @@
-import csv
-import io
-import os
-import uuid
-
-from flask import Blueprint, Response, current_app, request, render_template, redirect, url_for, flash
+from flask import Blueprint, Response, abort, current_app, request, render_template, redirect, send_file, url_for, flash, get_flashed_messages, stream_template, stream_with_context
+from flask_wtf.csrf import generate_csrf
 from werkzeug.security import generate_password_hash
-from werkzeug.utils import secure_filename
 from flask_login import current_user, login_required
-from datetime import datetime, timezone
-from .models import User, Puzzle, Hint, Issue, Submission, Erratum, PuzzleAnswerRule
-from .forms import PuzzleForm, HintForm, IssueForm, ErrataForm, PuzzleAnswerRuleForm
+from .models import User, Puzzle, Hint, Issue, Erratum, PuzzleAnswerRule, ReportExport
+from .forms import PuzzleForm, HintForm, IssueForm, ErrataForm, PuzzleAnswerRuleForm, ReportExportForm, EmailOutboxActionForm
 from . import db
 from .admin_utils import admin_required
 from app.puzzles import normalize_answer
-from .email import notify_all_users_new_issue
+from .email import discard_dead_email, outbox_summary, retry_dead_emails
+from .releases import forget_release
+from .scheduler import scheduler
+from .user_cache import user_cache
+from .hint_schedule import hint_schedule
+from .issue_cache import issue_cache
+from .pdf_store import store_pdf
+from .stats import forget_puzzle, forget_user
+from .ratings import forget_puzzle_rating, forget_user_rating
+from .leaderboard import leaderboard
 from .reporting import (
-    get_admin_dashboard_reporting_summary,
+    STREAM_BATCH_SIZE,
+    get_admin_dashboard_stats,
     get_puzzle_report_rows,
-    get_puzzle_solver_rows,
-    get_user_issue_progress_rows,
+    get_user_issue_progress_page,
     get_user_report_rows,
+    iter_puzzle_solver_rows,
+    iter_user_report_rows,
+)
+from .exports import (
+    REPORT_EXPORTS,
+    build_report_csv,
+    export_file_path,
+    iter_csv,
+    normalize_report_params,
+    queue_report_export,
 )
+from .report_cache import report_cache
+from .analytics import compute_issue_analytics
+from .utils import parse_optional_int
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
 ALLOWED_UPLOAD_EXTENSIONS = {'pdf'}
 
+# Rows per page on the issue progress report
+ISSUE_PROGRESS_PAGE_SIZE = 100
 
-def _parse_optional_int(value):
-    if value in (None, "", "0"):
-        return None
-    try:
-        return int(value)
-    except (TypeError, ValueError):
-        return None
+# Rendered HTML collected before each chunk of a streamed page is sent
+STREAM_CHUNK_BYTES = 16 * 1024
 
 
-def _csv_response(filename, headers, rows):
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(headers)
-    writer.writerows(rows)
+def _buffered(chunks, size=STREAM_CHUNK_BYTES):
+    """Join Jinja's many small output pieces into chunks of about size bytes"""
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= size:
+            yield ''.join(pending)
+            pending = []
+            pending_size = 0
+    if pending:
+        yield ''.join(pending)
 
+
+def _stream_page(template_name, **context):
+    """Send a page as it renders, so large report tables are never held in memory"""
+    # Headers (and the session cookie) go out before the body renders, so
+    # anything that changes the session must happen first: popping flashed
+    # messages and creating the CSRF token used by the export forms.
+    get_flashed_messages()
+    generate_csrf()
+    return Response(_buffered(stream_template(template_name, **context)), mimetype='text/html')
+
+
+def _csv_response(filename, headers, rows):
+    """Stream a CSV download; rows may be any (lazy) iterable"""
     return Response(
-        output.getvalue(),
+        stream_with_context(iter_csv(headers, rows)),
         mimetype='text/csv',
         headers={'Content-Disposition': f'attachment; filename={filename}'},
     )
@@ -56,26 +90,15 @@ def _is_allowed_upload(filename):
     return extension in ALLOWED_UPLOAD_EXTENSIONS
 
 
-def _save_issue_pdf(uploaded_file, filename_prefix):
+def _save_issue_pdf(uploaded_file):
+    """Store an uploaded PDF by its content digest; identical uploads share one file"""
     if not uploaded_file or not uploaded_file.filename:
         return None
 
     if not _is_allowed_upload(uploaded_file.filename):
         raise ValueError('Only PDF files are allowed.')
 
-    original_name = secure_filename(uploaded_file.filename)
-    _, extension = os.path.splitext(original_name)
-    timestamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
-    unique_suffix = uuid.uuid4().hex[:8]
-    final_filename = f"{filename_prefix}_{timestamp}_{unique_suffix}{extension.lower()}"
-
-    upload_dir = current_app.config.get('PDF_UPLOAD_FOLDER')
-    if not upload_dir:
-        upload_dir = os.path.join(current_app.root_path, 'static', 'pdfs')
-
-    os.makedirs(upload_dir, exist_ok=True)
-    uploaded_file.save(os.path.join(upload_dir, final_filename))
-    return final_filename
+    return store_pdf(uploaded_file.stream)
 
 @admin_bp.route('/users')
 @login_required
@@ -93,8 +116,12 @@ def delete_user(user_id):
         flash("Cannot delete another admin.")
         return redirect(url_for('admin.user_list'))
 
+    forget_user(user.id)
+    forget_user_rating(user.id)
     db.session.delete(user)
     db.session.commit()
+    user_cache.invalidate(user_id)
+    leaderboard.invalidate()
     flash("User deleted.")
     return redirect(url_for('admin.user_list'))
 
@@ -113,9 +140,9 @@ def add_issue():
 
         try:
             if issue_pdf_upload and issue_pdf_upload.filename:
-                issue_pdf_filename = _save_issue_pdf(issue_pdf_upload, 'issue_pdf')
+                issue_pdf_filename = _save_issue_pdf(issue_pdf_upload)
             if answer_pdf_upload and answer_pdf_upload.filename:
-                answer_pdf_filename = _save_issue_pdf(answer_pdf_upload, 'issue_answers')
+                answer_pdf_filename = _save_issue_pdf(answer_pdf_upload)
         except ValueError as exc:
             flash(str(exc))
             return render_template('admin_add_issue.html', form=form)
@@ -130,16 +157,15 @@ def add_issue():
         db.session.add(new_issue)
         db.session.commit()
         
-        # Send email notifications to users who want them
+        # The releases job announces the issue once it is available, unless
+        # it is a back-dated issue older than NOTIFICATION_MAX_LATENESS_HOURS
         try:
-            if new_issue.available_date <= datetime.now(timezone.utc):
-                notify_all_users_new_issue(new_issue)
-                flash('Issue created successfully and notifications sent!')
-            else:
-                flash('Issue created successfully! Notifications will be sent when the issue becomes available.')
+            scheduler.wake()
+            flash('Issue created successfully! Notifications will be sent when the issue becomes available.')
         except Exception as e:
-            flash('Issue created successfully, but failed to send some notifications.')
-            print(f"Failed to send issue notifications: {e}")
+            db.session.rollback()
+            flash('Issue created successfully, but failed to schedule notifications.')
+            print(f"Failed to schedule issue notifications: {e}")
         
         return redirect(url_for('admin.dashboard'))
 
@@ -170,6 +196,7 @@ def add_puzzle():
         )
         db.session.add(new_puzzle)
         db.session.commit()
+        issue_cache.invalidate()
         flash('Puzzle created successfully!')
         return redirect(url_for('admin.dashboard'))
 
@@ -190,6 +217,8 @@ def add_hint():
         )
         db.session.add(new_hint)
         db.session.commit()
+        hint_schedule.invalidate()
+        scheduler.wake()
         flash('Hint added successfully!')
         return redirect(url_for('admin.user_list'))
     
@@ -221,8 +250,13 @@ def hint_list():
 @admin_required
 def delete_puzzle(puzzle_id):
     puzzle = Puzzle.query.get_or_404(puzzle_id)
+    forget_puzzle(puzzle.id)
+    forget_puzzle_rating(puzzle.id)
     db.session.delete(puzzle)
     db.session.commit()
+    hint_schedule.invalidate()
+    issue_cache.invalidate()
+    leaderboard.invalidate()
     flash("Puzzle deleted successfully.")
     return redirect(url_for('admin.puzzle_list'))
 
@@ -231,8 +265,10 @@ def delete_puzzle(puzzle_id):
 @admin_required
 def delete_issue(issue_id):
     issue = Issue.query.get_or_404(issue_id)
+    forget_release('issue', issue.id)
     db.session.delete(issue)
     db.session.commit()
+    issue_cache.invalidate()
     flash("Issue deleted successfully.")
     return redirect(url_for('admin.issue_list'))
 
@@ -241,8 +277,10 @@ def delete_issue(issue_id):
 @admin_required
 def delete_hint(hint_id):
     hint = Hint.query.get_or_404(hint_id)
+    forget_release('hint', hint.id)
     db.session.delete(hint)
     db.session.commit()
+    hint_schedule.invalidate()
     flash("Hint deleted successfully.")
     return redirect(url_for('admin.hint_list'))
 
@@ -271,6 +309,9 @@ def edit_puzzle(puzzle_id):
             puzzle.answer_hash = generate_password_hash(normalize_answer(form.answer.data))
         
         db.session.commit()
+        report_cache.invalidate()
+        leaderboard.invalidate()
+        issue_cache.invalidate()
         flash('Puzzle updated successfully!')
         return redirect(url_for('admin.puzzle_list'))
     
@@ -352,9 +393,9 @@ def edit_issue(issue_id):
 
         try:
             if issue_pdf_upload and issue_pdf_upload.filename:
-                issue_pdf_filename = _save_issue_pdf(issue_pdf_upload, f'issue_{issue.id}')
+                issue_pdf_filename = _save_issue_pdf(issue_pdf_upload)
             if answer_pdf_upload and answer_pdf_upload.filename:
-                answer_pdf_filename = _save_issue_pdf(answer_pdf_upload, f'issue_{issue.id}_answers')
+                answer_pdf_filename = _save_issue_pdf(answer_pdf_upload)
         except ValueError as exc:
             flash(str(exc))
             return render_template('admin_edit_issue.html', form=form, issue=issue)
@@ -366,6 +407,9 @@ def edit_issue(issue_id):
         issue.available_date = form.available_date.data
         
         db.session.commit()
+        report_cache.invalidate()
+        issue_cache.invalidate()
+        scheduler.wake()
         flash('Issue updated successfully!')
         return redirect(url_for('admin.issue_list'))
     
@@ -385,6 +429,8 @@ def edit_hint(hint_id):
         hint.unlock_date = form.unlock_date.data
         
         db.session.commit()
+        hint_schedule.invalidate()
+        scheduler.wake()
         flash('Hint updated successfully!')
         return redirect(url_for('admin.hint_list'))
     
@@ -422,6 +468,7 @@ def add_erratum():
         )
         db.session.add(new_erratum)
         db.session.commit()
+        report_cache.invalidate()
         flash('Erratum created successfully!')
         return redirect(url_for('admin.errata_list'))
 
@@ -465,6 +512,7 @@ def delete_erratum(erratum_id):
     erratum = Erratum.query.get_or_404(erratum_id)
     db.session.delete(erratum)
     db.session.commit()
+    report_cache.invalidate()
     flash("Erratum deleted successfully.")
     return redirect(url_for('admin.errata_list'))
 
@@ -480,14 +528,18 @@ def reports_index():
 @login_required
 @admin_required
 def report_puzzles():
-    selected_issue_id = _parse_optional_int(request.args.get('issue_id'))
+    selected_issue_id = parse_optional_int(request.args.get('issue_id'))
     selected_sort = request.args.get('sort', 'most_solved')
 
     issues = Issue.query.order_by(Issue.title.asc()).all()
-    puzzle_rows = get_puzzle_report_rows(issue_id=selected_issue_id, sort=selected_sort)
+    params = normalize_report_params('puzzles', request.args)
+    puzzle_rows = report_cache.get_or_compute(
+        'puzzles', params, lambda: get_puzzle_report_rows(**params)
+    )
 
     return render_template(
         'admin_report_puzzles.html',
+        export_form=ReportExportForm(),
         puzzle_rows=puzzle_rows,
         issues=issues,
         selected_issue_id=selected_issue_id,
@@ -499,39 +551,20 @@ def report_puzzles():
 @login_required
 @admin_required
 def report_puzzles_export():
-    selected_issue_id = _parse_optional_int(request.args.get('issue_id'))
-    selected_sort = request.args.get('sort', 'most_solved')
-
-    puzzle_rows = get_puzzle_report_rows(issue_id=selected_issue_id, sort=selected_sort)
-    rows = [
-        [
-            row['puzzle_id'],
-            row['puzzle_title'],
-            row['issue_title'] or 'Unassigned',
-            row['solve_count'],
-            row['attempt_count'],
-            row['correct_submission_count'],
-            f"{row['success_rate']:.1f}",
-        ]
-        for row in puzzle_rows
-    ]
-
-    return _csv_response(
-        'puzzle-report.csv',
-        ['Puzzle ID', 'Puzzle Title', 'Issue', 'Solvers', 'Attempts', 'Correct Submissions', 'Success Rate %'],
-        rows,
-    )
+    params = normalize_report_params('puzzles', request.args)
+    return _csv_response(*build_report_csv('puzzles', params))
 
 
 @admin_bp.route('/reports/puzzles/<int:puzzle_id>')
 @login_required
 @admin_required
 def report_puzzle_detail(puzzle_id):
-    puzzle, solver_rows = get_puzzle_solver_rows(puzzle_id)
-    return render_template(
+    puzzle = Puzzle.query.get_or_404(puzzle_id)
+    return _stream_page(
         'admin_report_puzzle_detail.html',
+        export_form=ReportExportForm(),
         puzzle=puzzle,
-        solver_rows=solver_rows,
+        solver_rows=iter_puzzle_solver_rows(puzzle.id),
     )
 
 
@@ -539,24 +572,8 @@ def report_puzzle_detail(puzzle_id):
 @login_required
 @admin_required
 def report_puzzle_detail_export(puzzle_id):
-    puzzle, solver_rows = get_puzzle_solver_rows(puzzle_id)
-    rows = [
-        [
-            row['user_id'],
-            row['username'],
-            row['attempt_count'],
-            row['correct_submission_count'],
-            row['incorrect_before_solve'],
-            row['first_correct_at'].strftime('%Y-%m-%d %H:%M:%S') if row['first_correct_at'] else '',
-        ]
-        for row in solver_rows
-    ]
-
-    return _csv_response(
-        f"puzzle-{puzzle.id}-solvers.csv",
-        ['User ID', 'Username', 'Attempts', 'Correct Submissions', 'Incorrect Before First Solve', 'First Correct Submission (UTC)'],
-        rows,
-    )
+    puzzle = Puzzle.query.get_or_404(puzzle_id)
+    return _csv_response(*build_report_csv('puzzle_solvers', {'puzzle_id': puzzle.id}))
 
 
 @admin_bp.route('/reports/users')
@@ -564,9 +581,16 @@ def report_puzzle_detail_export(puzzle_id):
 @admin_required
 def report_users():
     selected_sort = request.args.get('sort', 'most_solved')
-    user_rows = get_user_report_rows(sort=selected_sort)
-    return render_template(
+    params = normalize_report_params('users', request.args)
+    # Up to REPORT_CACHE_MAX_ROWS users the rows are cached (and reused by
+    # the CSV export); past that they are streamed so no worker holds them all
+    if User.query.count() <= current_app.config.get('REPORT_CACHE_MAX_ROWS', 5000):
+        user_rows = report_cache.get_or_compute('users', params, lambda: get_user_report_rows(**params))
+    else:
+        user_rows = iter_user_report_rows(**params)
+    return _stream_page(
         'admin_report_users.html',
+        export_form=ReportExportForm(),
         user_rows=user_rows,
         selected_sort=selected_sort,
     )
@@ -576,47 +600,33 @@ def report_users():
 @login_required
 @admin_required
 def report_users_export():
-    selected_sort = request.args.get('sort', 'most_solved')
-    user_rows = get_user_report_rows(sort=selected_sort)
-    rows = [
-        [
-            row['user_id'],
-            row['username'],
-            row['email'],
-            row['solved_puzzles'],
-            row['attempt_count'],
-            row['correct_submission_count'],
-            f"{row['success_rate']:.1f}",
-        ]
-        for row in user_rows
-    ]
-
-    return _csv_response(
-        'user-report.csv',
-        ['User ID', 'Username', 'Email', 'Solved Puzzles', 'Attempts', 'Correct Submissions', 'Success Rate %'],
-        rows,
-    )
+    params = normalize_report_params('users', request.args)
+    return _csv_response(*build_report_csv('users', params))
 
 
 @admin_bp.route('/reports/issue-progress')
 @login_required
 @admin_required
 def report_issue_progress():
-    selected_user_id = _parse_optional_int(request.args.get('user_id'))
-    selected_issue_id = _parse_optional_int(request.args.get('issue_id'))
+    selected_user_id = parse_optional_int(request.args.get('user_id'))
+    selected_issue_id = parse_optional_int(request.args.get('issue_id'))
     selected_sort = request.args.get('sort', 'best_completion')
 
-    users = User.query.order_by(User.username.asc()).all()
+    # The user filter lists every account, so it is streamed like the rows
+    users = db.session.query(User.id, User.username).order_by(User.username.asc()).yield_per(STREAM_BATCH_SIZE)
     issues = Issue.query.order_by(Issue.title.asc()).all()
-    progress_rows = get_user_issue_progress_rows(
-        user_id=selected_user_id,
-        issue_id=selected_issue_id,
-        sort=selected_sort,
+    params = normalize_report_params('issue_progress', request.args)
+    page_params = dict(params, after=request.args.get('after') or None, limit=ISSUE_PROGRESS_PAGE_SIZE)
+    progress_rows, next_cursor = report_cache.get_or_compute(
+        'issue_progress_page', page_params, lambda: get_user_issue_progress_page(**page_params)
     )
 
-    return render_template(
+    return _stream_page(
         'admin_report_issue_progress.html',
+        export_form=ReportExportForm(),
         progress_rows=progress_rows,
+        next_cursor=next_cursor,
+        is_first_page=page_params['after'] is None,
         users=users,
         issues=issues,
         selected_user_id=selected_user_id,
@@ -629,50 +639,121 @@ def report_issue_progress():
 @login_required
 @admin_required
 def report_issue_progress_export():
-    selected_user_id = _parse_optional_int(request.args.get('user_id'))
-    selected_issue_id = _parse_optional_int(request.args.get('issue_id'))
-    selected_sort = request.args.get('sort', 'best_completion')
+    params = normalize_report_params('issue_progress', request.args)
+    return _csv_response(*build_report_csv('issue_progress', params))
 
-    progress_rows = get_user_issue_progress_rows(
-        user_id=selected_user_id,
-        issue_id=selected_issue_id,
-        sort=selected_sort,
+
+@admin_bp.route('/reports/analytics')
+@login_required
+@admin_required
+def report_analytics():
+    selected_issue_id = parse_optional_int(request.args.get('issue_id'))
+    issues = Issue.query.order_by(Issue.available_date.desc()).all()
+    analytics = report_cache.get_or_compute(
+        'analytics', {'issue_id': selected_issue_id}, lambda: compute_issue_analytics(selected_issue_id)
     )
-    rows = [
-        [
-            row['user_id'],
-            row['username'],
-            row['issue_id'],
-            row['issue_title'],
-            row['solved_count'],
-            row['total_puzzles'],
-            f"{row['completion_rate']:.1f}",
-        ]
-        for row in progress_rows
-    ]
 
-    return _csv_response(
-        'issue-progress-report.csv',
-        ['User ID', 'Username', 'Issue ID', 'Issue', 'Solved', 'Total Puzzles', 'Completion Rate %'],
-        rows,
+    return render_template(
+        'admin_report_analytics.html',
+        analytics=analytics,
+        issues=issues,
+        selected_issue_id=selected_issue_id,
+    )
+
+
+@admin_bp.route('/reports/exports')
+@login_required
+@admin_required
+def report_exports():
+    jobs = ReportExport.query.order_by(ReportExport.created_at.desc()).limit(50).all()
+    return render_template('admin_report_exports.html', jobs=jobs, report_exports=REPORT_EXPORTS)
+
+
+@admin_bp.route('/reports/exports/queue/<report_name>', methods=['POST'])
+@login_required
+@admin_required
+def queue_report_export_job(report_name):
+    if report_name not in REPORT_EXPORTS:
+        abort(404)
+
+    form = ReportExportForm()
+    if not form.validate_on_submit():
+        abort(400)
+
+    params = normalize_report_params(report_name, request.args)
+    if report_name == 'puzzle_solvers':
+        Puzzle.query.get_or_404(params['puzzle_id'])
+
+    job = queue_report_export(report_name, params, requested_by_id=current_user.id)
+    flash('Export queued. This page will update when the file is ready.')
+    return redirect(url_for('admin.report_export_status', export_id=job.id))
+
+
+@admin_bp.route('/reports/exports/<int:export_id>')
+@login_required
+@admin_required
+def report_export_status(export_id):
+    job = ReportExport.query.get_or_404(export_id)
+    return render_template('admin_report_export_status.html', job=job, report_exports=REPORT_EXPORTS)
+
+
+@admin_bp.route('/reports/exports/<int:export_id>/download')
+@login_required
+@admin_required
+def report_export_download(export_id):
+    job = ReportExport.query.get_or_404(export_id)
+    if job.status != 'complete' or not job.filename:
+        flash('This export is not ready to download.')
+        return redirect(url_for('admin.report_export_status', export_id=job.id))
+
+    return send_file(
+        export_file_path(job),
+        mimetype='application/gzip',
+        as_attachment=True,
+        download_name=job.download_name or job.filename,
+    )
+
+
+@admin_bp.route('/email-outbox')
+@login_required
+@admin_required
+def email_outbox():
+    return render_template(
+        'admin_email_outbox.html',
+        summary=outbox_summary(),
+        action_form=EmailOutboxActionForm(),
     )
 
+
+@admin_bp.route('/email-outbox/retry', methods=['POST'])
+@admin_bp.route('/email-outbox/<int:email_id>/retry', methods=['POST'])
+@login_required
+@admin_required
+def retry_email(email_id=None):
+    if not EmailOutboxActionForm().validate_on_submit():
+        abort(400)
+    count = retry_dead_emails(email_id)
+    flash(f'{count} message(s) returned to the outbox.')
+    return redirect(url_for('admin.email_outbox'))
+
+
+@admin_bp.route('/email-outbox/<int:email_id>/discard', methods=['POST'])
+@login_required
+@admin_required
+def discard_email(email_id):
+    if not EmailOutboxActionForm().validate_on_submit():
+        abort(400)
+    if discard_dead_email(email_id):
+        flash('Message discarded.')
+    return redirect(url_for('admin.email_outbox'))
+
 @admin_bp.route('/')
 @login_required
 @admin_required
 def dashboard():
-    stats = {
-        'total_users': User.query.count(),
-        'total_puzzles': Puzzle.query.count(),
-        'total_issues': Issue.query.count(),
-        'total_submissions': Submission.query.count(),
-        'correct_submissions': Submission.query.filter_by(is_correct=True).count(),
-        'total_distinct_solves': Submission.query.filter_by(is_correct=True).with_entities(Submission.user_id, Submission.puzzle_id).distinct().count(),
-        'total_errata': Erratum.query.count(),
-        'recent_users': User.query.order_by(User.id.desc()).limit(5).all(),
-        'recent_submissions': Submission.query.order_by(Submission.submitted_at.desc()).limit(5).all(),
-    }
-    stats['reporting'] = get_admin_dashboard_reporting_summary(limit=5)
+    stats = report_cache.get_or_compute(
+        'dashboard', {'limit': 5}, lambda: get_admin_dashboard_stats(limit=5)
+    )
     return render_template('admin_dashboard.html', stats=stats)
 
 
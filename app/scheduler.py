@@ -1,86 +1,283 @@
 from datetime import datetime, timezone, timedelta
-from flask import current_app
-from .models import Issue, Hint, User, Submission
-from .email import notify_all_users_new_issue, notify_users_new_hint
+from sqlalchemy import and_, case, func, or_
+from sqlalchemy.exc import IntegrityError
+from .email import queue_digests
+from .leases import Heartbeat, worker_id
+from .models import WorkerJob
+from .releases import (
+    announce_hint, announce_issue, due_releases, issues_to_prepare, next_preparation_at, next_release_at, prepare_release,
+)
+from .stats import reconcile_stats
+from .ratings import refit_ratings
+from .pdf_store import sweep_orphaned_pdfs
 from . import db
+import os
 import threading
 import time
 
 
+# Recurring jobs, in the order they run when due together; each method
+# does the work and returns when it should next run
+JOBS = {
+    'releases': '_announce_releases',
+    'digests': '_send_digests',
+    'stats': '_reconcile_stats',
+    'ratings': '_refit_ratings',
+    'pdfs': '_sweep_pdfs',
+}
+
+
 class EmailScheduler:
-    """Background scheduler for sending email notifications"""
-    
+    """Runs the recurring background jobs in a worker process.
+
+    Each job is a worker_job row holding its next run time. Any number of
+    worker processes can run the scheduler: a due job is claimed under a
+    lease, renewed by heartbeats while it runs, so exactly one of them runs
+    it. The scheduler sleeps until the soonest next_run_at, checking the
+    table at least every WORKER_POLL_SECONDS; wake() from an admin edit in a
+    web process moves a job's next run to now.
+    """
+
     def __init__(self):
         self.running = False
         self.thread = None
         self.app = None
-    
+        self._pid = None
+        self._wake = threading.Event()
+
     def init_app(self, app):
         """Initialize the scheduler with Flask app"""
         self.app = app
-    
+
     def start(self):
         """Start the background scheduler thread"""
         if not self.running and self.app:
             self.running = True
+            self._pid = os.getpid()
             self.thread = threading.Thread(target=self._run_scheduler, daemon=True)
             self.thread.start()
-    
+
     def stop(self):
-        """Stop the background scheduler thread"""
+        """Stop the background scheduler thread once its current job finishes"""
         self.running = False
+        self._wake.set()
         if self.thread:
             self.thread.join()
-    
+
+    def wake(self, job='releases'):
+        """Run a job now rather than at its scheduled time, e.g. after an admin edit"""
+        WorkerJob.query.filter(WorkerJob.name == job).update(
+            {'next_run_at': datetime.now(timezone.utc)}, synchronize_session=False
+        )
+        db.session.commit()
+        if self.running and self._pid == os.getpid():
+            self._wake.set()
+
     def _run_scheduler(self):
         """Main scheduler loop - runs in background thread"""
+        poll_seconds = self.app.config.get('WORKER_POLL_SECONDS', 5)
         with self.app.app_context():
             while self.running:
+                next_run_at = None
                 try:
-                    self._check_new_issues()
-                    self._check_new_hints()
+                    self._ensure_jobs()
+                    while self.running and self._run_next_due():
+                        pass
+                    next_run_at = db.session.query(func.min(WorkerJob.next_run_at)).scalar()
+                    db.session.commit()
                 except Exception as e:
+                    db.session.rollback()
                     print(f"Scheduler error: {e}")
-                
-                # Check every 10 minutes
-                time.sleep(600)
-    
-    def _check_new_issues(self):
-        """Check for issues that just became available"""
+                finally:
+                    db.session.remove()
+
+                timeout = poll_seconds
+                if next_run_at is not None:
+                    if next_run_at.tzinfo is None:
+                        next_run_at = next_run_at.replace(tzinfo=timezone.utc)
+                    until_due = (next_run_at - datetime.now(timezone.utc)).total_seconds()
+                    timeout = min(poll_seconds, max(0.0, until_due))
+                self._wake.wait(timeout)
+                self._wake.clear()
+
+    def _ensure_jobs(self):
+        """Create the worker_job rows the first time any worker starts"""
+        existing = {name for (name,) in db.session.query(WorkerJob.name)}
+        for name in JOBS:
+            if name in existing:
+                continue
+            try:
+                db.session.add(WorkerJob(name=name, next_run_at=datetime.now(timezone.utc)))
+                db.session.commit()
+            except IntegrityError:
+                # Another worker created it first
+                db.session.rollback()
+
+    def _run_next_due(self):
+        """Claim and run one due job; False when none are left"""
+        now = datetime.now(timezone.utc)
+        due = (
+            db.session.query(WorkerJob.name)
+            .filter(
+                WorkerJob.next_run_at <= now,
+                or_(WorkerJob.lease_owner.is_(None), WorkerJob.lease_expires_at < now),
+            )
+            .all()
+        )
+        db.session.commit()
+        for name in sorted((name for (name,) in due if name in JOBS), key=list(JOBS).index):
+            if self._claim(name, now):
+                self._run_job(name)
+                return True
+        return False
+
+    def _lease_expiry(self):
+        return datetime.now(timezone.utc) + timedelta(seconds=self.app.config.get('WORKER_LEASE_SECONDS', 60))
+
+    def _claim(self, name, now):
+        """Lease a due job to this worker; False if another worker got it first"""
+        claimed = (
+            WorkerJob.query
+            .filter(
+                WorkerJob.name == name,
+                WorkerJob.next_run_at <= now,
+                or_(WorkerJob.lease_owner.is_(None), WorkerJob.lease_expires_at < now),
+            )
+            .update(
+                {
+                    'lease_owner': worker_id(),
+                    'lease_expires_at': self._lease_expiry(),
+                    'heartbeat_at': now,
+                    'last_started_at': now,
+                },
+                synchronize_session=False,
+            )
+        )
+        db.session.commit()
+        return claimed == 1
+
+    def _renew(self, name):
+        """Extend this worker's lease on a running job"""
         now = datetime.now(timezone.utc)
-        # Look for issues that became available in the last 10 minutes
-        cutoff_time = now - timedelta(minutes=10)
-        
-        new_issues = Issue.query.filter(
-            Issue.available_date <= now,
-            Issue.available_date >= cutoff_time
-        ).all()
-        
-        for issue in new_issues:
+        return WorkerJob.query.filter(
+            WorkerJob.name == name, WorkerJob.lease_owner == worker_id()
+        ).update(
+            {'lease_expires_at': self._lease_expiry(), 'heartbeat_at': now},
+            synchronize_session=False,
+        ) == 1
+
+    def _run_job(self, name):
+        """Run a claimed job and release it with its next run time"""
+        started = datetime.now(timezone.utc)
+        error = None
+        try:
+            with Heartbeat(self.app, lambda: self._renew(name)):
+                next_run_at = getattr(self, JOBS[name])(started)
+        except Exception as e:
+            db.session.rollback()
+            error = str(e)
+            next_run_at = started + timedelta(seconds=self.app.config.get('WORKER_LEASE_SECONDS', 60))
+            print(f"Background job {name} failed: {e}")
+
+        # A wake() while the job ran moved next_run_at past its start; keep
+        # that earlier run rather than overwriting it
+        woken = and_(WorkerJob.next_run_at > started, WorkerJob.next_run_at < next_run_at)
+        WorkerJob.query.filter(
+            WorkerJob.name == name, WorkerJob.lease_owner == worker_id()
+        ).update(
+            {
+                'next_run_at': case((woken, WorkerJob.next_run_at), else_=next_run_at),
+                'lease_owner': None,
+                'lease_expires_at': None,
+                'last_finished_at': datetime.now(timezone.utc),
+                'last_error': error,
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+
+    def _announce_releases(self, now):
+        """Announce every issue and hint that is due and not yet announced"""
+        issues, hints = due_releases(now)
+
+        for issue in issues:
+            try:
+                count = announce_issue(issue)
+                db.session.commit()
+                if count is not None:
+                    print(f"Queued {count} notifications for issue: {issue.title}")
+            except Exception as e:
+                db.session.rollback()
+                print(f"Failed to queue notifications for issue {issue.title}: {e}")
+
+        for hint in hints:
             try:
-                notify_all_users_new_issue(issue)
-                print(f"Sent notifications for issue: {issue.title}")
+                count = announce_hint(hint)
+                db.session.commit()
+                if count is not None:
+                    print(f"Queued {count} notifications for hint on puzzle: {hint.puzzle.title}")
             except Exception as e:
-                print(f"Failed to send notifications for issue {issue.title}: {e}")
-    
-    def _check_new_hints(self):
-        """Check for hints that just became available"""
+                db.session.rollback()
+                print(f"Failed to queue notifications for hint on puzzle {hint.puzzle.title}: {e}")
+
+        self._prepare_releases(now)
+
+        # Edits made straight in the database don't wake the job, so it
+        # still looks again after SCHEDULER_MAX_SLEEP_SECONDS
         now = datetime.now(timezone.utc)
-        # Look for hints that became available in the last 10 minutes
-        cutoff_time = now - timedelta(minutes=10)
-        
-        new_hints = Hint.query.filter(
-            Hint.unlock_date <= now.date(),
-            Hint.unlock_date >= cutoff_time.date()
-        ).all()
-        
-        for hint in new_hints:
+        latest = now + timedelta(seconds=self.app.config.get('SCHEDULER_MAX_SLEEP_SECONDS', 600))
+        candidates = [at for at in (next_release_at(now), next_preparation_at(now)) if at is not None]
+        return min(candidates + [latest])
+
+    def _prepare_releases(self, now):
+        """Get issues released within RELEASE_WARMUP_SECONDS ready for their first visitors"""
+        for issue in issues_to_prepare(now):
             try:
-                notify_users_new_hint(hint.puzzle, hint)
-                print(f"Sent notifications for hint on puzzle: {hint.puzzle.title}")
+                created = prepare_release(issue)
+                db.session.commit()
+                if created:
+                    print(f"Prepared {created} puzzle stats rows for upcoming issue: {issue.title}")
             except Exception as e:
-                print(f"Failed to send notifications for hint on puzzle {hint.puzzle.title}: {e}")
+                db.session.rollback()
+                print(f"Failed to prepare upcoming issue {issue.title}: {e}")
+
+    def _send_digests(self, now):
+        """Queue digests for users whose hourly or daily window has closed"""
+        count = queue_digests(now)
+        db.session.commit()
+        if count:
+            print(f"Queued {count} notification digests")
+        # Hourly and daily digest windows both close on the hour
+        return now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+
+    def _reconcile_stats(self, now):
+        """Periodically correct drift in the materialized reporting stats"""
+        fixed = reconcile_stats()
+        if fixed:
+            print(f"Reconciled {fixed} reporting stats rows")
+        return now + timedelta(seconds=self.app.config.get('STATS_RECONCILE_INTERVAL_SECONDS', 3600))
+
+    def _refit_ratings(self, now):
+        """Refit puzzle difficulty and user ability ratings once a night"""
+        refit_at = now.replace(hour=self.app.config.get('RATINGS_REFIT_HOUR', 4), minute=0, second=0, microsecond=0)
+        if now < refit_at:
+            return refit_at
+
+        started = time.monotonic()
+        puzzles, users, iterations = refit_ratings()
+        print(
+            f"Refit ratings for {puzzles} puzzles and {users} users "
+            f"in {time.monotonic() - started:.1f}s ({iterations} iterations)"
+        )
+        return refit_at + timedelta(days=1)
+
+    def _sweep_pdfs(self, now):
+        """Delete uploaded PDFs that no issue refers to any more"""
+        deleted = sweep_orphaned_pdfs()
+        if deleted:
+            print(f"Deleted {deleted} orphaned PDF files")
+        return now + timedelta(seconds=self.app.config.get('PDF_SWEEP_INTERVAL_SECONDS', 6 * 3600))
 
 
 # Global scheduler instance
-scheduler = EmailScheduler()
\ No newline at end of file
+scheduler = EmailScheduler()
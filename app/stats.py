@@ -0,0 +1,220 @@
+"""
+Materialized puzzle and user statistics.
+
+PuzzleStats and UserStats hold the solver, attempt and correct-submission
+counters that reporting used to aggregate from the whole Submission table.
+They are bumped in the same transaction as each new submission, reconciled
+periodically by the scheduler, and can be rebuilt from scratch with
+``python migrations.py --rebuild-stats``.
+"""
+from datetime import datetime, timezone
+
+from sqlalchemy import case, distinct, func, update
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import Puzzle, PuzzleStats, Submission, User, UserStats
+
+
+def _compute_puzzle_stats(puzzle_id=None):
+    query = (
+        db.session.query(
+            Submission.puzzle_id,
+            func.count(distinct(case((Submission.is_correct == True, Submission.user_id), else_=None))),
+            func.count(Submission.id),
+            func.sum(case((Submission.is_correct == True, 1), else_=0)),
+        )
+        .join(Puzzle, Puzzle.id == Submission.puzzle_id)
+        .group_by(Submission.puzzle_id)
+    )
+    if puzzle_id is not None:
+        query = query.filter(Submission.puzzle_id == puzzle_id)
+
+    return {
+        row[0]: (int(row[1] or 0), int(row[2] or 0), int(row[3] or 0))
+        for row in query.all()
+    }
+
+
+def _compute_user_stats(user_id=None):
+    query = (
+        db.session.query(
+            Submission.user_id,
+            func.count(distinct(case((Submission.is_correct == True, Submission.puzzle_id), else_=None))),
+            func.count(Submission.id),
+            func.sum(case((Submission.is_correct == True, 1), else_=0)),
+        )
+        .join(User, User.id == Submission.user_id)
+        .group_by(Submission.user_id)
+    )
+    if user_id is not None:
+        query = query.filter(Submission.user_id == user_id)
+
+    return {
+        row[0]: (int(row[1] or 0), int(row[2] or 0), int(row[3] or 0))
+        for row in query.all()
+    }
+
+
+def _puzzle_stats_row(puzzle_id, counts):
+    solve_count, attempt_count, correct_count = counts
+    return PuzzleStats(
+        puzzle_id=puzzle_id,
+        solve_count=solve_count,
+        attempt_count=attempt_count,
+        correct_submission_count=correct_count,
+    )
+
+
+def _user_stats_row(user_id, counts):
+    solved_puzzles, attempt_count, correct_count = counts
+    return UserStats(
+        user_id=user_id,
+        solved_puzzles=solved_puzzles,
+        attempt_count=attempt_count,
+        correct_submission_count=correct_count,
+    )
+
+
+def _apply_deltas(model, key_column, key, values):
+    result = db.session.execute(
+        update(model)
+        .where(key_column == key)
+        .values(
+            updated_at=datetime.now(timezone.utc),
+            **{name: getattr(model, name) + delta for name, delta in values.items()},
+        )
+    )
+    return result.rowcount
+
+
+def _increment(model, key_column, key, values, build_row):
+    """Add the given deltas to one stats row, creating it if missing"""
+    if _apply_deltas(model, key_column, key, values):
+        return
+
+    # No row yet: compute it from the submissions, which already include the
+    # new one, inside a savepoint in case a concurrent request inserted it.
+    try:
+        with db.session.begin_nested():
+            db.session.add(build_row(key))
+    except IntegrityError:
+        _apply_deltas(model, key_column, key, values)
+
+
+def record_submission(submission):
+    """Apply a newly added submission to the stats tables (caller commits)"""
+    db.session.flush()
+
+    first_solve = False
+    if submission.is_correct:
+        first_solve = not db.session.query(
+            Submission.query.filter(
+                Submission.user_id == submission.user_id,
+                Submission.puzzle_id == submission.puzzle_id,
+                Submission.is_correct == True,
+                Submission.id != submission.id,
+            ).exists()
+        ).scalar()
+
+    correct = 1 if submission.is_correct else 0
+    solved = 1 if first_solve else 0
+
+    _increment(
+        PuzzleStats,
+        PuzzleStats.puzzle_id,
+        submission.puzzle_id,
+        {'solve_count': solved, 'attempt_count': 1, 'correct_submission_count': correct},
+        lambda puzzle_id: _puzzle_stats_row(
+            puzzle_id, _compute_puzzle_stats(puzzle_id).get(puzzle_id, (0, 0, 0))
+        ),
+    )
+    _increment(
+        UserStats,
+        UserStats.user_id,
+        submission.user_id,
+        {'solved_puzzles': solved, 'attempt_count': 1, 'correct_submission_count': correct},
+        lambda user_id: _user_stats_row(
+            user_id, _compute_user_stats(user_id).get(user_id, (0, 0, 0))
+        ),
+    )
+
+
+def ensure_puzzle_stats(puzzle_ids):
+    """Create any missing stats rows for these puzzles ahead of their first submissions (caller commits)"""
+    existing = {
+        puzzle_id for (puzzle_id,) in
+        db.session.query(PuzzleStats.puzzle_id).filter(PuzzleStats.puzzle_id.in_(puzzle_ids))
+    }
+    missing = [puzzle_id for puzzle_id in puzzle_ids if puzzle_id not in existing]
+    for puzzle_id in missing:
+        counts = _compute_puzzle_stats(puzzle_id).get(puzzle_id, (0, 0, 0))
+        db.session.add(_puzzle_stats_row(puzzle_id, counts))
+    return len(missing)
+
+
+def forget_puzzle(puzzle_id):
+    """Remove a puzzle's stats row before the puzzle itself is deleted"""
+    PuzzleStats.query.filter_by(puzzle_id=puzzle_id).delete()
+
+
+def forget_user(user_id):
+    """Remove a user's stats row before the user itself is deleted"""
+    UserStats.query.filter_by(user_id=user_id).delete()
+
+
+def rebuild_stats():
+    """Recompute both stats tables from the Submission table"""
+    puzzle_counts = _compute_puzzle_stats()
+    user_counts = _compute_user_stats()
+
+    PuzzleStats.query.delete()
+    UserStats.query.delete()
+    db.session.add_all(_puzzle_stats_row(key, counts) for key, counts in puzzle_counts.items())
+    db.session.add_all(_user_stats_row(key, counts) for key, counts in user_counts.items())
+    db.session.commit()
+
+    return len(puzzle_counts), len(user_counts)
+
+
+def _reconcile(model, key_name, fields, expected, build_row):
+    fixed = 0
+    now = datetime.now(timezone.utc)
+    seen = set()
+
+    for row in model.query.all():
+        key = getattr(row, key_name)
+        seen.add(key)
+        counts = expected.get(key, (0, 0, 0))
+        if tuple(getattr(row, name) for name in fields) != counts:
+            for name, value in zip(fields, counts):
+                setattr(row, name, value)
+            row.updated_at = now
+            fixed += 1
+
+    for key, counts in expected.items():
+        if key not in seen:
+            db.session.add(build_row(key, counts))
+            fixed += 1
+
+    return fixed
+
+
+def reconcile_stats():
+    """Correct any drift between the stats tables and Submission; returns rows fixed"""
+    fixed = _reconcile(
+        PuzzleStats,
+        'puzzle_id',
+        ('solve_count', 'attempt_count', 'correct_submission_count'),
+        _compute_puzzle_stats(),
+        _puzzle_stats_row,
+    )
+    fixed += _reconcile(
+        UserStats,
+        'user_id',
+        ('solved_puzzles', 'attempt_count', 'correct_submission_count'),
+        _compute_user_stats(),
+        _user_stats_row,
+    )
+    db.session.commit()
+    return fixed
@@ -0,0 +1,106 @@
+"""
+Per-worker identity cache for the Flask-Login user loader.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+
+from . import db
+
+
+class CachedUser(UserMixin):
+    """Detached, read-only snapshot of the User columns needed on every request."""
+
+    def __init__(self, id, username, display_name, is_admin,
+                 email_notifications, notify_new_issues, notify_new_hints):
+        self.id = id
+        self.username = username
+        self.display_name = display_name
+        self.is_admin = bool(is_admin)
+        self.email_notifications = bool(email_notifications)
+        self.notify_new_issues = bool(notify_new_issues)
+        self.notify_new_hints = bool(notify_new_hints)
+
+    def __repr__(self):
+        return f'<CachedUser {self.id} {self.username}>'
+
+
+class UserIdentityCache:
+    """Bounded TTL cache of CachedUser records keyed by user id."""
+
+    def __init__(self, ttl_seconds=30, max_size=1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read cache limits from the Flask config"""
+        self.ttl_seconds = app.config.get('USER_CACHE_TTL_SECONDS', self.ttl_seconds)
+        self.max_size = app.config.get('USER_CACHE_MAX_SIZE', self.max_size)
+        self.clear()
+
+    def get(self, user_id):
+        """Return a cached record, or None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, record = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return record
+
+    def put(self, record):
+        """Store a record, evicting the least recently used entry when full"""
+        if self.ttl_seconds <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[record.id] = (time.monotonic() + self.ttl_seconds, record)
+            self._entries.move_to_end(record.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Drop a single user, e.g. after their row changed"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def load(self, user_id):
+        """Return the user for user_id, querying the database only on a miss"""
+        record = self.get(user_id)
+        if record is not None:
+            return record
+
+        from .models import User
+        row = (
+            db.session.query(
+                User.id,
+                User.username,
+                User.display_name,
+                User.is_admin,
+                User.email_notifications,
+                User.notify_new_issues,
+                User.notify_new_hints,
+            )
+            .filter(User.id == user_id)
+            .first()
+        )
+        if row is None:
+            return None
+
+        record = CachedUser(*row)
+        self.put(record)
+        return record
+
+
+# Global identity cache instance (one per worker process)
+user_cache = UserIdentityCache()
@@ -1,8 +1,22 @@
 from datetime import datetime, timezone
 
+def as_utc(value):
+    """Treat a naive datetime (as stored by SQLite or entered in the admin forms) as UTC"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
 def compare_dates(date1, date2):
     if date1 and date1.tzinfo is None:
         date1 = date1.replace(tzinfo=timezone.utc)
     if date2 and date2.tzinfo is None:
         date2 = date2.replace(tzinfo=timezone.utc)
-    return date1 < date2
\ No newline at end of file
+    return date1 < date2
+
+def parse_optional_int(value):
+    if value in (None, "", "0"):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
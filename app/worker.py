@@ -0,0 +1,48 @@
+"""
+Background worker process.
+
+Web processes only serve requests and queue work in the database: emails
+in email_outbox, report exports in report_export, and the recurring jobs
+(release announcements, digests, stats reconciliation, rating refits) in
+worker_job. A worker process runs the email sender pool, the export
+builder and the job scheduler against those tables. Several workers, on
+one host or many, share the load: every row is claimed under a lease, so
+nothing is done twice, and work held by a worker that dies is picked up
+by another once its lease lapses.
+"""
+import signal
+import threading
+
+from .email import email_dispatcher
+from .exports import export_worker
+from .leases import worker_id
+from .scheduler import scheduler
+
+
+def start_background_work():
+    """Start the sender pool, export builder and scheduler in this process"""
+    email_dispatcher.start()
+    export_worker.start()
+    scheduler.start()
+
+
+def stop_background_work():
+    """Stop them, letting each finish what it is doing"""
+    scheduler.stop()
+    export_worker.stop()
+    email_dispatcher.stop()
+
+
+def run_worker(app):
+    """Run the background work until SIGTERM or SIGINT"""
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.set())
+
+    start_background_work()
+    print(f"Background worker {worker_id()} started ({app.config.get('EMAIL_WORKERS', 4)} email senders)")
+    while not stopping.wait(1):
+        pass
+
+    print(f"Background worker {worker_id()} stopping")
+    stop_background_work()
@@ -0,0 +1,126 @@
+"""
+Benchmark for the vectorized solve analytics.
+
+Seeds a throwaway SQLite database with N submissions spread over a set of
+puzzles and users, then times the cold load of the submission arrays, a
+warm report (arrays cached, only new rows fetched) and the pure array work.
+
+Usage:
+    python benchmarks/analytics.py --rows 2000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SEED_BATCH_SIZE = 100000
+PUZZLE_COUNT = 200
+USER_COUNT = 20000
+ISSUE_COUNT = 20
+
+
+def seed(db, Issue, Puzzle, User, Submission, count):
+    """Bulk insert issues, puzzles, users and count random submissions"""
+    from datetime import datetime, timedelta, timezone
+
+    base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    db.session.execute(Issue.__table__.insert(), [
+        {'title': f'Issue {index}', 'available_date': base + timedelta(days=7 * index)}
+        for index in range(ISSUE_COUNT)
+    ])
+    db.session.execute(Puzzle.__table__.insert(), [
+        {'title': f'Puzzle {index}', 'description': 'd', 'answer_hash': 'x', 'issue_id': index % ISSUE_COUNT + 1}
+        for index in range(PUZZLE_COUNT)
+    ])
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'user{index:06d}', 'email': f'user{index:06d}@example.com', 'password_hash': 'x', 'is_admin': False}
+        for index in range(USER_COUNT)
+    ])
+    db.session.commit()
+
+    rng = np.random.default_rng(0)
+    for start in range(0, count, SEED_BATCH_SIZE):
+        size = min(SEED_BATCH_SIZE, count - start)
+        puzzle_ids = rng.integers(1, PUZZLE_COUNT + 1, size)
+        issue_offsets = ((puzzle_ids - 1) % ISSUE_COUNT) * 7 * 86400
+        seconds = issue_offsets + rng.exponential(36 * 3600, size).astype(np.int64)
+        batch = [
+            {
+                'user_id': int(user_id),
+                'puzzle_id': int(puzzle_id),
+                'submitted_answer': 'a',
+                'is_correct': bool(correct),
+                'submitted_at': (base + timedelta(seconds=int(offset))).replace(tzinfo=None),
+            }
+            for user_id, puzzle_id, correct, offset in zip(
+                rng.integers(1, USER_COUNT + 1, size), puzzle_ids, rng.random(size) < 0.3, seconds
+            )
+        ]
+        db.session.execute(Submission.__table__.insert(), batch)
+        db.session.commit()
+
+
+def run(rows, db_path, reseed):
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+
+    from app import create_app, db
+    from app.analytics import (
+        compute_issue_analytics,
+        first_solves,
+        grouped_percentiles,
+        load_release_times,
+        solves_per_hour,
+        submission_arrays,
+        time_to_first_solve,
+    )
+    from app.models import Issue, Puzzle, Submission, User
+
+    app = create_app()
+
+    with app.app_context():
+        if reseed:
+            db.create_all()
+            print(f"🌱 Seeding {rows:,} submissions into {db_path}...")
+            started = time.perf_counter()
+            seed(db, Issue, Puzzle, User, Submission, rows)
+            print(f"   seeded in {time.perf_counter() - started:.1f}s")
+
+        print("📊 Cold load of the submission arrays...")
+        started = time.perf_counter()
+        submission_arrays.invalidate()
+        arrays = submission_arrays.get()
+        print(f"   {len(arrays.user_id):,} submissions in {time.perf_counter() - started:.2f}s")
+
+        print("📈 Computing analytics for all puzzles (warm cache)...")
+        started = time.perf_counter()
+        report = compute_issue_analytics()
+        print(f"   first solves:       {report['solve_count']:,}")
+        print(f"   median / p90:       {report['p50_hours']:.1f}h / {report['p90_hours']:.1f}h")
+        print(f"   total time:         {time.perf_counter() - started:.2f}s")
+
+        started = time.perf_counter()
+        solves = first_solves(arrays)
+        release_ids, released_at = load_release_times()
+        _, elapsed = time_to_first_solve(solves, release_ids, released_at)
+        grouped_percentiles(solves.puzzle_id, elapsed, (0.5, 0.9))
+        solves_per_hour(elapsed)
+        print(f"   array work only:    {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the vectorized solve analytics.')
+    parser.add_argument('--rows', type=int, default=1000000, help='number of submissions to seed')
+    parser.add_argument('--db', help='SQLite file to use (default: a temporary file); reused if it exists')
+    args = parser.parse_args()
+
+    if args.db:
+        path = os.path.abspath(args.db)
+        run(args.rows, path, reseed=not os.path.exists(path))
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run(args.rows, os.path.join(tmp_dir, 'bench.db'), reseed=True)
@@ -0,0 +1,99 @@
+"""
+Benchmark for rendering new-issue notifications.
+
+Seeds a throwaway SQLite database with one issue and N opted-in users,
+then times rendering the notification once per recipient with
+render_template against rendering it once into an EmailSkeleton and
+filling in each recipient, and checks both produce identical HTML.
+
+Usage:
+    python benchmarks/email_render.py --recipients 50000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SEED_BATCH_SIZE = 50000
+PUZZLE_COUNT = 12
+
+
+def seed(db, Issue, Puzzle, User, count):
+    """Insert one released issue with its puzzles and count opted-in users"""
+    from datetime import datetime, timezone
+
+    issue = Issue(
+        title='Benchmark Issue',
+        description='Puzzles <& "quotes"> for the render benchmark',
+        available_date=datetime.now(timezone.utc),
+    )
+    db.session.add(issue)
+    db.session.flush()
+    db.session.execute(Puzzle.__table__.insert(), [
+        {'title': f'Puzzle {index}', 'description': 'd', 'answer_hash': 'x', 'issue_id': issue.id}
+        for index in range(PUZZLE_COUNT)
+    ])
+    for start in range(0, count, SEED_BATCH_SIZE):
+        db.session.execute(User.__table__.insert(), [
+            {
+                'username': f'user{index:07d}',
+                'email': f'user{index:07d}@example.com',
+                # Every third name needs escaping
+                'display_name': f'User <{index}> & co' if index % 3 == 0 else None,
+                'password_hash': 'x',
+                'email_notifications': True,
+                'notify_new_issues': True,
+            }
+            for index in range(start, min(start + SEED_BATCH_SIZE, count))
+        ])
+    db.session.commit()
+    return issue.id
+
+
+def run(count, db_path):
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+
+    from flask import render_template
+    from app import create_app, db
+    from app.email import recipient_slots, render_skeleton
+    from app.models import Issue, Puzzle, User
+
+    app = create_app()
+    app.config['SERVER_NAME'] = 'puzzles.example.com'
+
+    with app.app_context():
+        db.create_all()
+        print(f"🌱 Seeding {count:,} recipients into {db_path}...")
+        issue = db.session.get(Issue, seed(db, Issue, Puzzle, User, count))
+        users = db.session.query(User.email, User.display_name, User.username).all()
+
+        print("🐢 render_template per recipient...")
+        started = time.perf_counter()
+        per_recipient = [
+            render_template('email/new_issue.html', recipient=recipient_slots(user), issue=issue)
+            for user in users
+        ]
+        per_recipient_seconds = time.perf_counter() - started
+        print(f"   {per_recipient_seconds:.2f}s ({per_recipient_seconds / count * 1e6:.0f}µs per recipient)")
+
+        print("⚡ Render once, fill per recipient...")
+        started = time.perf_counter()
+        skeleton = render_skeleton('email/new_issue.html', issue=issue)
+        filled = [skeleton.fill(recipient_slots(user)) for user in users]
+        skeleton_seconds = time.perf_counter() - started
+        print(f"   {skeleton_seconds:.2f}s ({skeleton_seconds / count * 1e6:.1f}µs per recipient)")
+
+        assert filled == per_recipient, 'skeleton output differs from render_template'
+        print(f"   identical output, {per_recipient_seconds / skeleton_seconds:.0f}x faster")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark rendering new-issue notifications.')
+    parser.add_argument('--recipients', type=int, default=50000, help='number of recipients to seed')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        run(args.recipients, os.path.join(tmp_dir, 'bench.db'))
@@ -0,0 +1,293 @@
+"""
+Benchmark harness for notification fan-out.
+
+Seeds a throwaway SQLite database with N subscribed users (all of whom have
+attempted one puzzle, so hint fan-outs reach them too), starts an
+in-process SMTP sink or the mock SendGrid endpoint from sendgrid_batch.py,
+then triggers a new-issue and/or new-hint fan-out exactly as the scheduler
+does and lets the app's own sender pool, started as a worker process starts
+it, deliver it. Nothing leaves the machine.
+
+For each fan-out it reports the time to queue, messages per second
+delivered, end-to-end latency from trigger to arrival (first, p50, p95,
+last), and the peak thread count (the sink's connection threads included)
+and RSS of the process while it ran, so dispatcher changes can be compared
+run against run.
+
+Usage:
+    python benchmarks/notification_fanout.py --recipients 10000
+    python benchmarks/notification_fanout.py --recipients 100000 --provider sendgrid
+    python benchmarks/notification_fanout.py --recipients 10000 --fanout hint --workers 8 --rate 200
+"""
+import argparse
+import os
+import resource
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sendgrid_batch import API_KEY, MockSendGrid  # noqa: E402
+
+SEED_BATCH_SIZE = 50000
+SAMPLE_SECONDS = 0.05
+
+
+class SMTPSink:
+    """Threaded SMTP server that accepts everything and notes when it arrived."""
+
+    def __init__(self):
+        self.arrivals = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def _reply(self, line):
+                self.wfile.write(line.encode() + b'\r\n')
+
+            def handle(self):
+                with sink._lock:
+                    sink.connections += 1
+                self._reply('220 sink ready')
+                recipients = 0
+                while line := self.rfile.readline():
+                    command = line.decode('ascii', 'replace').strip().upper()
+                    if command.startswith('RCPT'):
+                        recipients += 1
+                        self._reply('250 ok')
+                    elif command == 'DATA':
+                        self._reply('354 end with <CRLF>.<CRLF>')
+                        while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                            pass
+                        with sink._lock:
+                            sink.arrivals.append((time.monotonic(), recipients))
+                        recipients = 0
+                        self._reply('250 queued')
+                    elif command.startswith('RSET'):
+                        recipients = 0
+                        self._reply('250 ok')
+                    elif command == 'QUIT':
+                        self._reply('221 bye')
+                        return
+                    else:
+                        self._reply('250 ok')
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # No procfs: fall back to the lifetime peak (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Monitor:
+    """Samples the process's thread count and RSS until stopped."""
+
+    def __init__(self):
+        self.baseline_threads = threading.active_count()
+        self.baseline_rss = _rss_bytes()
+        self.peak_threads = self.baseline_threads
+        self.peak_rss = self.baseline_rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(SAMPLE_SECONDS):
+            # Don't count the monitor itself
+            self.peak_threads = max(self.peak_threads, threading.active_count() - 1)
+            self.peak_rss = max(self.peak_rss, _rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def seed(db, Issue, Puzzle, Hint, Submission, User, count):
+    """Insert an issue, a puzzle with a hint, and count users who attempted it"""
+    from datetime import date, datetime, timedelta, timezone
+
+    # Released outside the scheduler's look-back windows, so only the
+    # benchmark triggers these fan-outs
+    issue = Issue(
+        title='Benchmark Issue',
+        description='Puzzles for the fan-out benchmark',
+        available_date=datetime.now(timezone.utc) - timedelta(hours=1),
+    )
+    puzzle = Puzzle(title='Benchmark Puzzle', description='d', answer_hash='x', issue=issue)
+    hint = Hint(puzzle=puzzle, hint_text='Try harder', unlock_date=date.today() - timedelta(days=2))
+    db.session.add_all([issue, puzzle, hint])
+    db.session.flush()
+
+    for start in range(0, count, SEED_BATCH_SIZE):
+        end = min(start + SEED_BATCH_SIZE, count)
+        db.session.execute(User.__table__.insert(), [
+            {
+                'id': index + 1,
+                'username': f'user{index:07d}',
+                'email': f'user{index:07d}@example.com',
+                'display_name': f'User {index}' if index % 2 else None,
+                'password_hash': 'x',
+                'email_notifications': True,
+                'notify_new_issues': True,
+                'notify_new_hints': True,
+            }
+            for index in range(start, end)
+        ])
+        db.session.execute(Submission.__table__.insert(), [
+            {'user_id': index + 1, 'puzzle_id': puzzle.id, 'submitted_answer': 'guess', 'is_correct': False}
+            for index in range(start, end)
+        ])
+    db.session.commit()
+    return issue.id, hint.id
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def wait_for_outbox(db, EmailOutbox, timeout):
+    """Block until nothing is pending or sending, or timeout passes"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        db.session.rollback()
+        if not EmailOutbox.query.filter(EmailOutbox.status.in_(('pending', 'sending'))).count():
+            return True
+        time.sleep(SAMPLE_SECONDS)
+    return False
+
+
+def measure(name, trigger, arrivals, db, EmailOutbox, timeout):
+    """Run one fan-out and print its throughput, latency and resource use"""
+    already_arrived = len(arrivals())
+    with Monitor() as monitor:
+        started = time.monotonic()
+        queued = trigger()
+        queued_seconds = time.monotonic() - started
+        drained = wait_for_outbox(db, EmailOutbox, timeout)
+
+    # One arrival per message; a batched API request counts once per recipient
+    latencies = sorted(
+        arrived_at - started
+        for arrived_at, recipients in arrivals()[already_arrived:]
+        for _ in range(recipients)
+    )
+    dead = EmailOutbox.query.filter_by(status='dead').count()
+
+    print(f"📊 {name} fan-out to {queued:,} recipients")
+    print(f"   queued in {queued_seconds:.2f}s")
+    if latencies:
+        seconds = latencies[-1]
+        print(f"   delivered {len(latencies):,} messages in {seconds:.2f}s ({len(latencies) / seconds:,.0f} msg/s)")
+        print(
+            f"   latency: first {latencies[0]:.2f}s, p50 {_percentile(latencies, 0.5):.2f}s, "
+            f"p95 {_percentile(latencies, 0.95):.2f}s, last {seconds:.2f}s"
+        )
+    print(
+        f"   peak threads {monitor.peak_threads} (+{monitor.peak_threads - monitor.baseline_threads}), "
+        f"peak RSS {monitor.peak_rss / 2**20:.1f} MB (+{(monitor.peak_rss - monitor.baseline_rss) / 2**20:.1f} MB)"
+    )
+    if not drained:
+        print(f"   ⚠️  outbox still had mail after {timeout}s")
+    if dead:
+        print(f"   ⚠️  {dead:,} dead letters")
+
+
+def run(args, db_path):
+    if args.provider == 'sendgrid':
+        server = MockSendGrid().start()
+        arrivals = lambda: server.arrivals  # noqa: E731
+    else:
+        server = SMTPSink().start()
+        arrivals = lambda: server.arrivals  # noqa: E731
+
+    # The app reads its mail settings from the environment at startup
+    os.environ.update(
+        DATABASE_URL=f'sqlite:///{db_path}',
+        MAIL_PROVIDER=args.provider,
+        MAIL_SERVER='127.0.0.1',
+        MAIL_PORT=str(getattr(server, 'port', 25)),
+        MAIL_USE_TLS='false',
+        MAIL_USERNAME='',
+        MAIL_DEFAULT_SENDER='puzzles@example.com',
+        SENDGRID_API_KEY=API_KEY,
+        SENDGRID_API_URL=getattr(server, 'url', ''),
+        EMAIL_WORKERS=str(args.workers),
+        SMTP_SEND_RATE_PER_SECOND=str(args.rate),
+        SENDGRID_SEND_RATE_PER_SECOND=str(args.rate),
+    )
+    from app import create_app, db
+    from app.email import email_dispatcher, notify_all_users_new_issue, notify_users_new_hint
+    from app.models import EmailOutbox, Hint, Issue, Puzzle, Submission, User
+
+    app = create_app()
+    app.config['SERVER_NAME'] = 'puzzles.example.com'
+
+    with app.app_context():
+        db.create_all()
+        print(f"🌱 Seeding {args.recipients:,} subscribers into {db_path}...")
+        issue_id, hint_id = seed(db, Issue, Puzzle, Hint, Submission, User, args.recipients)
+        print(f"   sending via {args.provider} with {args.workers} sender threads, rate limit {args.rate or 'none'}")
+        # The sender pool a worker process would run
+        email_dispatcher.start()
+
+        def _issue_fanout():
+            count = notify_all_users_new_issue(db.session.get(Issue, issue_id))
+            db.session.commit()
+            return count
+
+        def _hint_fanout():
+            hint = db.session.get(Hint, hint_id)
+            count = notify_users_new_hint(hint.puzzle, hint)
+            db.session.commit()
+            return count
+
+        fanouts = {'issue': _issue_fanout, 'hint': _hint_fanout}
+        for name in ('issue', 'hint') if args.fanout == 'both' else (args.fanout,):
+            measure(name, fanouts[name], arrivals, db, EmailOutbox, args.timeout)
+
+        email_dispatcher.stop()
+        if args.provider == 'smtp':
+            print(f"   {server.connections} SMTP connections opened in total")
+        else:
+            print(f"   {len(server.requests):,} SendGrid API requests in total")
+    server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark notification fan-out against a local sink.')
+    parser.add_argument('--recipients', type=int, default=10000, help='number of subscribers to seed')
+    parser.add_argument('--provider', choices=('smtp', 'sendgrid'), default='smtp', help='transport to deliver with')
+    parser.add_argument('--fanout', choices=('issue', 'hint', 'both'), default='both', help='which notification to send')
+    parser.add_argument('--workers', type=int, default=4, help='EMAIL_WORKERS sender threads')
+    parser.add_argument('--rate', type=float, default=0, help='sends per second limit (0 for none)')
+    parser.add_argument('--timeout', type=int, default=1800, help='seconds to wait for each fan-out to drain')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        run(args, os.path.join(tmp_dir, 'bench.db'))
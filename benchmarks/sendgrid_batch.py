@@ -0,0 +1,238 @@
+"""
+Benchmark and mock server for batched SendGrid delivery.
+
+MockSendGrid is a local stand-in for the v3 mail send endpoint: it checks
+each request the way the API does (bearer key, at most 1000
+personalizations, a sender, subject and content), records it, and can
+fail the next N requests with a 500 or reject any request that includes
+one of a set of addresses with a 400. Point SENDGRID_API_URL at
+mock.url to send to it instead of SendGrid.
+
+Run directly, the benchmark seeds a throwaway SQLite database with N
+opted-in users, queues a new-issue notification for all of them and drains
+the outbox through the sender pool against the mock, then reports API
+calls, time taken and dead letters, and checks every recipient's
+substituted body matches the HTML stored for them.
+
+Usage:
+    python benchmarks/sendgrid_batch.py --recipients 20000
+    python benchmarks/sendgrid_batch.py --recipients 20000 --fail-requests 3 --reject-every 5000
+    python benchmarks/sendgrid_batch.py --serve 8025
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SEED_BATCH_SIZE = 50000
+API_KEY = 'SG.benchmark'
+
+
+class MockSendGrid:
+    """Threaded HTTP server that accepts SendGrid v3 mail send requests."""
+
+    def __init__(self, port=0, api_key=API_KEY, fail_requests=0, reject=()):
+        self.api_key = api_key
+        self.fail_requests = fail_requests
+        self.reject = set(reject)
+        self.requests = []
+        # (time accepted, recipients) per accepted request
+        self.arrivals = []
+        self.failures = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.port = self.server.server_address[1]
+        self.url = f'http://127.0.0.1:{self.port}/v3/mail/send'
+        self.thread = None
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, errors=None):
+                body = json.dumps({'errors': errors}).encode() if errors else b''
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                payload = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path != '/v3/mail/send':
+                    return self._reply(404, [{'message': 'not found'}])
+                if self.headers.get('Authorization') != f'Bearer {mock.api_key}':
+                    return self._reply(401, [{'message': 'authorization required'}])
+                status, errors = mock.handle(json.loads(payload))
+                self._reply(status, errors)
+
+        return Handler
+
+    def handle(self, message):
+        """(status, errors) for one request, recording the ones accepted"""
+        personalizations = message.get('personalizations') or []
+        if not 1 <= len(personalizations) <= 1000:
+            return 400, [{'message': 'personalizations must hold 1 to 1000 items', 'field': 'personalizations'}]
+        if not message.get('from') or not message.get('subject') or not message.get('content'):
+            return 400, [{'message': 'from, subject and content are required'}]
+        with self._lock:
+            if self.failures < self.fail_requests:
+                self.failures += 1
+                return 500, [{'message': 'internal error'}]
+            rejected = [
+                recipient['email']
+                for personalization in personalizations
+                for recipient in personalization['to']
+                if recipient['email'] in self.reject
+            ]
+            if rejected:
+                return 400, [{'message': f'invalid email address {rejected[0]}', 'field': 'personalizations.to'}]
+            self.requests.append(message)
+            self.arrivals.append((time.monotonic(), sum(len(p['to']) for p in personalizations)))
+        return 202, None
+
+    def delivered(self):
+        """{address: body after substitutions} for every accepted recipient"""
+        bodies = {}
+        for message in self.requests:
+            content = message['content'][0]['value']
+            for personalization in message['personalizations']:
+                body = content
+                for tag, value in (personalization.get('substitutions') or {}).items():
+                    body = body.replace(tag, value)
+                for recipient in personalization['to']:
+                    bodies[recipient['email']] = body
+        return bodies
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def seed(db, Issue, User, count):
+    """Insert one released issue and count opted-in users"""
+    from datetime import datetime, timedelta, timezone
+
+    # Released before the scheduler's look-back window, so it doesn't notify too
+    issue = Issue(
+        title='Benchmark Issue',
+        description='d',
+        available_date=datetime.now(timezone.utc) - timedelta(hours=1),
+    )
+    db.session.add(issue)
+    for start in range(0, count, SEED_BATCH_SIZE):
+        db.session.execute(User.__table__.insert(), [
+            {
+                'username': f'user{index:07d}',
+                'email': f'user{index:07d}@example.com',
+                # Every third name needs escaping
+                'display_name': f'User <{index}> & co' if index % 3 == 0 else None,
+                'password_hash': 'x',
+                'email_notifications': True,
+                'notify_new_issues': True,
+            }
+            for index in range(start, min(start + SEED_BATCH_SIZE, count))
+        ])
+    db.session.commit()
+    return issue
+
+
+def wait_for_outbox(db, EmailOutbox, timeout):
+    """Block until nothing is pending or sending, or timeout passes"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        db.session.rollback()
+        if not EmailOutbox.query.filter(EmailOutbox.status.in_(('pending', 'sending'))).count():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def run(count, db_path, fail_requests, reject_every):
+    reject = [f'user{index:07d}@example.com' for index in range(0, count, reject_every)] if reject_every else []
+    mock = MockSendGrid(fail_requests=fail_requests, reject=reject).start()
+
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    from app import create_app, db
+    from app.email import email_dispatcher, notify_all_users_new_issue
+    from app.models import EmailOutbox, Issue, User
+
+    app = create_app()
+    app.config.update(
+        SERVER_NAME='puzzles.example.com',
+        MAIL_PROVIDER='sendgrid',
+        MAIL_DEFAULT_SENDER='puzzles@example.com',
+        SENDGRID_API_KEY=API_KEY,
+        SENDGRID_API_URL=mock.url,
+        # The mock has no rate limit, and failed requests retry at once
+        SENDGRID_SEND_RATE_PER_SECOND=0,
+        EMAIL_RETRY_BASE_SECONDS=0,
+        EMAIL_POLL_SECONDS=1,
+    )
+
+    with app.app_context():
+        db.create_all()
+        print(f"🌱 Seeding {count:,} recipients into {db_path}...")
+        issue = seed(db, Issue, User, count)
+
+        print(f"📨 Sending through the mock at {mock.url}...")
+        # The sender pool a worker process would run
+        email_dispatcher.start()
+        started = time.perf_counter()
+        notify_all_users_new_issue(issue)
+        # Committing wakes the sender pool
+        db.session.commit()
+        assert wait_for_outbox(db, EmailOutbox, timeout=300), 'outbox did not drain'
+        seconds = time.perf_counter() - started
+        email_dispatcher.stop()
+
+        api_calls = len(mock.requests) + mock.failures
+        dead = EmailOutbox.query.filter_by(status='dead').count()
+        print(f"   {seconds:.2f}s, {api_calls:,} API calls ({len(mock.requests):,} accepted) for {count:,} recipients")
+        print(f"   {dead:,} dead letters (expected {len(reject):,})")
+
+        delivered = mock.delivered()
+        expected = dict(
+            (json.loads(recipients)[0], html)
+            for recipients, html in db.session.query(EmailOutbox.recipients, EmailOutbox.html)
+            .filter(EmailOutbox.status == 'sent')
+        )
+        assert delivered == expected, 'substituted bodies differ from the stored HTML'
+        assert dead == len(reject), 'unexpected dead letters'
+        print("   every recipient's body matches its stored HTML")
+    mock.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark batched SendGrid delivery against a local mock.')
+    parser.add_argument('--recipients', type=int, default=20000, help='number of recipients to seed')
+    parser.add_argument('--fail-requests', type=int, default=0, help='answer the first N requests with a 500')
+    parser.add_argument('--reject-every', type=int, default=0, help='reject every Nth address with a 400')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='only run the mock server on PORT')
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        mock = MockSendGrid(port=args.serve, fail_requests=args.fail_requests)
+        print(f"Mock SendGrid listening on {mock.url} (API key {API_KEY})")
+        try:
+            mock.server.serve_forever()
+        except KeyboardInterrupt:
+            mock.stop()
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run(args.recipients, os.path.join(tmp_dir, 'bench.db'), args.fail_requests, args.reject_every)
@@ -38,4 +38,11 @@ tmp_upload_dir = None
 
 # SSL (if using HTTPS directly with Gunicorn)
 # keyfile = '/path/to/keyfile'
-# certfile = '/path/to/certfile'
\ No newline at end of file
+# certfile = '/path/to/certfile'
+
+
+# Worker hooks
+def post_worker_init(worker):
+    # Build the leaderboard index as the worker starts, not in its first /leaderboard request
+    from app.leaderboard import leaderboard
+    leaderboard.warm()
@@ -7,7 +7,10 @@ import sys
 from flask import Flask
 from sqlalchemy import inspect, text
 from app import create_app, db
-from app.models import User, Issue, Puzzle, Submission, Hint, PuzzleAnswerRule
+from app.models import User, Issue, Puzzle, Submission, Hint, PuzzleAnswerRule, PuzzleStats, UserStats, PuzzleRating, UserRating, EmailOutbox
+from app.stats import rebuild_stats
+from app.ratings import refit_ratings
+from app.pdf_store import adopt_existing_pdfs
 
 
 def _ensure_column_exists(table_name, column_name, ddl_fragment):
@@ -15,15 +18,25 @@ def _ensure_column_exists(table_name, column_name, ddl_fragment):
     columns = [col['name'] for col in inspector.get_columns(table_name)]
     if column_name in columns:
         return
-    db.session.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {ddl_fragment}"))
+    quoted_table = db.engine.dialect.identifier_preparer.quote(table_name)
+    db.session.execute(text(f"ALTER TABLE {quoted_table} ADD COLUMN {column_name} {ddl_fragment}"))
     db.session.commit()
     print(f"✓ Added column: {table_name}.{column_name}")
 
+def _ensure_index_exists(table, index_name):
+    inspector = inspect(db.engine)
+    if index_name in {index['name'] for index in inspector.get_indexes(table.name)}:
+        return
+    next(index for index in table.indexes if index.name == index_name).create(db.engine)
+    print(f"✓ Added index: {index_name}")
+
 def create_database():
     """Create all database tables."""
     app = create_app()
     
     with app.app_context():
+        tables_before = inspect(db.engine).get_table_names()
+
         # Create all tables
         db.create_all()
         print("✓ Database tables created successfully")
@@ -31,12 +44,29 @@ def create_database():
         # Ensure schema updates for existing databases
         _ensure_column_exists('puzzle', 'correct_response', 'TEXT')
         _ensure_column_exists('puzzle', 'incorrect_response', 'TEXT')
+        _ensure_column_exists('email_outbox', 'batch_id', 'INTEGER REFERENCES email_batch(id)')
+        _ensure_column_exists('email_outbox', 'substitutions', 'TEXT')
+        _ensure_column_exists('user', 'digest_frequency', "VARCHAR(10) NOT NULL DEFAULT 'immediate'")
+        _ensure_column_exists('report_export', 'heartbeat_at', 'TIMESTAMP')
+        _ensure_column_exists('email_outbox', 'priority', "VARCHAR(20) NOT NULL DEFAULT 'bulk'")
+        _ensure_column_exists('email_outbox', 'queue_seconds', 'FLOAT')
+        _ensure_index_exists(EmailOutbox.__table__, 'ix_email_outbox_lane_due')
 
         inspector = inspect(db.engine)
         tables = inspector.get_table_names()
         if 'puzzle_answer_rule' not in tables:
             PuzzleAnswerRule.__table__.create(db.engine)
             print('✓ Created table: puzzle_answer_rule')
+
+        # Backfill the reporting stats tables the first time they appear
+        stats_tables = (PuzzleStats.__tablename__, UserStats.__tablename__)
+        if any(name not in tables_before for name in stats_tables):
+            rebuild_reporting_stats()
+
+        # Fit the difficulty ratings the first time their tables appear
+        rating_tables = (PuzzleRating.__tablename__, UserRating.__tablename__)
+        if any(name not in tables_before for name in rating_tables):
+            refit_difficulty_ratings()
         
         # Create default admin user if it doesn't exist
         admin_email = os.environ.get('PUZZLE_SITE_ADMIN', 'admin@example.com')
@@ -57,6 +87,21 @@ def create_database():
         else:
             print(f"✓ Admin user already exists: {admin_email}")
 
+def rebuild_reporting_stats():
+    """Recompute puzzle_stats and user_stats from all submissions."""
+    puzzle_rows, user_rows = rebuild_stats()
+    print(f"✓ Rebuilt reporting stats: {puzzle_rows} puzzles, {user_rows} users")
+
+def refit_difficulty_ratings():
+    """Refit puzzle_rating and user_rating from all submissions."""
+    puzzle_rows, user_rows, iterations = refit_ratings()
+    print(f"✓ Refit difficulty ratings: {puzzle_rows} puzzles, {user_rows} users ({iterations} iterations)")
+
+def store_issue_pdfs():
+    """Move the PDFs issues name into the content-addressed store, merging duplicates."""
+    files, fields = adopt_existing_pdfs()
+    print(f"✓ Stored issue PDFs: {fields} issue fields now use {files} stored files")
+
 def backup_database():
     """Create a backup of the existing database."""
     if os.path.exists('instance/puzzle_site.db'):
@@ -72,4 +117,20 @@ if __name__ == '__main__':
         backup_database()
     
     create_database()
+
+    if '--rebuild-stats' in sys.argv[1:]:
+        app = create_app()
+        with app.app_context():
+            rebuild_reporting_stats()
+
+    if '--store-pdfs' in sys.argv[1:]:
+        app = create_app()
+        with app.app_context():
+            store_issue_pdfs()
+
+    if '--refit-ratings' in sys.argv[1:]:
+        app = create_app()
+        with app.app_context():
+            refit_difficulty_ratings()
+
     print("✓ Database setup complete!")
\ No newline at end of file
@@ -1,6 +1,13 @@
+import os
+
 from app import create_app
+from app.worker import start_background_work
 
 app = create_app()
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # The development server does the background work itself (in the
+    # reloader's serving process); production runs worker.py for it
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_work()
+    app.run(debug=True)
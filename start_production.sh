@@ -39,6 +39,12 @@ python migrations.py
 # Create logs directory
 mkdir -p logs
 
+# Start the background worker (email, release announcements, exports)
+echo "⚙️  Starting background worker..."
+python worker.py &
+WORKER_PID=$!
+trap 'kill $WORKER_PID 2>/dev/null' EXIT
+
 # Start the application with Gunicorn
 echo "🌐 Starting Gunicorn server..."
 echo "📍 Application will be available at http://0.0.0.0:${PORT:-8000}"
@@ -0,0 +1,27 @@
+"""
+Background worker entry point for production deployment.
+
+Sends email, announces releases, builds report exports and runs the other
+recurring jobs, so the web processes (wsgi.py) don't. Run one or more:
+    python worker.py
+"""
+import os
+from app import create_app
+from app.worker import run_worker
+
+# Get the configuration environment
+config_name = os.environ.get('FLASK_ENV', 'production')
+
+# Create the Flask application
+app = create_app()
+
+# Validate production configuration
+if config_name == 'production':
+    required_vars = ['SECRET_KEY', 'DATABASE_URL']
+    missing_vars = [var for var in required_vars if not os.environ.get(var)]
+
+    if missing_vars:
+        raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
+
+if __name__ == "__main__":
+    run_worker(app)